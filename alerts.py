@@ -0,0 +1,304 @@
+"""
+Intraday push alerts for important news.
+
+The alert worker polls the distinct set of subscribed tickers, not users: every tick it takes
+the ALERT_BATCH_SIZE most overdue tickers, so the whole set is covered in rotating batches.
+Popular tickers are polled more often (ALERT_MAX_INTERVAL_SECONDS / sqrt(subscribers), at least
+ALERT_MIN_INTERVAL_SECONDS apart). Fetched items are diffed against a persisted seen-set per
+ticker, and only new, recent and important items (by the local score of scoring.py) are pushed,
+at once, to the subscribers of their ticker. The cost of a tick grows with the polled tickers and their new items; the
+subscribers are only looked up for tickers that have something to push.
+
+A pushed story is only marked as seen once every subscriber got it: if its summary or a send fails
+it stays new, and the next poll pushes it to those who have not received it (recorded in
+alert_deliveries, which also keeps the story out of their next digest). Users who blocked the bot
+are skipped until they return.
+
+Fetches go through the news store and summaries through the summary cache, so the digest
+reuses what the alert worker already fetched and summarized.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database as db
+import metrics
+from config import (
+    ALERT_BATCH_SIZE, ALERT_MIN_INTERVAL_SECONDS, ALERT_MAX_INTERVAL_SECONDS, ALERT_MAX_AGE_SECONDS,
+    ALERT_MIN_SCORE, DIGEST_FETCH_CONCURRENCY, NEWS_RETENTION_DAYS, TELEGRAM_RATE_LIMIT,
+    TELEGRAM_PER_CHAT_INTERVAL
+)
+from dedup import story_deduplicator
+from delivery import DeliveryScheduler, PRIORITY_HIGH, FAILURE_PERMANENT, FAILURE_TIMED_OUT
+from llm_processor import get_batch_summaries_async
+from news_store import get_ticker_news
+from scoring import score_items, format_score
+import sentiment
+
+# Maximum number of items pushed to one user in one tick
+MAX_ALERTS_PER_USER = 5
+
+# How long the subscriber counts that set the poll intervals are reused
+SUBSCRIBER_COUNTS_TTL_SECONDS = 600
+
+ALERT_EVENTS = metrics.counter(
+    'alert_events_total', 'Alert worker events (polled, new, important, pushed)', ('event',)
+)
+ALERT_PUSH_SECONDS = metrics.histogram('alert_push_seconds', 'Time to summarize and send the alerts of a tick')
+
+
+def important_items(news_items, min_score=ALERT_MIN_SCORE):
+    """
+    Default importance check of the alert worker: keeps the items whose local score is at least min_score.
+    The items are scored together, so a story is judged against the other news of the same poll.
+    :param news_items: list of news items with 'title' and 'ticker'
+    :return: the important items, with their 'score' and 'category'
+    """
+    return [
+        dict(news_item, score=score, category=category)
+        for news_item, (score, category) in zip(news_items, score_items(news_items))
+        if score >= min_score
+    ]
+
+
+def poll_interval(subscribers, min_interval=ALERT_MIN_INTERVAL_SECONDS, max_interval=ALERT_MAX_INTERVAL_SECONDS):
+    """
+    Returns how often a ticker with the given number of subscribers is polled, in seconds.
+    """
+    return max(min_interval, max_interval / math.sqrt(max(subscribers, 1)))
+
+
+def format_alert(ticker_items, results):
+    """
+    Builds the alert message of one user.
+    :param ticker_items: list of (ticker, news item)
+    :param results: dict link -> (summary, from_cache, degraded) in the user's language
+    """
+    parts = []
+    for ticker, news_item in ticker_items:
+        summary, _, _ = results.get(news_item['link'], (None, False, False))
+        parts.append(
+            f"🔔 *{ticker}*: *{news_item['title']}*\n"
+            + (f"{format_score(news_item)}\n" if 'score' in news_item else '')
+            + (f"{summary}\n" if summary else '')
+            + f"[Источник]({news_item['link']})"
+        )
+    return '\n\n'.join(parts)
+
+
+class AlertWorker:
+    """
+    Polls due tickers and pushes their important new items to the subscribers.
+    :param bot: telegram.Bot used for sending
+    :param importance_check: callable list of new items -> the items worth pushing
+    """
+
+    def __init__(self, bot, batch_size=ALERT_BATCH_SIZE, max_age_seconds=ALERT_MAX_AGE_SECONDS,
+                 importance_check=important_items):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.max_age_seconds = max_age_seconds
+        self.importance_check = importance_check
+        self._subscriber_counts = {}
+        self._counts_loaded_at = 0.0
+
+    def subscriber_counts(self, now):
+        if now - self._counts_loaded_at >= SUBSCRIBER_COUNTS_TTL_SECONDS:
+            self._subscriber_counts = db.get_ticker_subscriber_counts()
+            self._counts_loaded_at = now
+        return self._subscriber_counts
+
+    def due_tickers(self, now):
+        """
+        Returns up to batch_size tickers whose poll is due, the most overdue first.
+        Tickers never polled before come first.
+        :return: list of (ticker, first_poll)
+        """
+        state = db.get_alert_poll_state()
+        due = [
+            (state.get(ticker, 0.0), ticker) for ticker in self.subscriber_counts(now)
+            if state.get(ticker, 0.0) <= now
+        ]
+        due.sort()
+        return [(ticker, ticker not in state) for _, ticker in due[:self.batch_size]]
+
+    def poll(self, tickers, now):
+        """
+        Fetches the due tickers and diffs their items against the seen-set.
+        On the first poll of a ticker its current items are only marked as seen, like the new items
+        that are too old or not important; the items to push are marked by push() once delivered.
+        :param tickers: list of (ticker, first_poll)
+        :return: dict ticker -> list of new items to push, each with the 'links' of its story
+        """
+        with ThreadPoolExecutor(max_workers=DIGEST_FETCH_CONCURRENCY, thread_name_prefix='alert-fetch') as executor:
+            fetched = list(executor.map(
+                lambda ticker: get_ticker_news(ticker, ttl_seconds=ALERT_MIN_INTERVAL_SECONDS)[0],
+                (ticker for ticker, _ in tickers)
+            ))
+        canonical = story_deduplicator.canonicalize(news_item for items in fetched for news_item in items)
+
+        candidates = []
+        seen_entries = []
+        for (ticker, first_poll), items in zip(tickers, fetched):
+            stories = {}
+            for news_item in items:
+                story = canonical.get(news_item['link'], news_item['link'])
+                stories.setdefault(story, dict(news_item, link=story, links=set()))['links'].add(news_item['link'])
+            new_links = set(stories) - db.get_seen_alert_links(ticker, stories)
+            ALERT_EVENTS.inc(len(new_links), event='new')
+            for link in new_links:
+                if first_poll or (stories[link]['published'] or 0) < now - self.max_age_seconds:
+                    seen_entries.append((ticker, link, now))
+                else:
+                    candidates.append(dict(stories[link], ticker=ticker))
+
+        pending = {}
+        for news_item in self.importance_check(candidates) if candidates else []:
+            pending.setdefault(news_item['ticker'], []).append(news_item)
+        to_push = {(ticker, news_item['link']) for ticker, items in pending.items() for news_item in items}
+        seen_entries.extend(
+            (news_item['ticker'], news_item['link'], now) for news_item in candidates
+            if (news_item['ticker'], news_item['link']) not in to_push
+        )
+        for items in pending.values():
+            items.sort(key=lambda news_item: news_item['published'] or 0, reverse=True)
+
+        counts = self.subscriber_counts(now)
+        db.add_seen_alert_links(seen_entries)
+        db.save_alert_poll_state((ticker, now + poll_interval(counts.get(ticker, 1)), now) for ticker, _ in tickers)
+        ALERT_EVENTS.inc(len(tickers), event='polled')
+        return pending
+
+    @ALERT_PUSH_SECONDS.time()
+    async def push(self, pending, stats, now=None):
+        """
+        Sends the pending items of every ticker to its subscribers, one message per user, skipping
+        the stories a user already got. The stories are marked as seen unless some subscriber is
+        still owed them: a send that failed, an alert held back because its summary failed, or
+        items beyond MAX_ALERTS_PER_USER.
+        """
+        now = now or time.time()
+        recipients = {}
+        for ticker, subscribers in db.get_ticker_subscribers(pending).items():
+            for chat_id, language in subscribers:
+                recipients.setdefault(chat_id, (language, []))[1].extend(
+                    (ticker, news_item) for news_item in pending[ticker]
+                )
+
+        pushed = db.get_alert_deliveries(recipients)
+        owed = set()
+        messages = {}
+        for chat_id, (language, ticker_items) in recipients.items():
+            # A story reported for several of the user's tickers is pushed once
+            unique = {}
+            for ticker, news_item in ticker_items:
+                if news_item['link'] not in pushed.get(chat_id, ()):
+                    unique.setdefault(news_item['link'], (ticker, news_item))
+            unique = list(unique.values())
+            owed.update((ticker, news_item['link']) for ticker, news_item in unique[MAX_ALERTS_PER_USER:])
+            if unique:
+                messages[chat_id] = (language, unique[:MAX_ALERTS_PER_USER])
+
+        by_language = {}
+        for language, ticker_items in messages.values():
+            for _, news_item in ticker_items:
+                by_language.setdefault(language, {})[news_item['link']] = news_item
+        results = {}
+        for language, news_items in by_language.items():
+            try:
+                results[language], _ = await get_batch_summaries_async(list(news_items.values()), language)
+            except Exception as e:
+                logging.error(f"Error summarizing alerts ({language}), they are pushed on a later tick: {e}")
+                stats['errors'] += 1
+                for chat_id in [chat_id for chat_id, (other, _) in messages.items() if other == language]:
+                    owed.update((ticker, news_item['link']) for ticker, news_item in messages.pop(chat_id)[1])
+        try:
+            for language_results in results.values():
+                sentiment.record_summaries(
+                    ((ticker, news_item) for ticker, items in pending.items() for news_item in items), language_results
+                )
+        except Exception as e:
+            logging.error(f"Error recording the sentiment of alerts: {e}")
+
+        def callbacks(ticker_items):
+            # A message that timed out counts as delivered, as in the digest
+            def delivered(chat_id):
+                db.record_alert_deliveries(
+                    (chat_id, link, time.time()) for _, news_item in ticker_items
+                    for link in {news_item['link'], *news_item.get('links', ())}
+                )
+
+            def failed(chat_id, kind):
+                if kind == FAILURE_TIMED_OUT:
+                    return delivered(chat_id)
+                if kind == FAILURE_PERMANENT:
+                    logging.warning(f"User {chat_id} does not accept messages, skipping them until they return.")
+                    stats['users_blocked'] += 1
+                    db.block_users([chat_id], time.time())
+                else:
+                    owed.update((ticker, news_item['link']) for ticker, news_item in ticker_items)
+            return delivered, failed
+
+        scheduler = DeliveryScheduler(self.bot, rate=TELEGRAM_RATE_LIMIT, per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL)
+        scheduler.start()
+        for chat_id, (language, ticker_items) in messages.items():
+            on_delivered, on_failed = callbacks(ticker_items)
+            scheduler.submit(
+                chat_id, format_alert(ticker_items, results.get(language, {})), priority=PRIORITY_HIGH,
+                on_delivered=on_delivered, on_failed=on_failed
+            )
+        await scheduler.close()
+        db.add_seen_alert_links(
+            (ticker, news_item['link'], now) for ticker, items in pending.items() for news_item in items
+            if (ticker, news_item['link']) not in owed
+        )
+        stats['users_alerted'] += scheduler.stats['sent']
+        stats['errors'] += scheduler.stats['failed']
+        ALERT_EVENTS.inc(scheduler.stats['sent'], event='pushed')
+
+    async def tick(self, now=None):
+        """
+        Runs one polling round.
+        :return: dict with the statistics of the round
+        """
+        now = now or time.time()
+        stats = {'tickers_polled': 0, 'important_items': 0, 'users_alerted': 0, 'users_blocked': 0, 'errors': 0}
+        tickers = self.due_tickers(now)
+        if not tickers:
+            return stats
+        pending = await asyncio.to_thread(self.poll, tickers, now)
+        stats['tickers_polled'] = len(tickers)
+        stats['important_items'] = sum(len(items) for items in pending.values())
+        ALERT_EVENTS.inc(stats['important_items'], event='important')
+        if pending:
+            await self.push(pending, stats, now)
+        logging.info(
+            f"Alert tick: {stats['tickers_polled']} tickers polled, {stats['important_items']} important items, "
+            f"{stats['users_alerted']} users alerted, {stats['errors']} errors."
+        )
+        return stats
+
+    def prune(self):
+        """
+        Forgets seen stories older than the news retention and tickers nobody follows anymore.
+        """
+        return db.prune_alert_state(NEWS_RETENTION_DAYS * 24 * 3600)
+
+    async def run_forever(self, tick_seconds):
+        """
+        Runs a polling round every tick_seconds, and the pruning once a day.
+        """
+        pruned_at = 0.0
+        while True:
+            started = time.monotonic()
+            try:
+                await self.tick()
+                if time.time() - pruned_at > 24 * 3600:
+                    self.prune()
+                    pruned_at = time.time()
+            except Exception as e:
+                logging.error(f"Error in alert tick: {e}")
+            await asyncio.sleep(max(0.0, tick_seconds - (time.monotonic() - started)))
@@ -3,14 +3,21 @@ Flask web application for the interactive part of the bot (command handling).
 This file needs to be configured as a "Web App" on PythonAnywhere.
 """
 import telegram
-from flask import Flask, request
+from flask import Flask, Response, request
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
-from config import TELEGRAM_BOT_TOKEN
+import config
+import metrics
+from update_processor import UpdateProcessor, UPDATE_QUEUE_DEPTH
 import database as db
 import data_source as ds
+import delivery_schedule
 import logging
 import asyncio
+import hmac
+import math
+import time
+from datetime import datetime
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -18,6 +25,15 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 # Create Flask application
 app = Flask(__name__)
 
+WEBHOOK_REQUESTS = metrics.counter('webhook_requests_total', 'Webhook requests by response status', ('status',))
+WEBHOOK_SECONDS = metrics.histogram('webhook_request_seconds', 'Time to answer a webhook request')
+NEWS_COMMAND_ANSWERS = metrics.counter(
+    'news_command_answers_total', '/news answers by snapshot state (fresh, stale, miss)', ('state',)
+)
+
+# Largest number of news per ticker a user can ask for with /topk
+MAX_TOP_K = 10
+
 
 # Asynchronous functions to handle commands
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -46,6 +62,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         '/add <TICKER> – Add a ticker to track (e.g., /add TSLA)\n'
         '/remove <TICKER> – Remove a ticker from the list (e.g., /remove GOOG)\n'
         '/list – Show the list of tracked tickers\n'
+        '/schedule [HH:MM] [TIME_ZONE] [daily|weekdays|twice_daily] – Show or set when the digest arrives '
+        '(e.g., /schedule 07:30 Europe/Berlin weekdays)\n'
+        f'/topk [N] [TICKER] – Show or set how many of the most important news per ticker you get '
+        f'(1-{MAX_TOP_K}, e.g., /topk 5 or /topk 1 TSLA)\n'
+        '/news <TICKER> – Show the latest analyzed news of a ticker (e.g., /news NVDA)\n'
+        '/sentiment <TICKER> – Show the news sentiment and its momentum for a ticker (e.g., /sentiment AAPL)\n'
+        '/alert <TICKER> above|below <PRICE> – Get notified when the price crosses a level (e.g., /alert TSLA above 300)\n'
+        '/alert <TICKER> <PERCENT>% – Get notified when the price moves by a percentage in a day (e.g., /alert TSLA 5%)\n'
+        '/alert remove <ID> – Remove a price alert\n'
+        '/alerts – Show your price alerts\n'
         '/help – Show this message'
         )
     except Exception as e:
@@ -64,12 +90,15 @@ async def add_ticker(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
         ticker = context.args[0].upper()
 
-        # Validate ticker
-        if not ds.validate_ticker(ticker):
-            await update.message.reply_text(f"Ticker '{ticker}' not found or invalid. Please check the spelling.")
+        # Validate ticker (served from the local registry when possible)
+        if not await asyncio.to_thread(ds.validate_ticker, ticker):
+            suggestions = ds.suggest_tickers(ticker)
+            hint = f" Did you mean: {', '.join(suggestions)}?" if suggestions else " Please check the spelling."
+            await update.message.reply_text(f"Ticker '{ticker}' not found or invalid.{hint}")
             return
 
-        if db.add_or_update_user(chat_id, ticker):
+        db.ensure_user(chat_id)
+        if db.add_ticker_for_user(chat_id, ticker):
             await update.message.reply_text(f"Ticker {ticker} has been successfully added!")
         else:
             await update.message.reply_text(f"Ticker {ticker} is already in your list.")
@@ -110,30 +139,303 @@ async def list_tickers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         logging.error(f"Error in /list for {chat_id}: {e}")
 
 
-# Create the python-telegram-bot Application
-application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-# Add command handlers
-application.add_handler(CommandHandler('start', start))
-application.add_handler(CommandHandler('help', help_command))
-application.add_handler(CommandHandler('add', add_ticker))
-application.add_handler(CommandHandler('remove', remove_ticker))
-application.add_handler(CommandHandler('list', list_tickers))
+async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /schedule command: shows or changes the delivery time, time zone and frequency.
+    Any of the three can be given, in any order; the others are kept.
+    """
+    chat_id = update.effective_chat.id
+    usage = 'Usage: /schedule [HH:MM] [TIME_ZONE] [daily|weekdays|twice_daily]'
+    try:
+        db.ensure_user(chat_id)
+        schedule = db.get_user_schedule(chat_id)
+        for arg in context.args or []:
+            if ':' in arg:
+                schedule['delivery_time'] = arg
+            elif arg.lower() in delivery_schedule.FREQUENCIES:
+                schedule['frequency'] = arg.lower()
+            elif arg.isdigit():
+                # e.g. '8': a time without minutes, not a time zone
+                await update.message.reply_text(f"Invalid delivery time '{arg}', expected HH:MM. {usage}")
+                return
+            else:
+                try:
+                    delivery_schedule.get_timezone(arg)
+                except ValueError as e:
+                    await update.message.reply_text(f"{e}. {usage}")
+                    return
+                schedule['timezone'] = arg
+
+        try:
+            next_due_at = delivery_schedule.next_due_at(
+                time.time(), schedule['timezone'], schedule['delivery_time'], schedule['frequency'], chat_id
+            )
+        except ValueError as e:
+            await update.message.reply_text(f"{e}. {usage}")
+            return
+
+        if context.args:
+            schedule['delivery_time'] = delivery_schedule.parse_delivery_time(schedule['delivery_time']).strftime('%H:%M')
+            db.set_user_schedule(
+                chat_id, schedule['timezone'], schedule['delivery_time'], schedule['frequency'], next_due_at
+            )
+        elif schedule['next_due_at']:
+            next_due_at = schedule['next_due_at']
+        next_local = datetime.fromtimestamp(next_due_at, delivery_schedule.get_timezone(schedule['timezone']))
+        await update.message.reply_text(
+            f"Your digest: {delivery_schedule.describe(schedule)}.\n"
+            f"Next digest around {next_local:%Y-%m-%d %H:%M} ({schedule['timezone']})."
+        )
+    except Exception as e:
+        logging.error(f"Error in /schedule for {chat_id}: {e}")
+
+
+async def top_k_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /topk command: shows or sets how many of the best scored news per ticker the user gets,
+    for all their tickers or, with a ticker, for that one only.
+    """
+    chat_id = update.effective_chat.id
+    usage = f"Usage: /topk [N] [TICKER], with N from 1 to {MAX_TOP_K}"
+    try:
+        db.ensure_user(chat_id)
+        if not context.args:
+            top_k = db.get_user_top_k(chat_id) or config.DIGEST_TOP_K
+            await update.message.reply_text(f"You get the {top_k} most important news per ticker. {usage}")
+            return
+        try:
+            top_k = int(context.args[0])
+        except ValueError:
+            top_k = 0
+        if not 1 <= top_k <= MAX_TOP_K:
+            await update.message.reply_text(usage)
+            return
+
+        if len(context.args) > 1:
+            ticker = context.args[1].upper()
+            if db.set_subscription_top_k(chat_id, ticker, top_k):
+                await update.message.reply_text(f"You will get the {top_k} most important news of {ticker}.")
+            else:
+                await update.message.reply_text(f"Ticker {ticker} was not found in your list.")
+        else:
+            db.set_user_top_k(chat_id, top_k)
+            await update.message.reply_text(f"You will get the {top_k} most important news per ticker.")
+    except Exception as e:
+        logging.error(f"Error in /topk for {chat_id}: {e}")
+
+
+async def sentiment_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /sentiment command: shows the sentiment signals of a ticker.
+    """
+    # Imported on first use: sentiment pulls in numpy and the LLM client module
+    import sentiment
+    chat_id = update.effective_chat.id
+    try:
+        if not context.args:
+            await update.message.reply_text('Please specify a ticker. Usage: /sentiment <TICKER>')
+            return
+        ticker = context.args[0].upper()
+        signal = (await asyncio.to_thread(sentiment.get_signals, [ticker])).get(ticker)
+        if not signal:
+            await update.message.reply_text(f"No recent analyzed news for {ticker}.")
+            return
+        baseline = f"{signal['baseline']:+.2f}" if signal['baseline'] is not None else 'n/a'
+        momentum = f"{signal['momentum']:+.2f}" if signal['momentum'] is not None else 'n/a'
+        await update.message.reply_text(
+            f"{sentiment.format_signal(ticker, signal)}\n"
+            f"Last {config.SENTIMENT_SHORT_DAYS} days vs. {config.SENTIMENT_LONG_DAYS}-day baseline {baseline}, "
+            f"momentum {momentum}, based on {signal['observations']} news."
+            + ("\nThe sentiment has reversed." if signal['reversal'] else '')
+        )
+    except Exception as e:
+        logging.error(f"Error in /sentiment for {chat_id}: {e}")
+
+
+async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /news command: answers from the pre-rendered news of the ticker (see ticker_news)
+    and never waits on yfinance or the LLM. A stale answer is refreshed in the background; on a miss
+    the refresh is queued and its result sent to the user when it is ready.
+    """
+    chat_id = update.effective_chat.id
+    try:
+        if not context.args:
+            await update.message.reply_text('Please specify a ticker. Usage: /news <TICKER>')
+            return
+        ticker = context.args[0].upper()
+        language = db.get_user_language(chat_id) or 'ru'
+        now = time.time()
+        snapshot = db.get_ticker_news_snapshot(ticker, language)
+        if snapshot:
+            message, built_at = snapshot
+            age_minutes = int((now - built_at) // 60)
+            if now - built_at >= config.TICKER_NEWS_MAX_AGE_SECONDS:
+                db.request_ticker_news(ticker, language, chat_id, False, now)
+                NEWS_COMMAND_ANSWERS.inc(state='stale')
+            else:
+                NEWS_COMMAND_ANSWERS.inc(state='fresh')
+            await update.message.reply_text(f"{message}\n_Updated {age_minutes} min ago._", parse_mode='Markdown')
+            return
+
+        # Only the local registry is asked: an unknown ticker is checked by the refresh itself
+        if ds.ticker_registry.lookup(ticker) is False:
+            await update.message.reply_text(f"Ticker '{ticker}' not found or invalid.")
+            return
+        db.request_ticker_news(ticker, language, chat_id, True, now)
+        NEWS_COMMAND_ANSWERS.inc(state='miss')
+        await update.message.reply_text(f"Collecting the latest news of {ticker}, I will send them in a moment.")
+    except Exception as e:
+        logging.error(f"Error in /news for {chat_id}: {e}")
+
+
+def parse_price_alert(args):
+    """
+    Parses the arguments of /alert: TICKER above|below PRICE, or TICKER PERCENT%.
+    :return: (ticker, direction, level)
+    :raises ValueError: if the arguments are invalid
+    """
+    if len(args) == 3 and args[1].lower() in ('above', 'below'):
+        direction, level = args[1].lower(), float(args[2])
+    elif len(args) == 2 and args[1].endswith('%'):
+        direction, level = 'move', float(args[1].rstrip('%'))
+    else:
+        raise ValueError('invalid arguments')
+    if not math.isfinite(level) or level <= 0:
+        raise ValueError('the level must be a positive number')
+    return args[0].upper(), direction, level
+
+
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /alert command: creates or removes a price alert.
+    """
+    # Imported on first use, like in /sentiment: price_alerts pulls in numpy
+    import price_alerts
+    chat_id = update.effective_chat.id
+    usage = 'Usage: /alert <TICKER> above|below <PRICE>, /alert <TICKER> <PERCENT>% or /alert remove <ID>'
+    try:
+        args = context.args or []
+        if len(args) == 2 and args[0].lower() == 'remove':
+            if args[1].isdigit() and db.remove_price_alert(chat_id, int(args[1])):
+                await update.message.reply_text(f"Price alert {args[1]} has been removed.")
+            else:
+                await update.message.reply_text(f"Price alert {args[1]} was not found. See /alerts.")
+            return
+        try:
+            ticker, direction, level = parse_price_alert(args)
+        except ValueError:
+            await update.message.reply_text(usage)
+            return
+
+        if len(db.get_user_price_alerts(chat_id)) >= config.MAX_PRICE_ALERTS_PER_USER:
+            await update.message.reply_text(
+                f"You already have {config.MAX_PRICE_ALERTS_PER_USER} price alerts. Remove one first (see /alerts)."
+            )
+            return
+        if not await asyncio.to_thread(ds.validate_ticker, ticker):
+            await update.message.reply_text(f"Ticker '{ticker}' not found or invalid.")
+            return
+        db.ensure_user(chat_id)
+        alert_id = db.add_price_alert(chat_id, ticker, direction, level)
+        await update.message.reply_text(
+            f"Price alert {alert_id} set: {ticker} {price_alerts.describe(direction, level)}."
+        )
+    except Exception as e:
+        logging.error(f"Error in /alert for {chat_id}: {e}")
+
+
+async def list_price_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /alerts command.
+    """
+    import price_alerts
+    chat_id = update.effective_chat.id
+    try:
+        alerts = db.get_user_price_alerts(chat_id)
+        if not alerts:
+            await update.message.reply_text("You don't have any price alerts yet. Add one using /alert.")
+            return
+        await update.message.reply_text('Your price alerts:\n' + '\n'.join(
+            f"{alert['id']}. {alert['ticker']} {price_alerts.describe(alert['direction'], alert['level'])}"
+            + ('' if alert['armed'] else ' (triggered, waiting for the price to move back)')
+            for alert in alerts
+        ))
+    except Exception as e:
+        logging.error(f"Error in /alerts for {chat_id}: {e}")
+
+
+# Command handlers of the bot
+HANDLERS = [
+    CommandHandler('start', start),
+    CommandHandler('help', help_command),
+    CommandHandler('add', add_ticker),
+    CommandHandler('remove', remove_ticker),
+    CommandHandler('list', list_tickers),
+    CommandHandler('schedule', schedule_command),
+    CommandHandler('topk', top_k_command),
+    CommandHandler('news', news_command),
+    CommandHandler('sentiment', sentiment_command),
+    CommandHandler('alert', alert_command),
+    CommandHandler('alerts', list_price_alerts),
+]
+
+
+def build_application():
+    """
+    Creates the python-telegram-bot Application with the command handlers.
+    Called on the first webhook request, not at import, to keep worker start-up fast.
+    """
+    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+    application.add_handlers(HANDLERS)
+    return application
+
+
+# Updates are handled on the processor's own event loop, started on the first webhook call
+update_processor = UpdateProcessor(build_application)
 
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """
     Endpoint for the Telegram webhook, compatible with PTB v21+.
+    The update is only queued here, so Telegram gets its answer at once. If the queue
+    is full the webhook answers 503 and Telegram delivers the update again later.
+    """
+    with WEBHOOK_SECONDS.time():
+        try:
+            update = Update.de_json(request.get_json(force=True), update_processor.application.bot)
+            if not update_processor.submit(update):
+                logging.warning(f"Update queue is full, rejecting update {update.update_id}.")
+                WEBHOOK_REQUESTS.inc(status=503)
+                return 'busy', 503
+            WEBHOOK_REQUESTS.inc(status=200)
+            return 'ok'
+        except Exception as e:
+            logging.error(f"Error processing webhook: {e}")
+            WEBHOOK_REQUESTS.inc(status=500)
+            return 'error', 500
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Metrics of this process and of the latest digest run in Prometheus text format.
+    Only served to requests with the header 'Authorization: Bearer <METRICS_TOKEN>'.
     """
+    if not config.METRICS_TOKEN:
+        return 'not found', 404
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), config.METRICS_TOKEN.encode()):
+        return 'forbidden', 403
+    UPDATE_QUEUE_DEPTH.set(update_processor.pending)
     try:
-        update = Update.de_json(request.get_json(force=True), application.bot)
-        # Create a task to process the update asynchronously,
-        # so we don't block the webhook response.
-        asyncio.create_task(application.process_update(update))
-        return 'ok'
+        summary = db.get_last_run_summary('digest')
+        if summary:
+            metrics.export_run_summary('digest', summary)
     except Exception as e:
-        logging.error(f"Error processing webhook: {e}")
-        return 'error', 500
+        logging.error(f"Error loading the last digest run summary: {e}")
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
@@ -0,0 +1,216 @@
+"""
+Article processing stage: gives the LLM a few key sentences of the article instead of the headline alone.
+
+The article body is downloaded and extracted with BeautifulSoup, reduced to ARTICLE_SENTENCES
+sentences with sumy's extractive LexRank or LSA summarizer and cached in SQLite, so every
+article is downloaded and condensed only once. Only the condensed text goes into the prompt.
+BeautifulSoup and sumy (which loads NLTK) are imported on first use.
+"""
+
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import database as db
+from config import (
+    ARTICLE_CONTEXT_ENABLED, ARTICLE_SENTENCES, ARTICLE_SUMMARIZER, ARTICLE_FETCH_TIMEOUT,
+    ARTICLE_CACHE_TTL_SECONDS, DIGEST_FETCH_CONCURRENCY
+)
+
+# Articles are almost always in English, whatever the language of the digest
+ARTICLE_LANGUAGE = 'english'
+
+# Extracted text is cut to this length before condensing (long pages are mostly boilerplate)
+MAX_ARTICLE_CHARS = 20000
+
+# Paragraphs shorter than this are navigation, captions or bylines
+MIN_PARAGRAPH_CHARS = 40
+
+# Extractive summarizers supported by condense()
+SUMMARIZERS = ('lexrank', 'lsa')
+
+REQUEST_HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; financial-news-bot/1.0)'}
+
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"“])')
+WORD_PATTERN = re.compile(r"[\w'’$%.-]+")
+
+
+class RegexTokenizer:
+    """
+    Fallback tokenizer for sumy when the NLTK punkt data is not installed.
+    """
+    language = ARTICLE_LANGUAGE
+
+    def to_sentences(self, paragraph):
+        return tuple(sentence.strip() for sentence in SENTENCE_PATTERN.split(paragraph) if sentence.strip())
+
+    def to_words(self, sentence):
+        return tuple(word.strip('.') for word in WORD_PATTERN.findall(sentence) if word.strip('.'))
+
+
+def _make_tokenizer():
+    from sumy.nlp.tokenizers import Tokenizer
+    try:
+        tokenizer = Tokenizer(ARTICLE_LANGUAGE)
+        tokenizer.to_sentences('Check. Check.')
+        return tokenizer
+    except LookupError:
+        logging.warning("NLTK punkt data not found, using a regex sentence tokenizer for articles.")
+        return RegexTokenizer()
+
+
+def extract_text(html):
+    """
+    Extracts the readable text of an article page: the paragraphs of <article> if the page has one,
+    otherwise of the whole page, without scripts, navigation and page chrome.
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'lxml')
+    for tag in soup(['script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside', 'form']):
+        tag.decompose()
+    root = soup.find('article') or soup.body or soup
+    paragraphs = (paragraph.get_text(' ', strip=True) for paragraph in root.find_all('p'))
+    text = '\n'.join(paragraph for paragraph in paragraphs if len(paragraph) >= MIN_PARAGRAPH_CHARS)
+    return text[:MAX_ARTICLE_CHARS]
+
+
+class ArticleProcessor:
+    """
+    Downloads, extracts and condenses articles, with a SQLite cache of the results.
+    """
+
+    def __init__(self, sentences=ARTICLE_SENTENCES, method=ARTICLE_SUMMARIZER,
+                 timeout=ARTICLE_FETCH_TIMEOUT, ttl_seconds=ARTICLE_CACHE_TTL_SECONDS,
+                 max_workers=DIGEST_FETCH_CONCURRENCY):
+        if method not in SUMMARIZERS:
+            raise ValueError(f"Unknown article summarizer '{method}', expected one of {', '.join(SUMMARIZERS)}")
+        self.sentences = sentences
+        self.method = method
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+        self.max_workers = max_workers
+        self._tokenizer = None
+        self._summarizer = None
+        self._lock = threading.Lock()
+        self.stats = {'articles_fetched': 0, 'articles_failed': 0, 'article_chars': 0, 'condensed_chars': 0}
+
+    def _get_summarizer(self):
+        with self._lock:
+            if self._summarizer is None:
+                from sumy.nlp.stemmers import Stemmer
+                from sumy.utils import get_stop_words
+                if self.method == 'lsa':
+                    from sumy.summarizers.lsa import LsaSummarizer as Summarizer
+                else:
+                    from sumy.summarizers.lex_rank import LexRankSummarizer as Summarizer
+                self._tokenizer = _make_tokenizer()
+                summarizer = Summarizer(Stemmer(ARTICLE_LANGUAGE))
+                summarizer.stop_words = get_stop_words(ARTICLE_LANGUAGE)
+                self._summarizer = summarizer
+            return self._tokenizer, self._summarizer
+
+    def condense(self, text):
+        """
+        Reduces a text to at most self.sentences sentences, kept in their original order.
+        """
+        if not text:
+            return ''
+        from sumy.parsers.plaintext import PlaintextParser
+        tokenizer, summarizer = self._get_summarizer()
+        parser = PlaintextParser.from_string(text, tokenizer)
+        if len(parser.document.sentences) <= self.sentences:
+            return ' '.join(str(sentence) for sentence in parser.document.sentences)
+        return ' '.join(str(sentence) for sentence in summarizer(parser.document, self.sentences))
+
+    def fetch_text(self, url):
+        """
+        Downloads an article and extracts its text.
+        :return: the text, or '' if the page could not be downloaded or has no readable text
+        """
+        try:
+            response = requests.get(url, headers=REQUEST_HEADERS, timeout=self.timeout)
+            response.raise_for_status()
+            return extract_text(response.text)
+        except Exception as e:
+            logging.warning(f"Could not fetch article {url}: {e}")
+            return ''
+
+    def _process(self, link):
+        text = self.fetch_text(link)
+        condensed = self.condense(text)
+        with self._lock:
+            if text:
+                self.stats['articles_fetched'] += 1
+                self.stats['article_chars'] += len(text)
+                self.stats['condensed_chars'] += len(condensed)
+            else:
+                self.stats['articles_failed'] += 1
+        return link, text, condensed, self.method, self.sentences, time.time()
+
+    def get_contexts(self, news_items):
+        """
+        Returns the condensed article text of every news item, downloading only uncached articles.
+        :return: dict link -> condensed text (items without a readable article are left out)
+        """
+        links = list(dict.fromkeys(news_item['link'] for news_item in news_items))
+        if not links:
+            return {}
+        try:
+            cached = db.get_article_texts(links, self.ttl_seconds)
+        except Exception as e:
+            logging.error(f"Error loading cached articles: {e}")
+            cached = {}
+
+        contexts = {}
+        updated = []
+        missing = []
+        for link in links:
+            entry = cached.get(link)
+            if entry is None:
+                missing.append(link)
+            elif entry['method'] == self.method and entry['sentence_count'] == self.sentences:
+                contexts[link] = entry['condensed']
+            else:
+                # Condensed with other settings: reuse the extracted text, condense it again
+                condensed = self.condense(entry['text'])
+                contexts[link] = condensed
+                updated.append((link, entry['text'], condensed, self.method, self.sentences, time.time()))
+
+        if missing:
+            logging.info(f"Fetching {len(missing)} articles.")
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='article-fetch') as executor:
+                for entry in executor.map(self._process, missing):
+                    contexts[entry[0]] = entry[2]
+                    updated.append(entry)
+
+        try:
+            db.save_article_texts(updated)
+        except Exception as e:
+            logging.error(f"Error caching articles: {e}")
+        return {link: condensed for link, condensed in contexts.items() if condensed}
+
+    def prune(self):
+        """
+        Removes cached articles older than the cache TTL.
+        """
+        deleted = db.prune_article_texts(self.ttl_seconds)
+        if deleted:
+            logging.info(f"Pruned {deleted} cached articles.")
+        return deleted
+
+
+# Shared processor used by the LLM stage
+article_processor = ArticleProcessor()
+
+
+def get_article_contexts(news_items):
+    """
+    Returns dict link -> condensed article text, or an empty dict if article context is disabled.
+    """
+    if not ARTICLE_CONTEXT_ENABLED:
+        return {}
+    return article_processor.get_contexts(news_items)
@@ -0,0 +1,4 @@
+"""
+Local benchmarks and fake backends. Run them from the project root, e.g.:
+    python -m benchmarks.delivery_throughput
+"""
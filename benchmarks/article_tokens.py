@@ -0,0 +1,117 @@
+"""
+Measures the prompt size saved by sending condensed article text instead of the full article.
+
+A local HTTP server serves synthetic article pages; each article is downloaded, extracted and
+condensed by the ArticleProcessor. Then the batch prompt is built from the headline plus the full
+text and from the headline plus the condensed text. Tokens are estimated at 4 characters each
+(pass --count-tokens with a real GOOGLE_API_KEY to count them with the Gemini API instead).
+
+Usage:
+    python -m benchmarks.article_tokens --articles 20 --sentences 3
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import database as db
+from article import ArticleProcessor, extract_text
+from llm_processor import build_batch_prompt
+
+WORDS = (
+    'revenue guidance quarter growth margin analysts shares investors demand supply outlook '
+    'earnings forecast cloud chips buyback dividend market regulators expansion costs'
+).split()
+
+
+def make_article(index, paragraphs=12):
+    rng = random.Random(index)
+    body = ''.join(
+        '<p>' + ' '.join(
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(12, 24))).capitalize() + '.'
+            for _ in range(rng.randint(3, 5))
+        ) + '</p>'
+        for _ in range(paragraphs)
+    )
+    return (
+        f"<html><head><script>var tracking = {index};</script></head><body>"
+        f"<nav><p>Markets Tech Economy Opinion Video Newsletters Subscribe Sign in</p></nav>"
+        f"<article><h1>Company {index} reports results</h1>{body}</article>"
+        f"<footer><p>Copyright 2026 Example Media. All rights reserved. Terms and privacy.</p></footer>"
+        f"</body></html>"
+    )
+
+
+class ArticleHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = make_article(int(self.path.rsplit('/', 1)[-1])).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def count_tokens(prompt, use_api):
+    if use_api:
+        from llm_processor import get_model
+        return get_model().count_tokens(prompt).total_tokens
+    return len(prompt) // 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--articles', type=int, default=20)
+    parser.add_argument('--sentences', type=int, default=3)
+    parser.add_argument('--method', default='lexrank', choices=['lexrank', 'lsa'])
+    parser.add_argument('--count-tokens', action='store_true', help='count tokens with the Gemini API')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ArticleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db.DATABASE_NAME = os.path.join(workdir, 'bench.db')
+        db.init_db()
+        processor = ArticleProcessor(sentences=args.sentences, method=args.method)
+        items = [
+            {'title': f"Company {i} reports results", 'link': f"{base_url}/article/{i}"}
+            for i in range(args.articles)
+        ]
+
+        started = time.perf_counter()
+        contexts = processor.get_contexts(items)
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        processor.get_contexts(items)
+        warm = time.perf_counter() - started
+
+        titles = [item['title'] for item in items]
+        full_texts = [extract_text(make_article(i)).replace('\n', ' ') for i in range(args.articles)]
+        prompts = {
+            'headlines only': build_batch_prompt(titles, 'en'),
+            'full article': build_batch_prompt(titles, 'en', full_texts),
+            'condensed article': build_batch_prompt(titles, 'en', [contexts.get(item['link']) for item in items]),
+        }
+        server.shutdown()
+        db.close_db_connection()
+
+    print(f"{args.articles} articles, {args.method} to {args.sentences} sentences")
+    print(f"fetch + extract + condense: {cold:.2f}s cold, {warm * 1000:.1f}ms from the cache")
+    print(f"article text: {processor.stats['article_chars']} chars condensed to {processor.stats['condensed_chars']}")
+    full_tokens = count_tokens(prompts['full article'], args.count_tokens)
+    for label, prompt in prompts.items():
+        tokens = count_tokens(prompt, args.count_tokens)
+        print(f"{label:<20} {tokens:>8} prompt tokens ({tokens / full_tokens:.0%} of the full article prompt)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of the SQLite data layer: operations per second of the old access
+pattern (a new connection per call, SELECT-then-INSERT, one lookup per query) against
+the current one (per-thread WAL connection, INSERT OR IGNORE, executemany and bulk lookups).
+
+Usage:
+    python -m benchmarks.db_ops --ops 5000
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+
+import database as db
+
+
+def _timed(label, ops, func):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<45} {ops / elapsed:>12,.0f} ops/s")
+    return ops / elapsed
+
+
+def _legacy_connection(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def run_legacy(path, subscriptions, cache_keys):
+    def subscribe():
+        for chat_id, ticker in subscriptions:
+            with _legacy_connection(path) as conn:
+                exists = conn.execute(
+                    'SELECT 1 FROM user_tickers WHERE chat_id = ? AND ticker = ?', (chat_id, ticker)
+                ).fetchone()
+                if not exists:
+                    conn.execute('INSERT INTO user_tickers (chat_id, ticker) VALUES (?, ?)', (chat_id, ticker))
+                    conn.commit()
+
+    def lookup():
+        for key in cache_keys:
+            with _legacy_connection(path) as conn:
+                conn.execute('SELECT processed_summary FROM news_cache WHERE cache_key = ?', (key,)).fetchone()
+
+    return (
+        _timed('before: subscribe (connect + SELECT + INSERT)', len(subscriptions), subscribe),
+        _timed('before: cache lookup (connect per key)', len(cache_keys), lookup),
+    )
+
+
+def run_current(subscriptions, cache_keys):
+    def subscribe_single():
+        for chat_id, ticker in subscriptions:
+            db.add_ticker_for_user(chat_id, ticker)
+
+    def subscribe_bulk():
+        db.add_subscriptions(subscriptions)
+
+    def lookup_single():
+        for key in cache_keys:
+            db.get_summary_from_cache(key, 3600)
+
+    def lookup_bulk():
+        db.get_summaries_from_cache(cache_keys, 3600)
+
+    with db.get_db_connection() as conn:
+        conn.execute('DELETE FROM user_tickers')
+    single = _timed('after: subscribe (INSERT OR IGNORE)', len(subscriptions), subscribe_single)
+    with db.get_db_connection() as conn:
+        conn.execute('DELETE FROM user_tickers')
+    bulk = _timed('after: subscribe (executemany)', len(subscriptions), subscribe_bulk)
+    lookup = _timed('after: cache lookup (pooled connection)', len(cache_keys), lookup_single)
+    lookup_many = _timed('after: cache lookup (bulk IN query)', len(cache_keys), lookup_bulk)
+    return single, bulk, lookup, lookup_many
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=5000)
+    args = parser.parse_args()
+
+    subscriptions = [(i % 1000, f"T{i % 300}") for i in range(args.ops)]
+    cache_keys = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(args.ops)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db.DATABASE_NAME = os.path.join(workdir, 'bench.db')
+        db.init_db()
+        db.add_summaries_to_cache((key, 'summary', 'en', 'model', '1') for key in cache_keys[::2])
+
+        print(f"{args.ops} operations per case, database in {workdir}")
+        before = run_legacy(db.DATABASE_NAME, subscriptions, cache_keys)
+        after = run_current(subscriptions, cache_keys)
+        print(f"Subscribe speed-up: {after[0] / before[0]:.1f}x single, {after[1] / before[0]:.1f}x bulk")
+        print(f"Cache lookup speed-up: {after[2] / before[1]:.1f}x single, {after[3] / before[1]:.1f}x bulk")
+        db.close_db_connection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Measures the sustained throughput of the DeliveryScheduler against a FakeBot.
+
+Usage:
+    python -m benchmarks.delivery_throughput --messages 600 --chats 300 --rate 30
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.fakes import FakeBot
+from delivery import DeliveryScheduler, PRIORITY_HIGH, PRIORITY_NORMAL
+
+
+async def run(messages, chats, rate, workers, latency, length):
+    bot = FakeBot(latency=latency, server_rate=rate)
+    scheduler = DeliveryScheduler(bot, rate=rate, workers=workers)
+    scheduler.start()
+
+    text = '\n'.join(f"\n--- 📈 *T{i}* ---\n*Headline {i}*\nSummary text." for i in range(length // 40 + 1))
+    started = time.monotonic()
+    for i in range(messages):
+        priority = PRIORITY_HIGH if i % 10 == 0 else PRIORITY_NORMAL
+        scheduler.submit(i % chats, text, priority=priority)
+    await scheduler.close()
+    elapsed = time.monotonic() - started
+
+    print(f"Messages submitted: {messages} to {chats} chats (text length {len(text)})")
+    print(f"Messages delivered: {scheduler.stats['sent']} in {elapsed:.2f}s")
+    print(f"Sustained throughput: {scheduler.stats['sent'] / elapsed:.1f} msg/s (limit {rate} msg/s)")
+    print(f"Split messages: {scheduler.stats['split_messages']}, "
+          f"flood waits: {scheduler.stats['flood_waits']}, failed: {scheduler.stats['failed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=600)
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=30)
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake send latency in seconds.')
+    parser.add_argument('--length', type=int, default=1000, help='Approximate digest length in characters.')
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.chats, args.rate, args.workers, args.latency, args.length))
+
+
+if __name__ == '__main__':
+    main()
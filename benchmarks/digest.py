@@ -0,0 +1,240 @@
+"""
+Offline benchmark of the whole digest run (send_daily_digest) at scale.
+
+A temporary database is filled with synthetic users and subscriptions (ticker popularity
+follows a Zipf distribution, like real watchlists), and yfinance, Gemini and Telegram are
+replaced by the stand-ins of benchmarks.fakes with configurable latency and error rates.
+The report shows the wall time, peak memory, the duration of every stage and the calls made
+to each backend. The results are saved as JSON; --compare prints the change against an
+earlier result, so a regression in the digest path shows up as a number.
+
+Only the yfinance source is used, article downloads are off and the client-side Telegram and
+LLM quota limits are raised, so the numbers measure the pipeline rather than the network or the
+limits (see delivery_throughput for those). Settings can be overridden with the usual
+environment variables. The users are streamed in chunks of --chunk-size: with a fixed chunk
+size the peak memory should stay flat as --users grows.
+
+Usage:
+    python -m benchmarks.digest --users 10000 --tickers 1000 --concurrent
+    python -m benchmarks.digest --users 1000000 --tickers 2000 --concurrent --chunk-size 5000
+    python -m benchmarks.digest --users 500 --tickers 100 --llm-error-rate 0.05 --compare results.json
+"""
+
+import os
+
+# Read by config at import: set before the bot modules are imported
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:benchmark')
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+os.environ.setdefault('NEWS_SOURCES', 'yfinance')
+os.environ.setdefault('ARTICLE_CONTEXT_ENABLED', 'false')
+os.environ.setdefault('TELEGRAM_RATE_LIMIT', '1000')
+os.environ.setdefault('TELEGRAM_PER_CHAT_INTERVAL', '0')
+os.environ.setdefault('LLM_REQUESTS_PER_MINUTE', '100000')
+os.environ.setdefault('LLM_TOKENS_PER_MINUTE', '1000000000')
+os.environ.setdefault('LLM_REQUESTS_PER_DAY', '10000000')
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import resource
+import string
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import bot_logic
+import data_source
+import database as db
+import llm_processor
+import metrics
+from benchmarks.fakes import FakeBot, FakeGeminiModel, FakeTickerFactory
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def make_symbols(count, rng):
+    """
+    Returns `count` distinct ticker-like symbols of 3 or 4 letters.
+    """
+    symbols = set()
+    while len(symbols) < count:
+        symbols.add(''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.choice((3, 4)))))
+    return sorted(symbols)
+
+
+def generate_users(users, tickers, per_user, english_share=0.3, zipf=1.1, seed=0):
+    """
+    Fills the database with synthetic users and their subscriptions.
+    :param per_user: number of tickers every user subscribes to
+    :param zipf: exponent of the ticker popularity distribution (0 means uniform)
+    :return: the number of subscriptions created
+    """
+    rng = random.Random(seed)
+    symbols = make_symbols(tickers, rng)
+    weights = [1 / (rank ** zipf) for rank in range(1, tickers + 1)]
+    per_user = min(per_user, tickers)
+
+    db.add_or_update_users(
+        (chat_id, 'en' if rng.random() < english_share else 'ru') for chat_id in range(1, users + 1)
+    )
+    # Inserted in batches, so generating a large user base does not set the peak memory of the run
+    created = 0
+    subscriptions = []
+    for chat_id in range(1, users + 1):
+        chosen = set()
+        while len(chosen) < per_user:
+            chosen.update(rng.choices(symbols, weights, k=per_user - len(chosen)))
+        subscriptions.extend((chat_id, symbol) for symbol in chosen)
+        if len(subscriptions) >= 100000 or chat_id == users:
+            created += db.add_subscriptions(subscriptions)
+            subscriptions = []
+    return created
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(RESULTS_DIR)
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    ticker_factory = FakeTickerFactory(
+        latency=args.yfinance_latency, error_rate=args.yfinance_error_rate,
+        items_per_ticker=args.items_per_ticker, seed=args.seed
+    )
+    model = FakeGeminiModel(latency=args.llm_latency, error_rate=args.llm_error_rate, seed=args.seed)
+    bot = FakeBot(
+        latency=args.telegram_latency, server_rate=0, error_rate=args.telegram_error_rate, seed=args.seed, record=False
+    )
+    data_source.set_ticker_factory(ticker_factory)
+    llm_processor.set_model(model)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db.DATABASE_NAME = os.path.join(workdir, 'bench.db')
+        db.init_db()
+        started = time.perf_counter()
+        subscriptions = generate_users(args.users, args.tickers, args.per_user, seed=args.seed)
+        print(f"Generated {args.users} users with {subscriptions} subscriptions over {args.tickers} tickers "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        metrics.registry.reset()
+        if args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        summary = asyncio.run(bot_logic.send_daily_digest(
+            concurrent=args.concurrent, bot=bot, chunk_size=args.chunk_size
+        ))
+        wall_seconds = time.perf_counter() - started
+        peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        tracemalloc.stop()
+        db.close_db_connection()
+
+    db_queries = metrics.snapshot().get('db_query_seconds', {})
+    return {
+        'timestamp': time.time(),
+        'revision': git_revision(),
+        'parameters': vars(args),
+        'wall_seconds': round(wall_seconds, 3),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_traced_mb': round(peak_traced / 2 ** 20, 1) if peak_traced is not None else None,
+        'stages': summary['stages'],
+        'calls': {
+            'fetch': {'yfinance': ticker_factory.calls, 'yfinance_errors': ticker_factory.errors},
+            'summarize': {
+                'llm_batch': model.calls['batch'], 'llm_single': model.calls['single'], 'llm_errors': model.errors,
+                'prompt_tokens': summary['stats'].get('prompt_tokens', 0),
+            },
+            'send': {'telegram': bot.calls, 'telegram_errors': bot.errors},
+            'database': {
+                'queries': sum(series['count'] for series in db_queries.values()),
+                'seconds': round(sum(series['sum'] for series in db_queries.values()), 3),
+            },
+        },
+        'stats': summary['stats'],
+    }
+
+
+def flatten(result):
+    """
+    Returns the comparable numbers of a result as a flat dict, e.g. 'stages.fetch' -> seconds.
+    """
+    values = {'wall_seconds': result['wall_seconds'], 'peak_rss_mb': result['peak_rss_mb']}
+    if result.get('peak_traced_mb') is not None:
+        values['peak_traced_mb'] = result['peak_traced_mb']
+    values.update((f"stages.{stage}", seconds) for stage, seconds in result['stages'].items())
+    for stage, calls in result['calls'].items():
+        values.update((f"calls.{stage}.{name}", value) for name, value in calls.items())
+    return values
+
+
+def report(result):
+    print(f"Wall time: {result['wall_seconds']:.2f}s, peak RSS: {result['peak_rss_mb']} MB"
+          + (f", peak traced: {result['peak_traced_mb']} MB" if result['peak_traced_mb'] is not None else ''))
+    for stage, seconds in result['stages'].items():
+        calls = ', '.join(f"{name} {value}" for name, value in result['calls'].get(stage, {}).items())
+        print(f"  {stage:<10} {seconds:>8.2f}s  {calls}")
+    database = result['calls']['database']
+    print(f"  database: {database['queries']} queries, {database['seconds']:.2f}s")
+    stats = result['stats']
+    print(f"  users {stats['users_processed']}, messages {stats['messages_sent']}, news {stats['news_sent']}, "
+          f"summaries {stats['summaries_requested']}, duplicates {stats['duplicates_found']}, "
+          f"errors {stats['errors']}")
+
+
+def compare(result, path):
+    with open(path) as f:
+        baseline = json.load(f)
+    before, after = flatten(baseline), flatten(result)
+    print(f"Compared with {path} (revision {baseline.get('revision')}):")
+    for name, value in after.items():
+        if name not in before:
+            continue
+        change = f"{(value - before[name]) / before[name]:+.1%}" if before[name] else 'n/a'
+        print(f"  {name:<32} {before[name]:>12} -> {value:<12} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--tickers', type=int, default=1000)
+    parser.add_argument('--per-user', type=int, default=5, help='tickers per user')
+    parser.add_argument('--items-per-ticker', type=int, default=5)
+    parser.add_argument('--concurrent', action='store_true', help='benchmark the concurrent mode')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='users streamed and handled at a time')
+    parser.add_argument('--yfinance-latency', type=float, default=0.05)
+    parser.add_argument('--yfinance-error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also trace the peak Python heap (slows the run down noticeably)')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/digest-<time>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    args = parser.parse_args()
+
+    # bot_logic configures INFO logging at import: keep the per-batch lines out of the report
+    logging.getLogger().setLevel(logging.WARNING)
+    result = run(args)
+    report(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('digest-%Y%m%d-%H%M%S.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved to {output}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Fake stand-ins for external services, used by the local benchmarks.
+"""
+
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter, TimedOut
+
+
+class FakeBot:
+    """
+    Local replacement for telegram.Bot that records sent messages.
+    It emulates Telegram's global limit: above `server_rate` messages per second
+    it raises RetryAfter, just like the real API does on a flood wait.
+    A fraction `error_rate` of the calls fails with TimedOut.
+    With record=False the messages are only counted, so the bot does not grow with the run.
+    """
+
+    def __init__(self, latency=0.02, server_rate=30, retry_after=1, error_rate=0.0, seed=0, record=True):
+        self.latency = latency
+        self.server_rate = server_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.record = record
+        self.sent = []
+        self.calls = 0
+        self.flood_errors = 0
+        self.errors = 0
+        self._recent = deque()
+        self._random = random.Random(seed)
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            raise TimedOut()
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1.0:
+            self._recent.popleft()
+        if self.server_rate and len(self._recent) >= self.server_rate:
+            self.flood_errors += 1
+            raise RetryAfter(self.retry_after)
+        self._recent.append(now)
+        if self.record:
+            self.sent.append((chat_id, len(text), now))
+
+
+class FakeTicker:
+    """
+    Stand-in for yfinance.Ticker returned by FakeTickerFactory.
+    """
+
+    def __init__(self, factory, symbol):
+        self.factory = factory
+        self.symbol = symbol
+
+    @property
+    def news(self):
+        self.factory.call(self.symbol)
+        return self.factory.news_for(self.symbol)
+
+    @property
+    def info(self):
+        self.factory.call(self.symbol)
+        return {'symbol': self.symbol, 'shortName': f"{self.symbol} Corp."}
+
+
+class FakeTickerFactory:
+    """
+    Replacement for yfinance.Ticker (see data_source.set_ticker_factory) serving generated news.
+    Every call blocks for `latency` seconds and fails with probability `error_rate`.
+    A fraction `shared_story_rate` of the items is the same market-wide story under every
+    ticker, so the near-duplicate detection has something to find.
+    """
+
+    SUBJECTS = ('shares', 'earnings', 'revenue', 'guidance', 'dividend', 'margins', 'buyback', 'outlook')
+    VERBS = ('beat', 'miss', 'raise', 'cut', 'hold', 'surprise', 'disappoint', 'lift')
+    SHARED_STORIES = (
+        'Fed signals it will keep rates on hold as inflation cools',
+        'Oil prices jump after supply cut announcement',
+        'Stocks slide as Treasury yields hit new highs',
+    )
+
+    def __init__(self, latency=0.05, error_rate=0.0, items_per_ticker=5, shared_story_rate=0.2, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.items_per_ticker = items_per_ticker
+        self.shared_story_rate = shared_story_rate
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self.started = time.time()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, symbol):
+        return FakeTicker(self, symbol)
+
+    def call(self, symbol):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            raise ConnectionError(f"Fake yfinance error for {symbol}")
+
+    def news_for(self, symbol):
+        items = []
+        for i in range(self.items_per_ticker):
+            rng = random.Random(f"{self.seed}:{symbol}:{i}")
+            if rng.random() < self.shared_story_rate:
+                title = f"{rng.choice(self.SHARED_STORIES)} - {symbol} Wire"
+            else:
+                title = f"{symbol} {rng.choice(self.SUBJECTS)} {rng.choice(self.VERBS)} expectations ({rng.randrange(10**6)})"
+            published = datetime.fromtimestamp(self.started - i * 900, timezone.utc)
+            items.append({
+                'id': f"{symbol}-{i}",
+                'content': {
+                    'title': title,
+                    'pubDate': published.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'canonicalUrl': {'url': f"https://finance.example.com/{symbol}/{i}"},
+                },
+            })
+        return items
+
+
+class FakeGeminiModel:
+    """
+    Stand-in for genai.GenerativeModel (see llm_processor.set_model). Batched requests
+    get a valid JSON answer for every numbered headline, single requests the text format.
+    Every request takes `latency` seconds and fails with probability `error_rate`;
+    token counts are estimated at four characters per token.
+    """
+
+    HEADLINE_PATTERN = re.compile(r'^(\d+)\. ', re.MULTILINE)
+
+    def __init__(self, latency=0.3, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = {'batch': 0, 'single': 0}
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _respond(self, prompt, generation_config):
+        kind = 'batch' if generation_config else 'single'
+        with self._lock:
+            self.calls[kind] += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            raise RuntimeError('Fake Gemini error')
+        if generation_config:
+            text = json.dumps([
+                {'id': int(number), 'essence': 'The company reported results in line with expectations.',
+                 'impact': 'Neutral', 'forecast': 'Sideways trading over the next days.'}
+                for number in self.HEADLINE_PATTERN.findall(prompt)
+            ])
+        else:
+            text = ("ESSENCE: The company reported results in line with expectations.\n"
+                    "IMPACT: Neutral\nFORECAST: Sideways trading over the next days.")
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        time.sleep(self.latency)
+        return self._respond(prompt, generation_config)
+
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._respond(prompt, generation_config)
+
+
+class FakeQuoteDownloader:
+    """
+    Stand-in for yfinance.download (see data_source.set_quote_downloader). Every ticker follows
+    a random walk: each call moves the latest close by up to `volatility` percent and returns
+    the last two daily closes in the yfinance column layout ('Close', ticker).
+    Tickers listed in `missing` are returned as NaN, like delisted symbols.
+    """
+
+    def __init__(self, latency=0.2, volatility=2.0, start_price=100.0, seed=0):
+        self.latency = latency
+        self.volatility = volatility
+        self.start_price = start_price
+        self.calls = 0
+        self.missing = set()
+        self.previous = {}
+        self.last = {}
+        self._random = random.Random(seed)
+
+    def __call__(self, tickers, **kwargs):
+        import pandas as pd
+        time.sleep(self.latency)
+        self.calls += 1
+        for symbol in tickers:
+            previous = self.previous.setdefault(symbol, self.start_price * (0.5 + self._random.random()))
+            last = self.last.get(symbol, previous)
+            self.last[symbol] = last * (1 + self._random.uniform(-self.volatility, self.volatility) / 100)
+        closes = [
+            [float('nan') if symbol in self.missing else self.previous[symbol] for symbol in tickers],
+            [float('nan') if symbol in self.missing else self.last[symbol] for symbol in tickers],
+        ]
+        columns = pd.MultiIndex.from_product([['Close'], list(tickers)])
+        return pd.DataFrame(closes, index=pd.to_datetime(['2024-01-01', '2024-01-02']), columns=columns)
@@ -0,0 +1,89 @@
+"""
+Import-time report of the entry points, based on `python -X importtime`.
+
+Each module is imported in a fresh interpreter several times; the report shows the median
+total import time and the slowest imports below it. With --ref the same is measured on
+another git revision (extracted with `git archive` into a temporary directory), e.g. to
+compare with the code before lazy initialization.
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --ref HEAD~1 --modules app run_digest
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dummy secrets: older revisions load them at import and refuse to start without them
+ENVIRONMENT = dict(os.environ, TELEGRAM_BOT_TOKEN='123456:import-time', GOOGLE_API_KEY='import-time')
+
+
+def measure(module, cwd):
+    """
+    Imports a module in a fresh interpreter.
+    :return: dict module name -> (self microseconds, cumulative microseconds) of the first import
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd, env=ENVIRONMENT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+    return timings
+
+
+def report(module, cwd, repeat, top):
+    runs = [measure(module, cwd) for _ in range(repeat)]
+    total = statistics.median(run[module][1] for run in runs)
+    print(f"  {module}: {total / 1000:.0f} ms (median of {repeat})")
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][1], reverse=True)
+    for name, (_, cumulative_us) in [item for item in slowest if item[0] != module][:top]:
+        print(f"    {cumulative_us / 1000:>8.1f} ms  {name}")
+    return total
+
+
+def extract_revision(ref, target):
+    archive = subprocess.run(['git', 'archive', ref], cwd=REPO_ROOT, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=['app', 'run_digest'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='number of slowest imports listed')
+    parser.add_argument('--ref', help='git revision to compare with')
+    args = parser.parse_args()
+
+    print('working tree:')
+    current = {module: report(module, REPO_ROOT, args.repeat, args.top) for module in args.modules}
+    if not args.ref:
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        extract_revision(args.ref, workdir)
+        print(f"{args.ref}:")
+        baseline = {module: report(module, workdir, args.repeat, args.top) for module in args.modules}
+
+    for module in args.modules:
+        print(f"{module}: {baseline[module] / 1000:.0f} ms -> {current[module] / 1000:.0f} ms "
+              f"({baseline[module] / current[module]:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark of the price alert check against a fake yfinance.download.
+
+Creates random alerts over a set of tickers in a temporary database and runs a few checks of the
+PriceAlertWorker: one bulk download per check and one vectorized evaluation of all alerts. For
+comparison it times the evaluation alone, vectorized and one alert at a time in Python, as a
+per-alert check would do it (without the per-ticker network calls that check would also make).
+
+Usage:
+    python -m benchmarks.price_alerts --alerts 100000 --tickers 2000 --ticks 5
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:benchmark')
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+
+import numpy as np
+
+import database as db
+import data_source
+import price_alerts
+from benchmarks.fakes import FakeQuoteDownloader
+
+
+def create_alerts(alerts, tickers, seed):
+    """
+    Inserts random alerts: a third each of 'above', 'below' (within 5% of the start price) and 'move'.
+    """
+    rng = random.Random(seed)
+    symbols = [f"T{i:04d}" for i in range(tickers)]
+    rows = []
+    for i in range(alerts):
+        direction = price_alerts.DIRECTIONS[i % 3]
+        level = rng.uniform(1, 5) if direction == 'move' else rng.uniform(95, 105)
+        rows.append((i % 50000, rng.choice(symbols), direction, level, time.time()))
+    with db.get_db_connection() as conn:
+        conn.executemany(
+            'INSERT INTO price_alerts (chat_id, ticker, direction, level, created_at) VALUES (?, ?, ?, ?, ?)', rows
+        )
+    return symbols
+
+
+def check_vectorized(downloader, hysteresis_percent):
+    """
+    Evaluates all alerts at once, with the quotes already downloaded.
+    :return: number of alerts that would fire
+    """
+    _, _, tickers, directions, levels, armed = db.get_price_alerts()
+    started = time.perf_counter()
+    symbols = sorted(set(tickers))
+    positions = {symbol: position for position, symbol in enumerate(symbols)}
+    ticker_index = np.fromiter((positions[ticker] for ticker in tickers), dtype=np.int64, count=len(tickers))
+    last = np.array([downloader.last[symbol] for symbol in symbols])
+    previous = np.array([downloader.previous[symbol] for symbol in symbols])
+    codes = np.fromiter((price_alerts.DIRECTION_CODES[direction] for direction in directions), dtype=np.int64)
+    fire, _, _ = price_alerts.evaluate(
+        codes, np.array(levels), np.array(armed, dtype=bool), last[ticker_index], previous[ticker_index],
+        hysteresis_percent
+    )
+    return int(fire.sum()), time.perf_counter() - started
+
+
+def check_one_by_one(downloader, hysteresis_percent):
+    """
+    Evaluates every alert separately, with the quotes already downloaded.
+    :return: number of alerts that would fire
+    """
+    fired = 0
+    _, _, tickers, directions, levels, armed = db.get_price_alerts()
+    started = time.perf_counter()
+    for ticker, direction, level, is_armed in zip(tickers, directions, levels, armed):
+        price, previous = downloader.last[ticker], downloader.previous[ticker]
+        move = (price / previous - 1) * 100
+        if is_armed and (
+            (direction == 'above' and price >= level) or (direction == 'below' and price <= level)
+            or (direction == 'move' and abs(move) >= level)
+        ):
+            fired += 1
+    return fired, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--alerts', type=int, default=100000)
+    parser.add_argument('--tickers', type=int, default=2000)
+    parser.add_argument('--ticks', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='Fake download latency in seconds.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db.DATABASE_NAME = os.path.join(tempfile.mkdtemp(prefix='price-alerts-'), 'bench.db')
+    db.init_db()
+    create_alerts(args.alerts, args.tickers, args.seed)
+    downloader = FakeQuoteDownloader(latency=args.latency, seed=args.seed)
+    data_source.set_quote_downloader(downloader)
+    worker = price_alerts.PriceAlertWorker(bot=None)
+
+    print(f"{args.alerts} alerts over {args.tickers} tickers")
+    for tick in range(args.ticks):
+        started = time.perf_counter()
+        now = time.time()
+        fired = worker.check(now)
+        elapsed = time.perf_counter() - started
+        # As if every message was delivered: the worker disarms the alerts in the delivery callbacks
+        db.update_price_alerts([alert[0] for alerts in fired.values() for alert in alerts], [], now)
+        armed = db.get_db_connection().execute('SELECT COUNT(*) FROM price_alerts WHERE armed = 1').fetchone()[0]
+        print(f"  check {tick}: {elapsed:.3f}s, {sum(len(alerts) for alerts in fired.values())} fired "
+              f"for {len(fired)} users, {armed} armed, downloads so far: {downloader.calls}")
+
+    fired, elapsed = check_vectorized(downloader, worker.hysteresis_percent)
+    print(f"  evaluation only, vectorized: {elapsed * 1000:.1f} ms ({fired} would fire)")
+    fired, elapsed = check_one_by_one(downloader, worker.hysteresis_percent)
+    print(f"  evaluation only, one by one: {elapsed * 1000:.1f} ms ({fired} would fire; "
+          f"a per-alert check would also make {args.tickers} quote requests)")
+
+
+if __name__ == '__main__':
+    main()
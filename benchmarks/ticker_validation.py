@@ -0,0 +1,60 @@
+"""
+Measures ticker validation latency: a cold check (simulated yfinance round trip)
+against repeat validations served by the local TickerRegistry, plus "did you mean" lookups.
+
+Usage:
+    python -m benchmarks.ticker_validation --symbols 10000 --latency 0.5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import database as db
+from ticker_registry import TickerRegistry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', type=int, default=10000, help='Size of the local symbol list.')
+    parser.add_argument('--latency', type=float, default=0.5, help='Simulated yfinance latency in seconds.')
+    parser.add_argument('--repeats', type=int, default=10000)
+    args = parser.parse_args()
+
+    def fake_checker(symbol):
+        time.sleep(args.latency)
+        return symbol.startswith('T'), None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db.DATABASE_NAME = os.path.join(workdir, 'bench.db')
+        db.init_db()
+        symbol_file = os.path.join(workdir, 'symbols.csv')
+        with open(symbol_file, 'w') as f:
+            f.writelines(f"S{i:05d},Company {i}\n" for i in range(args.symbols))
+
+        registry = TickerRegistry(checker=fake_checker, symbol_file=symbol_file)
+
+        started = time.perf_counter()
+        registry.validate('TSLA')
+        registry.validate('XXXX')
+        cold = (time.perf_counter() - started) / 2
+
+        started = time.perf_counter()
+        for i in range(args.repeats):
+            registry.validate('TSLA' if i % 2 else 'XXXX')
+            registry.validate(f"S{i % args.symbols:05d}")
+        warm = (time.perf_counter() - started) / (2 * args.repeats)
+
+        started = time.perf_counter()
+        suggestions = registry.suggest('S0012')
+        suggest = time.perf_counter() - started
+
+        print(f"Cold validation (network): {cold * 1000:.1f} ms")
+        print(f"Repeat validation (registry): {warm * 1e6:.2f} us")
+        print(f"'Did you mean' over {args.symbols} symbols: {suggest * 1000:.1f} ms -> {suggestions}")
+        db.close_db_connection()
+
+
+if __name__ == '__main__':
+    main()
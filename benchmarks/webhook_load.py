@@ -0,0 +1,168 @@
+"""
+Load generator for the webhook: POSTs synthetic command updates (by default /help and /list)
+to the Flask app and reports webhook requests per second and the latency of the update handlers.
+The users follow AAPL and its /news answer is pre-rendered, so '/news AAPL' measures the
+snapshot path of the on-demand news.
+
+Everything runs locally: the Flask app is served by werkzeug, and the Bot API calls made by
+the handlers (getMe, sendMessage) go to a fake Telegram server with a configurable latency.
+The clients, the servers and the bot share one process, so the numbers are a lower bound.
+
+Usage (the config module requires the tokens to be set, they are not used):
+    TELEGRAM_BOT_TOKEN=x GOOGLE_API_KEY=x python -m benchmarks.webhook_load --requests 2000 --clients 16
+    TELEGRAM_BOT_TOKEN=x GOOGLE_API_KEY=x python -m benchmarks.webhook_load --commands '/news AAPL'
+"""
+
+import argparse
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import Application
+from werkzeug.serving import make_server
+
+import app as webapp
+import database as db
+from update_processor import UpdateProcessor, percentile
+
+BOT_TOKEN = '123456:bench'
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Bot API methods used by the handlers after a fixed delay.
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0.05
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        method = self.path.rsplit('/', 1)[-1]
+        time.sleep(self.latency)
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        else:
+            try:
+                chat_id = int(json.loads(body).get('chat_id', 1))
+            except ValueError:
+                chat_id = 1
+            result = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        data = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_update(update_id, chat_id, command):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'text': command,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command.split()[0])}],
+        },
+    }
+
+
+def run_client(port, updates):
+    """
+    POSTs updates over one keep-alive connection.
+    :return: list of (status, latency)
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    results = []
+    for update in updates:
+        body = json.dumps(update)
+        started = time.perf_counter()
+        conn.request('POST', '/webhook', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        results.append((response.status, time.perf_counter() - started))
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent HTTP clients')
+    parser.add_argument('--workers', type=int, default=8, help='update worker coroutines')
+    parser.add_argument('--queue-size', type=int, default=256)
+    parser.add_argument('--api-latency', type=float, default=0.05, help='seconds per fake Bot API call')
+    parser.add_argument('--commands', default='/list,/help', help='comma-separated commands, sent in turn')
+    args = parser.parse_args()
+
+    FakeTelegramHandler.latency = args.api_latency
+    api_server = ThreadingHTTPServer(('127.0.0.1', 0), FakeTelegramHandler)
+    threading.Thread(target=api_server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db.DATABASE_NAME = os.path.join(workdir, 'bench.db')
+        db.init_db()
+        for chat_id in range(1, 101):
+            db.add_or_update_user(chat_id, 'en')
+            db.add_ticker_for_user(chat_id, 'AAPL')
+        db.save_ticker_news_snapshots([(
+            'AAPL', 'en',
+            '\n'.join(f"*Apple headline {i}*\nESSENCE: summary {i}\n[Источник](https://example.com/{i})" for i in range(5)),
+            time.time()
+        )])
+
+        application = (
+            Application.builder().token(BOT_TOKEN)
+            .base_url(f"http://127.0.0.1:{api_server.server_address[1]}/bot")
+            .build()
+        )
+        application.add_handlers(webapp.HANDLERS)
+        processor = UpdateProcessor(lambda: application, workers=args.workers, queue_size=args.queue_size)
+        webapp.update_processor = processor
+        processor.start()
+
+        web_server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+        threading.Thread(target=web_server.serve_forever, daemon=True).start()
+
+        commands = args.commands.split(',')
+        updates = [make_update(i, i % 100 + 1, commands[i % len(commands)]) for i in range(args.requests)]
+        shares = [updates[i::args.clients] for i in range(args.clients)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            results = [result for part in executor.map(run_client, [web_server.port] * args.clients, shares)
+                       for result in part]
+        posted = time.perf_counter() - started
+        while processor.pending:
+            time.sleep(0.01)
+        drained = time.perf_counter() - started
+
+        snapshot = processor.snapshot()
+        processor.stop()
+        web_server.shutdown()
+        api_server.shutdown()
+        db.close_db_connection()
+
+    latencies = [latency for _, latency in results]
+    rejected = sum(1 for status, _ in results if status == 503)
+    print(f"{args.requests} updates from {args.clients} clients, {args.workers} workers, "
+          f"queue {args.queue_size}, Bot API latency {args.api_latency * 1000:.0f}ms")
+    print(f"webhook: {args.requests / posted:,.0f} req/s, "
+          f"p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p99 {percentile(latencies, 0.99) * 1000:.1f}ms, "
+          f"{rejected} answered 503")
+    print(f"handlers: {snapshot['processed']} processed, {snapshot['failed']} failed in {drained:.2f}s "
+          f"({snapshot['processed'] / drained:,.0f} updates/s), "
+          f"p50 {snapshot['latency_p50'] * 1000:.1f}ms, p99 {snapshot['latency_p99'] * 1000:.1f}ms (queued to done)")
+
+
+if __name__ == '__main__':
+    main()
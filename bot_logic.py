@@ -1,110 +1,724 @@
 """
 Logic that will be run on a schedule to send digests.
+
+The digest is built as a ticker-centric pipeline that runs over the users in chunks: the
+subscriptions are streamed from the database (see subscriptions.py) and every chunk of
+DIGEST_CHUNK_SIZE users goes through the stages below, so the first messages go out before the
+scan is finished and memory is bounded by the chunk, not the user base. What is per ticker
+(fetched news, scores, summaries, sentiment) is kept for the whole run and only computed for
+the tickers and stories a chunk adds.
+1. build the inverted ticker -> users index of the chunk and collect its unique tickers and
+   (ticker, language) pairs;
+2. fetch the news for every unique ticker exactly once (served from the news store within its TTL)
+   and map near-duplicate stories (same story, other URL or outlet) to one canonical link;
+3. select for every user only the items published after their delivery watermark, and the items
+   they got with a degraded summary (LLM quota exhausted) in an earlier digest;
+4. summarize every selected story exactly once per language, in batched LLM requests;
+5. build and send each user's message from those shared results and move the watermarks.
+The best items of every (ticker, language) pair are also stored as the answer of /news (see ticker_news).
+
+Every run is checkpointed: each delivered message moves the watermarks of its tickers, and a
+user's delivery is recorded once all their messages went out, so a run that crashed is resumed
+without sending anyone the digest twice. The process executing a run holds a lease on it, renewed
+by a heartbeat, so a run is only resumed once its owner stopped (DIGEST_LEASE_SECONDS without a
+heartbeat). A message that timed out counts as delivered, since it usually was; a user whose digest
+failed otherwise is tried again after DIGEST_RETRY_DELAY_SECONDS, and a user who blocked the bot is
+skipped until they talk to it again. With shard=(i, n) a run only handles the users whose chat id
+hashes to shard i (database.shard_key, selected in SQL), so n processes can split the user base
+while sharing the news store and the summary cache in the same database.
+
+With due_only=True only the users whose delivery time has come are handled (see
+delivery_schedule); every handled user is rescheduled to their next delivery.
+
+In concurrent mode every stage runs with its own concurrency limit instead of fixed sleeps:
+blocking yfinance fetches go to a thread pool and LLM calls use the async Gemini client.
+Messages are always sent through the rate-limited DeliveryScheduler.
 """
 
 import telegram
 import asyncio
+import contextlib
 import logging
-from database import get_all_users_with_tickers
-from data_source import get_news_from_yfinance
-from llm_processor import get_simple_summary
-from config import TELEGRAM_BOT_TOKEN
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import database as db
+from delivery import DeliveryScheduler, pack_blocks, MAX_MESSAGE_LENGTH, FAILURE_PERMANENT, FAILURE_TIMED_OUT
+from database import get_delivery_watermarks
+from news_store import get_ticker_news, select_new_items, prune_old_news
+from summary_cache import summary_cache
+from dedup import story_deduplicator
+from delivery_schedule import next_due_at
+from scoring import rank_news, top_k, format_score
+from subscriptions import TickerSymbols, iter_subscribers, build_ticker_index
+import sentiment
+import ticker_news
+from article import article_processor
+from llm_processor import get_batch_summaries_async, chunked, token_usage_snapshot
+import config
+from config import (
+    DIGEST_FETCH_CONCURRENCY, DIGEST_LLM_CONCURRENCY, DIGEST_SEND_CONCURRENCY, DIGEST_CHUNK_SIZE,
+    LLM_BATCH_SIZE, TELEGRAM_RATE_LIMIT, TELEGRAM_PER_CHAT_INTERVAL,
+    DIGEST_RESUME_WINDOW_SECONDS, DIGEST_RUN_RETENTION_DAYS, DIGEST_RETRY_DELAY_SECONDS, DIGEST_LEASE_SECONDS,
+    DIGEST_TOP_K, DIGEST_MIN_SCORE, NEWS_RETENTION_DAYS
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-
 def log_digest_stats(stats):
     """
     Logs the statistics of the digest mailing.
     """
     logging.info(
         f"Mailing statistics: "
-        f"Users processed: {stats['users_processed']}, "
+        f"Users processed: {stats['users_processed']} "
+        f"(already delivered before resuming: {stats['users_already_delivered']}), "
         f"News sent: {stats['news_sent']}, "
         f"LLM calls: {stats['llm_calls']}, "
         f"Cache hits: {stats['cache_hits']}, "
-        f"Sending errors: {stats['errors']}"
+        f"Sending errors: {stats['errors']} (users blocked: {stats['users_blocked']}, "
+        f"retried later: {stats['users_retried']}), "
+        f"Messages sent: {stats['messages_sent']} (flood waits: {stats['flood_waits']}), "
+        f"Tickers fetched: {stats['tickers_fetched']} (fetches saved: {stats['fetches_saved']}, "
+        f"served from the news store: {stats['fetches_from_store']}), "
+        f"Summaries requested: {stats['summaries_requested']} (summaries saved: {stats['summaries_saved']}), "
+        f"Near-duplicates: {stats['duplicates_found']} (LLM calls avoided: {stats['llm_calls_avoided']}), "
+        f"Items scored: {stats['items_scored']}, "
+        f"Sentiment observations: {stats['sentiment_observations']}, "
+        f"/news snapshots: {stats['news_snapshots']}, "
+        f"LLM tokens: {stats['prompt_tokens']} in, {stats['output_tokens']} out, "
+        f"Articles: {stats['articles_fetched']} fetched ({stats['article_chars']} chars condensed to "
+        f"{stats['condensed_chars']}), "
+        f"Summary cache: memory hits {stats['cache_memory_hits']}, DB hits {stats['cache_db_hits']}, "
+        f"misses {stats['cache_misses']}, evictions {stats['cache_evictions']}"
+    )
+
+
+def schedule_next_delivery(user, now):
+    """
+    Returns the next delivery time of a user after now, using the default
+    schedule if the stored preferences are invalid.
+    :param user: a Subscriber record
+    """
+    try:
+        return next_due_at(now, user.timezone, user.delivery_time, user.frequency, user.chat_id)
+    except ValueError as e:
+        logging.warning(f"Invalid schedule of user {user.chat_id}: {e}. Using the default schedule.")
+        return next_due_at(now, chat_id=user.chat_id)
+
+
+def collect_digest_work(users, symbols):
+    """
+    Stage 1: builds the inverted index of a chunk of users and collects its unique work.
+    :param users: Subscriber records of the chunk (see subscriptions.iter_subscribers)
+    :param symbols: the TickerSymbols of the scan
+    :return: (index, tickers, pairs) where index maps ticker ids to the positions of their users
+        (see subscriptions.build_ticker_index), tickers is the set of unique tickers and
+        pairs is the set of unique (ticker, language) pairs.
+    """
+    index = build_ticker_index(users)
+    tickers = set()
+    pairs = set()
+    for ticker_id, positions in index.items():
+        ticker = symbols.names[ticker_id]
+        tickers.add(ticker)
+        pairs.update((ticker, language) for language in {users[position].language for position in positions})
+    return index, tickers, pairs
+
+
+def fetch_ticker_news(tickers, stats):
+    """
+    Stage 2: fetches the news for every unique ticker exactly once.
+    :return: dict ticker -> list of recent news items, newest first
+    """
+    news_by_ticker = {}
+    for ticker in sorted(tickers):
+        news_by_ticker[ticker], from_store = get_ticker_news(ticker)
+        stats['fetches_from_store'] += from_store
+    return news_by_ticker
+
+
+async def fetch_ticker_news_concurrent(tickers, stats, max_workers=None):
+    """
+    Concurrent version of fetch_ticker_news(): the blocking yfinance calls
+    run in a thread pool with at most max_workers in flight.
+    """
+    max_workers = max_workers or DIGEST_FETCH_CONCURRENCY
+    loop = asyncio.get_running_loop()
+    ordered = sorted(tickers)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='digest-fetch') as executor:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(executor, get_ticker_news, ticker) for ticker in ordered
+        ))
+    news_by_ticker = {}
+    for ticker, (news, from_store) in zip(ordered, results):
+        news_by_ticker[ticker] = news
+        stats['fetches_from_store'] += from_store
+    return news_by_ticker
+
+
+def deduplicate_news(news_by_ticker, stats):
+    """
+    Stage 2b: maps every fetched item to its canonical story.
+    :return: dict link -> canonical link
+    """
+    canonical = story_deduplicator.canonicalize(
+        news_item for news in news_by_ticker.values() for news_item in news
+    )
+    stats['duplicates_found'] += sum(1 for link, story in canonical.items() if link != story)
+    return canonical
+
+
+def score_news(news_by_ticker, stats):
+    """
+    Stage 2c: scores and categorizes all fetched items locally, in one batch.
+    :return: dict ticker -> list of scored news items, best first
+    """
+    ranked = rank_news(news_by_ticker)
+    stats['items_scored'] += sum(len(items) for items in ranked.values())
+    return ranked
+
+
+def digest_limits(users, subscription_limits):
+    """
+    Returns the function giving how many items of a ticker a user gets: the subscription's own
+    value, else the user's, else DIGEST_TOP_K.
+    :param users: Subscriber records
+    :param subscription_limits: dict (chat_id, ticker) -> k, see db.get_subscription_top_k()
+    """
+    user_limits = {user.chat_id: user.top_k for user in users if user.top_k}
+    return lambda chat_id, ticker: subscription_limits.get(
+        (chat_id, ticker), user_limits.get(chat_id, DIGEST_TOP_K)
     )
 
 
-async def send_daily_digest():
+def select_user_news(users, index, symbols, news_by_ticker, watermarks,
+                     limit=lambda chat_id, ticker: DIGEST_TOP_K, retries=None, pushed=None):
+    """
+    Stage 3: picks for every user the best scored items published after their delivery watermark.
+    Works ticker by ticker over the inverted index: the users of a ticker with the same watermark
+    and limit share one list of items. Items the user got with a degraded summary before are added
+    again, flagged with 'retry', as long as the ticker's news still has them. Stories the user
+    already got as an alert are left out.
+    :param users: Subscriber records of the chunk
+    :param index: inverted index of the chunk, see collect_digest_work()
+    :param news_by_ticker: dict ticker -> list of scored news items, best first
+    :param watermarks: dict (chat_id, ticker) -> unix time of the newest delivered item
+    :param limit: callable (chat_id, ticker) -> number of items of the ticker the user gets
+    :param retries: optional dict (chat_id, ticker) -> links to deliver again, see db.get_summary_retries()
+    :param pushed: optional dict chat_id -> links pushed as alerts, see db.get_alert_deliveries()
+    :return: list of (chat_id, language, [(ticker, [news items])]) in the order of users,
+        with the tickers of every user in alphabetical order
+    """
+    retries = retries or {}
+    pushed = pushed or {}
+    ticker_items = [[] for _ in users]
+    for ticker_id in sorted(index, key=symbols.names.__getitem__):
+        ticker = symbols.names[ticker_id]
+        news = news_by_ticker.get(ticker, [])
+        chosen = {}
+        for position in index[ticker_id]:
+            chat_id = users[position].chat_id
+            key = (watermarks.get((chat_id, ticker)), limit(chat_id, ticker))
+            items = chosen.get(key)
+            if items is None:
+                items = chosen[key] = top_k(select_new_items(news, key[0]), key[1], DIGEST_MIN_SCORE)
+            links = retries.get((chat_id, ticker))
+            if links:
+                selected = {news_item['link'] for news_item in items}
+                items = [dict(news_item, retry=True) if news_item['link'] in links else news_item for news_item in items]
+                items += [
+                    dict(news_item, retry=True) for news_item in news
+                    if news_item['link'] in links and news_item['link'] not in selected
+                ]
+            alerted = pushed.get(chat_id)
+            if alerted:
+                items = [news_item for news_item in items if news_item['link'] not in alerted]
+            ticker_items[position].append((ticker, items))
+    return [(user.chat_id, user.language, items) for user, items in zip(users, ticker_items)]
+
+
+def group_news_by_language(selections, canonical, stats, known=None):
+    """
+    Collects the unique stories that need a summary in every language.
+    Near-duplicates are requested under the link of their canonical story, so they
+    share its cached summary; every such (link, language) pair is an LLM call avoided.
+    :param canonical: dict link -> canonical link from deduplicate_news()
+    :param known: optional dict language -> results already summarized in this run (earlier chunks)
+    :return: dict language -> list of news items (unique by canonical link)
+    """
+    by_language = {}
+    seen = set()
+    seen_links = set()
+    known = known or {}
+    for _, language, ticker_items in selections:
+        done = known.get(language, {})
+        for _, items in ticker_items:
+            for news_item in items:
+                link = news_item['link']
+                story = canonical.get(link, link)
+                if link in done or story in done:
+                    continue
+                if story != link and (link, language) not in seen_links:
+                    stats['llm_calls_avoided'] += 1
+                seen_links.add((link, language))
+                if (story, language) not in seen:
+                    seen.add((story, language))
+                    by_language.setdefault(language, []).append(dict(news_item, link=story))
+    return by_language
+
+
+def expand_duplicates(results, canonical):
+    """
+    Gives every near-duplicate link the summary of its canonical story.
+    """
+    for link, story in canonical.items():
+        if link != story and story in results:
+            results[link] = results[story]
+    return results
+
+
+def record_summary_stats(results, llm_requests, stats):
+    """
+    Adds the outcome of one batch of summaries to the run stats.
+    """
+    stats['summaries_requested'] += len(results)
+    stats['llm_calls'] += llm_requests
+    stats['cache_hits'] += sum(1 for _, from_cache, _ in results.values() if from_cache)
+
+
+async def summarize_news(selections, canonical, stats, known=None):
+    """
+    Stage 4: summarizes every selected story once per language.
+    Uncached headlines are sent to the LLM in batches of LLM_BATCH_SIZE, one at a time;
+    the pacing comes from the LLM governor, which waits without blocking the event loop.
+    :param known: optional dict language -> results of earlier chunks, which are not summarized again
+    :return: dict language -> dict link -> (summary, from_cache, degraded) of the stories summarized now
+    """
+    results_by_language = {}
+    for language, news_items in group_news_by_language(selections, canonical, stats, known).items():
+        results = {}
+        for batch in chunked(news_items, LLM_BATCH_SIZE):
+            batch_results, llm_requests = await get_batch_summaries_async(batch, language)
+            record_summary_stats(batch_results, llm_requests, stats)
+            results.update(batch_results)
+        results_by_language[language] = expand_duplicates(results, canonical)
+    return results_by_language
+
+
+async def summarize_news_concurrent(selections, canonical, stats, max_concurrency=None, known=None):
+    """
+    Concurrent version of summarize_news(): at most max_concurrency
+    batched LLM requests are in flight at any time.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or DIGEST_LLM_CONCURRENCY)
+
+    async def summarize(batch, language):
+        async with semaphore:
+            batch_results, llm_requests = await get_batch_summaries_async(batch, language)
+        record_summary_stats(batch_results, llm_requests, stats)
+        return language, batch_results
+
+    jobs = [
+        summarize(batch, language)
+        for language, news_items in group_news_by_language(selections, canonical, stats, known).items()
+        for batch in chunked(news_items, LLM_BATCH_SIZE)
+    ]
+    results_by_language = {}
+    for language, batch_results in await asyncio.gather(*jobs):
+        results_by_language.setdefault(language, {}).update(batch_results)
+    for results in results_by_language.values():
+        expand_duplicates(results, canonical)
+    return results_by_language
+
+
+def update_sentiment(selections, results_by_language, tickers, stats, recorded=None):
+    """
+    Stage 4b: records the impact of the summarized items and computes the sentiment signals
+    of the given tickers in one batch.
+    :param recorded: optional set of (ticker, link, language) already recorded in this run; it is updated
+    :return: dict ticker -> signals (see sentiment.compute_signals), empty if that fails
+    """
+    recorded = recorded if recorded is not None else set()
+    try:
+        by_language = {}
+        for _, language, ticker_items in selections:
+            for ticker, items in ticker_items:
+                for news_item in items:
+                    if (ticker, news_item['link'], language) not in recorded:
+                        recorded.add((ticker, news_item['link'], language))
+                        by_language.setdefault(language, {})[(ticker, news_item['link'])] = (ticker, news_item)
+        for language, ticker_items in by_language.items():
+            stats['sentiment_observations'] += sentiment.record_summaries(
+                ticker_items.values(), results_by_language.get(language, {})
+            )
+        return sentiment.get_signals(tickers)
+    except Exception as e:
+        logging.error(f"Error updating the sentiment signals: {e}")
+        return {}
+
+
+def build_user_message(language, ticker_items, results, signals=None, max_length=MAX_MESSAGE_LENGTH):
+    """
+    Stage 5: builds the digest messages for one user from the shared results.
+    A long digest is cut into several messages at ticker blocks, and every message carries the
+    watermarks of its own tickers, so each one moves them forward only once it is delivered.
+    :param ticker_items: list of (ticker, [news items]) selected for the user
+    :param results: dict link -> (summary, from_cache, degraded) for the user's language
+    :param signals: optional dict ticker -> sentiment signals shown in the header
+    :return: (messages, news_count) where messages is a list of (text, watermarks, retries),
+        watermarks mapping each ticker of the message to the publish time of its newest item
+        included, or ([], 0) if there is nothing new. retries lists the (ticker, link, degraded)
+        of the items sent with a degraded summary, to be delivered again with their real summary
+        in a later digest (degraded=True), and of earlier such items now summarized (degraded=False).
+    """
+    header_parts = [f"News digest for you ({language}): \n"]
+    signals = signals or {}
+    header = [sentiment.format_signal(ticker, signals[ticker]) for ticker, _ in ticker_items if ticker in signals]
+    if header:
+        header_parts.append("Sentiment: " + ', '.join(header) + "\n")
+    blocks = [('\n'.join(header_parts), ({}, []))]
+    news_count = 0
+
+    for ticker, items in ticker_items:
+        block_parts = [f"\n--- 📈 *{ticker}* ---\n"]
+        ticker_count = 0
+        watermark = None
+        retries = []
+        for news_item in items:
+            summary, _, degraded = results.get(news_item['link'], (None, False, False))
+            if not summary:
+                logging.warning(f"Failed to get summary for: {news_item['title']}")
+                continue
+            block_parts.append(
+                f"*{news_item['title']}*\n"
+                + (f"{format_score(news_item)}\n" if 'score' in news_item else '')
+                + f"{summary}\n"
+                f"[Источник]({news_item['link']})\n"
+            )
+            ticker_count += 1
+            if news_item['published'] and (watermark is None or news_item['published'] > watermark):
+                watermark = news_item['published']
+            if degraded or news_item.get('retry'):
+                retries.append((ticker, news_item['link'], degraded))
+        news_count += ticker_count
+
+        if not ticker_count:
+            block_parts.append(f"_No new news found._\n")
+        blocks.append(('\n'.join(block_parts), ({ticker: watermark} if watermark is not None else {}, retries)))
+
+    if not news_count:
+        return [], 0
+    messages = [
+        (
+            text,
+            {ticker: published for watermarks, _ in payloads for ticker, published in watermarks.items()},
+            [retry for _, retries in payloads for retry in retries]
+        )
+        for text, payloads in pack_blocks(blocks, max_length)
+    ]
+    return messages, news_count
+
+
+def delivery_callbacks(run_id, message_count, next_due, stats):
+    """
+    Checkpoints the digest of one user that is sent as message_count messages: every delivered
+    message moves the watermarks of its tickers forward, so a failed message does not make the next
+    run resend the others. Once the last message is handled the delivery of the user is recorded,
+    or the user is blocked (the chat refuses messages) or retried after DIGEST_RETRY_DELAY_SECONDS.
+    A message that timed out counts as delivered: it usually was, and it is never resent.
+    :param next_due: unix time of the user's next regular delivery
+    :param stats: run stats; 'users_blocked' and 'users_retried' are incremented
+    :return: function (watermarks, retries) -> (on_delivered, on_failed) callbacks of one message,
+        see build_user_message() and DeliveryScheduler.submit()
+    """
+    state = {'remaining': message_count, 'failure': None}
+
+    def finish(chat_id, entries):
+        if state['failure'] is None:
+            db.record_digest_delivery(run_id, chat_id, entries, next_due)
+        elif state['failure'] == FAILURE_PERMANENT:
+            logging.warning(f"User {chat_id} does not accept messages, skipping them until they return.")
+            stats['users_blocked'] += 1
+            db.block_users([chat_id], time.time())
+        else:
+            stats['users_retried'] += 1
+            db.set_next_due([(min(next_due, time.time() + DIGEST_RETRY_DELAY_SECONDS), chat_id)])
+
+    def message_callbacks(watermarks, retries=()):
+        def delivered(chat_id):
+            entries = [(chat_id, ticker, published) for ticker, published in watermarks.items()]
+            if retries:
+                db.update_summary_retries(chat_id, retries, time.time())
+            state['remaining'] -= 1
+            if state['remaining'] or state['failure']:
+                db.update_delivery_watermarks(entries)
+            if not state['remaining']:
+                finish(chat_id, entries)
+
+        def failed(chat_id, kind):
+            if kind == FAILURE_TIMED_OUT:
+                return delivered(chat_id)
+            if state['failure'] != FAILURE_PERMANENT:
+                state['failure'] = kind
+            state['remaining'] -= 1
+            if not state['remaining']:
+                finish(chat_id, [])
+        return delivered, failed
+    return message_callbacks
+
+
+async def send_daily_digest(concurrent=False, bot=None, shard=(0, 1), resume=True, due_only=False,
+                            chunk_size=DIGEST_CHUNK_SIZE):
     """
     Main function to send the daily news digest.
+    :param concurrent: run the stages concurrently with bounded parallelism
+        (DIGEST_*_CONCURRENCY) instead of serially with fixed pauses.
+    :param bot: telegram.Bot to send with; by default one is created with TELEGRAM_BOT_TOKEN
+    :param shard: (index, count): only the users of shard `index` out of `count` are handled
+    :param resume: resume an unfinished run of the shard, skipping the users it already reached
+    :param due_only: only handle the users whose scheduled delivery time has come
+    :param chunk_size: number of users streamed and handled at a time
+    :return: the run summary that is also persisted in run_summaries, or None if the shard's run is
+        still being executed by another process
     """
-    bot = telegram.Bot(token=TELEGRAM_BOT_TOKEN)
-    users = get_all_users_with_tickers()
+    timer = metrics.RunTimer()
+    shard_index, shard_count = shard
+    run_id, resumed = db.start_digest_run(
+        shard_index, shard_count, DIGEST_RESUME_WINDOW_SECONDS, resume, DIGEST_LEASE_SECONDS
+    )
+    if run_id is None:
+        logging.warning(f"The digest run of shard {shard_index}/{shard_count} is still running in another process.")
+        return None
+    with digest_run_lease(run_id):
+        return await _run_digest(timer, run_id, resumed, concurrent, bot, shard, due_only, chunk_size)
+
+
+@contextlib.contextmanager
+def digest_run_lease(run_id, interval=None):
+    """
+    Renews the lease of a digest run from a background thread every interval seconds (a third of
+    DIGEST_LEASE_SECONDS by default), so it keeps beating while a stage blocks the event loop.
+    """
+    stop = threading.Event()
+    owner = db.run_owner()
+
+    def beat():
+        try:
+            while not stop.wait(interval or DIGEST_LEASE_SECONDS / 3):
+                if not db.heartbeat_digest_run(run_id, owner):
+                    logging.error(f"Lost the lease of digest run {run_id} to another process.")
+        except Exception as e:
+            logging.error(f"Error renewing the lease of digest run {run_id}: {e}")
+        finally:
+            db.close_db_connection()
+
+    thread = threading.Thread(target=beat, name='digest-lease', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+async def _run_digest(timer, run_id, resumed, concurrent, bot, shard, due_only, chunk_size):
+    """
+    Executes a digest run started by send_daily_digest().
+    """
+    shard_index, shard_count = shard
+    delivered = db.get_digest_deliveries(run_id) if resumed else set()
+    if resumed:
+        logging.info(f"Resuming digest run {run_id}: {len(delivered)} users already received it.")
+    if bot is None:
+        bot = telegram.Bot(token=config.TELEGRAM_BOT_TOKEN)
 
     stats = {
         'users_processed': 0,
         'news_sent': 0,
         'llm_calls': 0,
         'cache_hits': 0,
-        'errors': 0
+        'errors': 0,
+        'messages_sent': 0,
+        'flood_waits': 0,
+        'tickers_fetched': 0,
+        'fetches_saved': 0,
+        'fetches_from_store': 0,
+        'summaries_requested': 0,
+        'summaries_saved': 0,
+        'duplicates_found': 0,
+        'llm_calls_avoided': 0,
+        'items_scored': 0,
+        'sentiment_observations': 0,
+        'news_snapshots': 0,
+        'users_blocked': 0,
+        'users_retried': 0,
+        'users_already_delivered': len(delivered)
     }
 
-    logging.info(f"Starting digest mailing for {len(users)} users.")
+    tokens_before = token_usage_snapshot()
+    articles_before = dict(article_processor.stats)
 
-    for user in users:
-        stats['users_processed'] += 1
-        chat_id = user['chat_id']
-        language = user['language']
-        tickers = user['tickers'].split(',') # GROUP_CONCAT returns a string
+    # Per-ticker state of the run, shared by the chunks: it grows with the tickers, not the users
+    symbols = TickerSymbols()
+    ranked_by_ticker = {}
+    canonical = {}
+    results_by_language = {}
+    signals = {}
+    signalled = set()
+    recorded = set()
+    snapshot_pairs = set()
+    subscription_limits = db.get_subscription_top_k()
+    ticker_refs = summary_refs = 0
 
-        logging.info(f"Processing user {chat_id} with tickers: {tickers}")
+    scheduler = DeliveryScheduler(
+        bot,
+        rate=TELEGRAM_RATE_LIMIT,
+        per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL,
+        workers=DIGEST_SEND_CONCURRENCY if concurrent else 1
+    )
+    scheduler.start()
 
-        message_parts = [f"News digest for you ({language}): \n"]
-        has_new_content = False
+    logging.info(f"Starting digest mailing (shard {shard_index}/{shard_count}, chunks of {chunk_size} users).")
+    chunks = iter_subscribers(
+        due_at=timer.started if due_only else None, chunk_size=chunk_size, symbols=symbols, shard=shard
+    )
+    while True:
+        with timer.stage('collect'):
+            chunk = next(chunks, None)
+            if chunk is not None:
+                users = [user for user in chunk if user.chat_id not in delivered]
+                next_due = {user.chat_id: schedule_next_delivery(user, timer.started) for user in users}
+                index, tickers, pairs = collect_digest_work(users, symbols)
+                ticker_refs += sum(len(user.ticker_ids) for user in users)
+        if chunk is None:
+            break
+        if not users:
+            continue
+        new_tickers = tickers - ranked_by_ticker.keys()
+        logging.info(f"Digest chunk: {len(users)} users, {len(tickers)} tickers ({len(new_tickers)} new).")
 
-        for ticker in tickers:
-            news_list = get_news_from_yfinance(ticker)
-            if not news_list:
-                continue
+        with timer.stage('fetch'):
+            if concurrent:
+                fetched = await fetch_ticker_news_concurrent(new_tickers, stats)
+            else:
+                fetched = fetch_ticker_news(new_tickers, stats)
+        with timer.stage('dedup'):
+            canonical.update(deduplicate_news(fetched, stats))
+        with timer.stage('score'):
+            ranked_by_ticker.update(score_news(fetched, stats))
+        with timer.stage('select'):
+            chat_ids = [user.chat_id for user in users]
+            selections = select_user_news(
+                users, index, symbols, ranked_by_ticker, get_delivery_watermarks(chat_ids),
+                digest_limits(users, subscription_limits), db.get_summary_retries(chat_ids),
+                db.get_alert_deliveries(chat_ids)
+            )
+            summary_refs += sum(len(items) for _, _, ticker_items in selections for _, items in ticker_items)
 
-            message_parts.append(f"\n--- 📈 *{ticker}* ---\n")
-            news_found_for_ticker = False
+        with timer.stage('summarize'):
+            if concurrent:
+                chunk_results = await summarize_news_concurrent(selections, canonical, stats, known=results_by_language)
+            else:
+                chunk_results = await summarize_news(selections, canonical, stats, known=results_by_language)
+            for language, results in chunk_results.items():
+                results_by_language.setdefault(language, {}).update(results)
+            # Stories of earlier chunks may have got new near-duplicates
+            for results in results_by_language.values():
+                expand_duplicates(results, canonical)
+        with timer.stage('sentiment'):
+            signals.update(update_sentiment(selections, results_by_language, tickers - signalled, stats, recorded))
+            signalled |= tickers
+        with timer.stage('snapshots'):
+            try:
+                stats['news_snapshots'] += ticker_news.save_digest_snapshots(
+                    ranked_by_ticker, pairs - snapshot_pairs, results_by_language
+                )
+                snapshot_pairs |= pairs
+            except Exception as e:
+                logging.error(f"Error saving the /news snapshots: {e}")
 
-            for news_item in news_list[:3]:  # Take only 3 recent news items for MVP
-                summary, from_cache = get_simple_summary(news_item['title'], news_item['link'], language)
+        with timer.stage('send'):
+            # Back-pressure: at most about one chunk of messages waits in the scheduler
+            await scheduler.wait_below(chunk_size)
+            # Users with nothing new are rescheduled too
+            idle = []
+            for chat_id, language, ticker_items in selections:
+                stats['users_processed'] += 1
+                messages, news_count = build_user_message(
+                    language, ticker_items, results_by_language.get(language, {}), signals
+                )
 
-                if not from_cache:
-                    stats['llm_calls'] += 1
-                else:
-                    stats['cache_hits'] += 1
-
-                if summary:
-                    news_found_for_ticker = True
-                    has_new_content = True
-                    stats['news_sent'] += 1
-                    formatted_news = (
-                        f"*{news_item['title']}*\n"
-                        f"{summary}\n"
-                        f"[Источник]({news_item['link']})\n"
-                    )
-                    message_parts.append(formatted_news)
-                    await asyncio.sleep(1) # Small delay between LLM requests (if not from cache)
+                if messages:
+                    stats['news_sent'] += news_count
+                    message_callbacks = delivery_callbacks(run_id, len(messages), next_due[chat_id], stats)
+                    for text, watermarks, retries in messages:
+                        sent, failed = message_callbacks(watermarks, retries)
+                        scheduler.submit(chat_id, text, on_delivered=sent, on_failed=failed)
                 else:
-                    logging.warning(f"Failed to get summary for: {news_item['title']}")
+                    logging.info(f"No new content to send to user {chat_id}.")
+                    idle.append((next_due[chat_id], chat_id))
+            db.set_next_due(idle)
 
-            if not news_found_for_ticker:
-                message_parts.append(f"_No new news found._\n")
+    with timer.stage('send'):
+        await scheduler.close()
+    stats['errors'] += scheduler.stats['failed']
+    stats['messages_sent'] = scheduler.stats['sent']
+    stats['flood_waits'] = scheduler.stats['flood_waits']
 
-        if has_new_content:
-            final_message = '\n'.join(message_parts)
-            try:
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=final_message,
-                    parse_mode='Markdown'
-                )
-                logging.info(f"Digest successfully sent to user {chat_id}")
-            except Exception as e:
-                stats['errors'] += 1
-                logging.error(f"Failed to send message to user {chat_id}: {e}")
-        else:
-            logging.info(f"No new content to send to user {chat_id}.")
+    # What a per-user loop would have requested, for comparison
+    stats['tickers_fetched'] = len(ranked_by_ticker)
+    stats['fetches_saved'] = ticker_refs - len(ranked_by_ticker)
+    stats['summaries_saved'] = summary_refs - stats['summaries_requested']
+    tokens_after = token_usage_snapshot()
+    stats['prompt_tokens'] = tokens_after['prompt_tokens'] - tokens_before['prompt_tokens']
+    stats['output_tokens'] = tokens_after['output_tokens'] - tokens_before['output_tokens']
+    for name in ('articles_fetched', 'article_chars', 'condensed_chars'):
+        stats[name] = article_processor.stats[name] - articles_before[name]
 
-        await asyncio.sleep(5) # Pause between processing different users
+    with timer.stage('cleanup'):
+        db.finish_digest_run(run_id)
+        # The tables below are shared by all shards: one of them maintains them
+        if shard_index == 0:
+            prune_old_news()
+            story_deduplicator.prune()
+            article_processor.prune()
+            summary_cache.evict()
+            db.prune_digest_runs(DIGEST_RUN_RETENTION_DAYS)
+            db.prune_summary_retries(NEWS_RETENTION_DAYS * 24 * 3600)
+            sentiment.prune()
+    for name, value in summary_cache.snapshot().items():
+        stats[f'cache_{name}'] = value
 
     log_digest_stats(stats)
+    return save_run_summary(
+        timer, stats, concurrent=concurrent, shard=f"{shard_index}/{shard_count}", run_id=run_id, resumed=resumed,
+        due_only=due_only
+    )
 
+
+def save_run_summary(timer, stats, **details):
+    """
+    Logs the stage timings of a digest run and persists its structured summary.
+    :param details: run settings stored with the summary (mode, shard, run id)
+    :return: the summary dict
+    """
+    finished_at = time.time()
+    slowest, _ = timer.slowest()
+    logging.info(
+        "Stage timings: " + ', '.join(f"{stage} {elapsed:.2f}s" for stage, elapsed in timer.durations.items())
+        + f" (slowest: {slowest})"
+    )
+    summary = {
+        **details,
+        'stats': stats,
+        'stages': {stage: round(elapsed, 6) for stage, elapsed in timer.durations.items()},
+        'metrics': metrics.snapshot(),
+    }
+    try:
+        db.save_run_summary('digest', timer.started, finished_at, summary)
+    except Exception as e:
+        logging.error(f"Error saving the digest run summary: {e}")
+    return dict(summary, started_at=timer.started, finished_at=finished_at)
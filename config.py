@@ -1,4 +1,5 @@
 # Configuration management and loading of secret keys.
+import logging
 import os
 
 # Load the token for the Telegram bot from environment variables.
@@ -15,12 +16,12 @@ def load_config():
         # Try to load secrets from local secrets.py file
         # This file should be added to .gitignore and not committed to repository
         from secrets import TELEGRAM_TOKEN, GOOGLE_API_KEY
-        print("Configuration loaded from local secrets.py file")
+        logging.info("Configuration loaded from local secrets.py file")
         return TELEGRAM_TOKEN, GOOGLE_API_KEY
 
     except ImportError:
         # If secrets.py file is not found, load from environment variables
-        print("secrets.py file not found, loading from environment variables")
+        logging.info("secrets.py file not found, loading from environment variables")
 
         # Load the token for the Telegram bot from environment variables.
         # On PythonAnywhere, it needs to be set in the "Web" -> "Environment variables" section
@@ -38,12 +39,173 @@ def load_config():
         return telegram_token, google_api_key
 
 
-# Load configuration when module is imported
-TELEGRAM_BOT_TOKEN, GOOGLE_API_KEY = load_config()
+# Secrets loaded by load_config() on first access
+_secrets = None
 
-# Additional check in case values are empty
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError('TELEGRAM_BOT_TOKEN cannot be empty')
 
-if not GOOGLE_API_KEY:
-    raise ValueError('GOOGLE_API_KEY cannot be empty')
+def __getattr__(name):
+    """
+    Loads TELEGRAM_BOT_TOKEN and GOOGLE_API_KEY on first access instead of at import,
+    so importing config (and every module that reads its settings) stays cheap.
+    Read them as config.TELEGRAM_BOT_TOKEN at the point of use: `from config import ...`
+    at module level would load them at import again.
+    """
+    global _secrets
+    if name not in ('TELEGRAM_BOT_TOKEN', 'GOOGLE_API_KEY'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _secrets is None:
+        telegram_token, google_api_key = load_config()
+        # Additional check in case values are empty
+        if not telegram_token:
+            raise ValueError('TELEGRAM_BOT_TOKEN cannot be empty')
+        if not google_api_key:
+            raise ValueError('GOOGLE_API_KEY cannot be empty')
+        _secrets = {'TELEGRAM_BOT_TOKEN': telegram_token, 'GOOGLE_API_KEY': google_api_key}
+    return _secrets[name]
+
+# Concurrency limits of the digest pipeline stages (used in concurrent mode).
+# They bound the number of in-flight yfinance fetches, Gemini requests and Telegram sends.
+DIGEST_FETCH_CONCURRENCY = int(os.getenv('DIGEST_FETCH_CONCURRENCY', '8'))
+DIGEST_LLM_CONCURRENCY = int(os.getenv('DIGEST_LLM_CONCURRENCY', '4'))
+DIGEST_SEND_CONCURRENCY = int(os.getenv('DIGEST_SEND_CONCURRENCY', '20'))
+
+# The digest streams the users in chunks of DIGEST_CHUNK_SIZE and runs its stages chunk by chunk,
+# so memory is bounded by the chunk size rather than the user base.
+DIGEST_CHUNK_SIZE = int(os.getenv('DIGEST_CHUNK_SIZE', '5000'))
+
+# Telegram delivery limits: messages per second for the whole bot and
+# the minimum interval in seconds between two messages to the same chat.
+TELEGRAM_RATE_LIMIT = float(os.getenv('TELEGRAM_RATE_LIMIT', '30'))
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv('TELEGRAM_PER_CHAT_INTERVAL', '1.0'))
+
+# Maximum number of headlines summarized in a single batched LLM request.
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', '10'))
+
+# Summary cache: in-process LRU size, time to live of an entry,
+# maximum number of rows kept in SQLite and how many writes trigger an eviction pass.
+SUMMARY_CACHE_LRU_SIZE = int(os.getenv('SUMMARY_CACHE_LRU_SIZE', '2048'))
+SUMMARY_CACHE_TTL_SECONDS = int(os.getenv('SUMMARY_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+SUMMARY_CACHE_MAX_ROWS = int(os.getenv('SUMMARY_CACHE_MAX_ROWS', '50000'))
+SUMMARY_CACHE_EVICT_EVERY = int(os.getenv('SUMMARY_CACHE_EVICT_EVERY', '500'))
+
+# Ticker registry: how long a validation result is trusted (valid and invalid symbols
+# separately) and an optional local symbol list (CSV: SYMBOL[,NAME] per line) loaded at start.
+TICKER_VALID_TTL_SECONDS = int(os.getenv('TICKER_VALID_TTL_SECONDS', str(30 * 24 * 3600)))
+TICKER_INVALID_TTL_SECONDS = int(os.getenv('TICKER_INVALID_TTL_SECONDS', str(24 * 3600)))
+TICKER_LIST_PATH = os.getenv('TICKER_LIST_PATH')
+
+# News store: how long fetched news for a ticker is served locally before refetching,
+# how many recent items per ticker are kept for the digest and how long items are retained.
+NEWS_FETCH_TTL_SECONDS = int(os.getenv('NEWS_FETCH_TTL_SECONDS', '1800'))
+NEWS_STORE_LIMIT = int(os.getenv('NEWS_STORE_LIMIT', '20'))
+NEWS_RETENTION_DAYS = int(os.getenv('NEWS_RETENTION_DAYS', '14'))
+
+# News sources queried by the aggregator (comma-separated: yfinance, rss, newsapi, alphavantage),
+# the timeout of a single source and the optional API keys and RSS feed URL template.
+NEWS_SOURCES = [name.strip() for name in os.getenv('NEWS_SOURCES', 'yfinance,rss,newsapi,alphavantage').split(',')
+                if name.strip()]
+NEWS_SOURCE_TIMEOUT = float(os.getenv('NEWS_SOURCE_TIMEOUT', '10'))
+NEWSAPI_KEY = os.getenv('NEWSAPI_KEY')
+ALPHAVANTAGE_API_KEY = os.getenv('ALPHAVANTAGE_API_KEY')
+RSS_FEED_TEMPLATE = os.getenv(
+    'RSS_FEED_TEMPLATE', 'https://feeds.finance.yahoo.com/rss/2.0/headline?s={ticker}&region=US&lang=en-US'
+)
+
+# Near-duplicate story detection: maximum Hamming distance between two 64-bit
+# SimHash fingerprints of normalized titles for the stories to count as the same.
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', '3'))
+
+# Article context for the LLM: whether article bodies are fetched at all, the number of sentences
+# the extractive summarizer keeps (lexrank or lsa), the fetch timeout and how long extracted texts are cached.
+ARTICLE_CONTEXT_ENABLED = os.getenv('ARTICLE_CONTEXT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ARTICLE_SENTENCES = int(os.getenv('ARTICLE_SENTENCES', '3'))
+ARTICLE_SUMMARIZER = os.getenv('ARTICLE_SUMMARIZER', 'lexrank').lower()
+ARTICLE_FETCH_TIMEOUT = float(os.getenv('ARTICLE_FETCH_TIMEOUT', '10'))
+ARTICLE_CACHE_TTL_SECONDS = int(os.getenv('ARTICLE_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# Webhook update processing: number of worker coroutines handling updates concurrently and
+# the maximum number of queued updates; when the queue is full the webhook answers 503.
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '256'))
+
+# Bearer token of the /metrics route of the web app; the route is disabled while it is not set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Digest checkpoints: an unfinished run of the same shard started less than this many seconds ago
+# is resumed (users who already received it are skipped); older unfinished runs are abandoned.
+# A run is only resumed once the process executing it sent no heartbeat for DIGEST_LEASE_SECONDS.
+# Finished runs and their delivery records are kept for DIGEST_RUN_RETENTION_DAYS.
+DIGEST_RESUME_WINDOW_SECONDS = int(os.getenv('DIGEST_RESUME_WINDOW_SECONDS', str(12 * 3600)))
+DIGEST_LEASE_SECONDS = int(os.getenv('DIGEST_LEASE_SECONDS', '300'))
+DIGEST_RUN_RETENTION_DAYS = int(os.getenv('DIGEST_RUN_RETENTION_DAYS', '14'))
+
+# A digest that failed with a transient error is tried again DIGEST_RETRY_DELAY_SECONDS later, but not
+# after the user's next regular delivery. Users whose chat refuses messages get no digest until they
+# talk to the bot again.
+DIGEST_RETRY_DELAY_SECONDS = int(os.getenv('DIGEST_RETRY_DELAY_SECONDS', '3600'))
+
+# Local pre-scoring: of the new items of every ticker, only the DIGEST_TOP_K best scored ones
+# (1-10, see scoring.py) go to the LLM and into the digest, and none below DIGEST_MIN_SCORE.
+# Users can change their k with /topk, for all their tickers or for one.
+DIGEST_TOP_K = int(os.getenv('DIGEST_TOP_K', '3'))
+DIGEST_MIN_SCORE = int(os.getenv('DIGEST_MIN_SCORE', '1'))
+
+# Sentiment momentum (see sentiment.py): the sentiment of a ticker is its mean news impact over
+# SENTIMENT_SHORT_DAYS, compared with the SENTIMENT_LONG_DAYS baseline. A sign change of at least
+# SENTIMENT_REVERSAL_THRESHOLD against the previous short window is a reversal.
+SENTIMENT_SHORT_DAYS = int(os.getenv('SENTIMENT_SHORT_DAYS', '3'))
+SENTIMENT_LONG_DAYS = int(os.getenv('SENTIMENT_LONG_DAYS', '14'))
+SENTIMENT_REVERSAL_THRESHOLD = float(os.getenv('SENTIMENT_REVERSAL_THRESHOLD', '0.5'))
+SENTIMENT_RETENTION_DAYS = int(os.getenv('SENTIMENT_RETENTION_DAYS', '60'))
+
+# Price alerts: all alerted tickers are downloaded in one bulk request every PRICE_ALERT_TICK_SECONDS.
+# A fired alert is re-armed once the price is back more than PRICE_ALERT_HYSTERESIS_PERCENT on the
+# other side of its level (percentage points for daily-move alerts). A user has at most
+# MAX_PRICE_ALERTS_PER_USER alerts. A fired alert whose message keeps failing is disarmed after
+# PRICE_ALERT_MAX_SEND_ATTEMPTS ticks.
+PRICE_ALERT_TICK_SECONDS = int(os.getenv('PRICE_ALERT_TICK_SECONDS', '60'))
+PRICE_ALERT_HYSTERESIS_PERCENT = float(os.getenv('PRICE_ALERT_HYSTERESIS_PERCENT', '1.0'))
+PRICE_ALERT_MAX_SEND_ATTEMPTS = int(os.getenv('PRICE_ALERT_MAX_SEND_ATTEMPTS', '5'))
+MAX_PRICE_ALERTS_PER_USER = int(os.getenv('MAX_PRICE_ALERTS_PER_USER', '20'))
+
+# Gemini quota shared by all processes (defaults: the free tier of gemini-2.5-flash). Requests of the
+# batch lane (digest, alerts) leave LLM_INTERACTIVE_RESERVE of every limit to the interactive lane
+# (commands in the web app). A request that would wait longer than LLM_MAX_WAIT_*_SECONDS for quota
+# gets a degraded summary instead.
+LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', '10'))
+LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', '250000'))
+LLM_REQUESTS_PER_DAY = int(os.getenv('LLM_REQUESTS_PER_DAY', '250'))
+LLM_INTERACTIVE_RESERVE = float(os.getenv('LLM_INTERACTIVE_RESERVE', '0.2'))
+LLM_MAX_WAIT_INTERACTIVE_SECONDS = float(os.getenv('LLM_MAX_WAIT_INTERACTIVE_SECONDS', '10'))
+LLM_MAX_WAIT_BATCH_SECONDS = float(os.getenv('LLM_MAX_WAIT_BATCH_SECONDS', '300'))
+
+# Circuit breaker: after LLM_BREAKER_FAILURES consecutive failures, or at once on a quota error, no
+# request is sent for LLM_BREAKER_COOLDOWN_SECONDS and degraded summaries are served instead.
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv('LLM_BREAKER_COOLDOWN_SECONDS', '60'))
+
+# On-demand /news: answered from pre-rendered news per ticker and language. Answers older than
+# TICKER_NEWS_MAX_AGE_SECONDS are still served, and refreshed in the background. The worker in
+# run_alerts.py handles the queued refreshes every TICKER_NEWS_TICK_SECONDS and pre-warms the
+# TICKER_NEWS_PREWARM_COUNT most followed pairs every TICKER_NEWS_PREWARM_SECONDS.
+TICKER_NEWS_ITEMS = int(os.getenv('TICKER_NEWS_ITEMS', '5'))
+TICKER_NEWS_MAX_AGE_SECONDS = int(os.getenv('TICKER_NEWS_MAX_AGE_SECONDS', '3600'))
+TICKER_NEWS_TICK_SECONDS = int(os.getenv('TICKER_NEWS_TICK_SECONDS', '10'))
+TICKER_NEWS_REFRESH_BATCH = int(os.getenv('TICKER_NEWS_REFRESH_BATCH', '50'))
+TICKER_NEWS_PREWARM_COUNT = int(os.getenv('TICKER_NEWS_PREWARM_COUNT', '50'))
+TICKER_NEWS_PREWARM_SECONDS = int(os.getenv('TICKER_NEWS_PREWARM_SECONDS', '1800'))
+
+# Delivery schedule: users who picked the same local delivery time are spread over this many
+# minutes (a stable offset per user), so a popular time does not become a burst.
+DELIVERY_SPREAD_MINUTES = int(os.getenv('DELIVERY_SPREAD_MINUTES', '30'))
+
+# Intraday alerts: the worker wakes up every ALERT_TICK_SECONDS and polls at most ALERT_BATCH_SIZE
+# due tickers. A ticker is polled every ALERT_MAX_INTERVAL_SECONDS / sqrt(subscribers), but not more
+# often than ALERT_MIN_INTERVAL_SECONDS. Items older than ALERT_MAX_AGE_SECONDS are never pushed, and
+# only items with a local importance score (1-10, see scoring.py) of at least ALERT_MIN_SCORE are.
+ALERT_TICK_SECONDS = int(os.getenv('ALERT_TICK_SECONDS', '60'))
+ALERT_BATCH_SIZE = int(os.getenv('ALERT_BATCH_SIZE', '50'))
+ALERT_MIN_INTERVAL_SECONDS = int(os.getenv('ALERT_MIN_INTERVAL_SECONDS', '300'))
+ALERT_MAX_INTERVAL_SECONDS = int(os.getenv('ALERT_MAX_INTERVAL_SECONDS', '3600'))
+ALERT_MAX_AGE_SECONDS = int(os.getenv('ALERT_MAX_AGE_SECONDS', str(3 * 3600)))
+ALERT_MIN_SCORE = int(os.getenv('ALERT_MIN_SCORE', '7'))
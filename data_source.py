@@ -2,41 +2,197 @@
 Module for fetching news from external sources.
 """
 
-import yfinance as yf
+import hashlib
 import logging
+from datetime import datetime
+import metrics
+from ticker_registry import TickerRegistry
+
+YFINANCE_REQUEST_SECONDS = metrics.histogram(
+    'yfinance_request_seconds', 'Latency of yfinance calls', ('operation',)
+)
+YFINANCE_ERRORS = metrics.counter('yfinance_errors_total', 'Failed yfinance calls', ('operation',))
+
+
+def _yfinance():
+    """
+    Imports yfinance on first use: together with pandas and numpy it takes about half
+    a second, which web app commands that never fetch market data should not pay.
+    """
+    import yfinance
+    return yfinance
+
+
+# Callable ticker -> yfinance.Ticker-like object; None means yfinance.Ticker
+_ticker_factory = None
+
+
+def set_ticker_factory(factory):
+    """
+    Replaces yfinance.Ticker, e.g. with a local stand-in for benchmarks.
+    :param factory: callable returning an object with .news, .info and .history(), or None to reset
+    """
+    global _ticker_factory
+    _ticker_factory = factory
+
+
+def _ticker(symbol):
+    return (_ticker_factory or _yfinance().Ticker)(symbol)
+
+
+# Callable with the signature of yfinance.download; None means yfinance.download
+_quote_downloader = None
+
+
+def set_quote_downloader(downloader):
+    """
+    Replaces yfinance.download, e.g. with a local stand-in for benchmarks.
+    :param downloader: callable(tickers, **kwargs) returning a DataFrame like yfinance.download, or None to reset
+    """
+    global _quote_downloader
+    _quote_downloader = downloader
+
+
+def parse_timestamp(value):
+    """
+    Converts a unix timestamp or an ISO 8601 string to a unix timestamp.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+        except ValueError:
+            return None
+    return None
+
+
+def normalize_yfinance_item(item):
+    """
+    Converts a yfinance news item to {'id', 'title', 'link', 'published'}.
+    Supports both the flat format of older yfinance versions and the nested 'content' format.
+    :return: the normalized item, or None if it has no title or link
+    """
+    content = item.get('content') or item
+    title = content.get('title')
+    link = (
+        content.get('link')
+        or (content.get('canonicalUrl') or {}).get('url')
+        or (content.get('clickThroughUrl') or {}).get('url')
+    )
+    if not title or not link:
+        return None
+    published = parse_timestamp(
+        content.get('providerPublishTime') or content.get('pubDate') or content.get('displayTime')
+    )
+    item_id = item.get('id') or item.get('uuid') or hashlib.sha256(link.encode()).hexdigest()
+    return {'id': item_id, 'title': title, 'link': link, 'published': published}
+
+
+def fetch_yfinance_news(ticker):
+    """
+    Fetches news for a given ticker from Yahoo Finance, letting errors propagate.
+    :return: list of dicts with 'id', 'title', 'link' and 'published' (unix time or None)
+    """
+    try:
+        with YFINANCE_REQUEST_SECONDS.time(operation='news'):
+            news = _ticker(ticker).news
+    except Exception:
+        YFINANCE_ERRORS.inc(operation='news')
+        raise
+    if not news:
+        logging.info(f"No news found for ticker {ticker} on Yahoo Finance.")
+        return []
+    return [normalized for normalized in map(normalize_yfinance_item, news) if normalized]
 
 
 def get_news_from_yfinance(ticker):
     """
     Fetches news for a given ticker from Yahoo Finance.
+    :return: list of dicts with 'id', 'title', 'link' and 'published' (unix time or None)
     """
     try:
-        stock = yf.Ticker(ticker)
-        news = stock.news
-        if not news:
-            logging.info(f"No news found for ticker {ticker} on Yahoo Finance.")
-            return []
-        return [{'title': item['title'], 'link': item['link']} for item in news]
+        return fetch_yfinance_news(ticker)
     except Exception as e:
         logging.error(f"Error fetching news for {ticker} from yfinance: {e}")
         return []
 
 
-def validate_ticker(ticker):
+def fetch_quotes(tickers):
+    """
+    Fetches the latest daily closes of many tickers with one bulk yfinance.download call.
+    During trading hours the close of the current day is the latest price.
+    :param tickers: list of ticker symbols
+    :return: (last, previous) float arrays parallel to tickers: the latest close and the close
+        of the trading day before it, NaN where yfinance returned nothing
+    """
+    import numpy as np
+    if not tickers:
+        return np.empty(0), np.empty(0)
+    try:
+        with YFINANCE_REQUEST_SECONDS.time(operation='download'):
+            frame = (_quote_downloader or _yfinance().download)(
+                list(tickers), period='5d', interval='1d', group_by='column', auto_adjust=False,
+                progress=False, threads=True
+            )
+        closes = frame['Close']
+        # A single ticker may come back as a Series instead of one column
+        if closes.ndim == 1:
+            closes = closes.to_frame(tickers[0])
+        closes = closes.reindex(columns=list(tickers)).to_numpy(dtype=float)
+    except Exception as e:
+        YFINANCE_ERRORS.inc(operation='download')
+        logging.error(f"Error downloading quotes of {len(tickers)} tickers from yfinance: {e}")
+        nothing = np.full(len(tickers), np.nan)
+        return nothing, nothing.copy()
+
+    # The last and the one-but-last non-NaN row of every column
+    columns = np.arange(closes.shape[1])
+    present = ~np.isnan(closes)
+    last_row = closes.shape[0] - 1 - np.argmax(present[::-1], axis=0)
+    last = np.where(present.any(axis=0), closes[last_row, columns], np.nan)
+    present[last_row, columns] = False
+    previous_row = closes.shape[0] - 1 - np.argmax(present[::-1], axis=0)
+    previous = np.where(present.any(axis=0), closes[previous_row, columns], np.nan)
+    return last, previous
+
+
+def check_ticker_online(ticker):
     """
-    Checks if a ticker exists using yfinance.
+    Checks if a ticker exists using yfinance (network call).
+    :return: (is_valid, name), or (None, None) if the check itself failed
     """
     try:
-        stock = yf.Ticker(ticker)
-        # If the ticker has a 'shortName' or 'symbol', it's considered valid.
-        # stock.info can be empty for invalid tickers or cause an error.
-        if stock.info.get('shortName') or stock.info.get('symbol'):
-            return True
-        # Sometimes .info is empty but the ticker exists, let's try another method.
-        hist = stock.history(period='1d')
-        if not hist.empty:
-            return True
-        return False
+        with YFINANCE_REQUEST_SECONDS.time(operation='validate'):
+            stock = _ticker(ticker)
+            # If the ticker has a 'shortName' or 'symbol', it's considered valid.
+            # stock.info can be empty for invalid tickers or cause an error.
+            info = stock.info or {}
+            name = info.get('shortName') or info.get('longName')
+            if name or info.get('symbol'):
+                return True, name
+            # Sometimes .info is empty but the ticker exists, let's try another method.
+            hist = stock.history(period='1d')
+            return not hist.empty, None
     except Exception as e:
+        YFINANCE_ERRORS.inc(operation='validate')
         logging.warning(f"Error validating ticker {ticker}: {e}")
-        return False
+        return None, None
+
+
+# Local symbol index: repeat validations are served from memory
+ticker_registry = TickerRegistry(checker=check_ticker_online)
+
+
+def validate_ticker(ticker):
+    """
+    Checks if a ticker exists, using the local registry before yfinance.
+    """
+    return ticker_registry.validate(ticker)
+
+
+def suggest_tickers(ticker, limit=3):
+    """
+    Returns known tickers similar to the given one.
+    """
+    return ticker_registry.suggest(ticker, limit)
@@ -2,97 +2,581 @@
 Module for all operations with the SQLite database.
 """
 
+import hashlib
+import json
+import os
+import socket
 import sqlite3
 import logging
+import threading
+import time
+
+import metrics
 
 DATABASE_NAME = 'bot_database.db'
 
+# Seconds a connection waits for a lock held by another process (web app vs. digest)
+BUSY_TIMEOUT_MS = 5000
+
+# SQLite limits the number of host parameters per statement; bulk lookups are chunked
+MAX_QUERY_PARAMS = 500
+
+_local = threading.local()
+
+DB_QUERY_SECONDS = metrics.histogram('db_query_seconds', 'Latency of database operations', ('operation',))
+
+
+def _timed(func):
+    """
+    Records the latency of a database operation, labelled with the function name.
+    """
+    return DB_QUERY_SECONDS.time(operation=func.__name__)(func)
+
+
+def shard_key(chat_id):
+    """
+    Returns the stable hash of a user that assigns them to a digest shard (shard_key % shard_count).
+    Unlike the built-in hash() of Python it is the same across processes and machines, and it fits
+    in a signed SQLite integer. Stored in users.shard_key, so shards are selected in SQL.
+    """
+    digest = hashlib.blake2b(str(chat_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
 
 def get_db_connection():
     """
-    Creates a connection to the database.
+    Returns the connection of the current thread, creating it on first use.
+    Connections are reused, run in WAL mode and wait for locks instead of failing.
     """
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(DATABASE_NAME)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_NAME, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.create_function('shard_key', 1, shard_key, deterministic=True)
+        connections[DATABASE_NAME] = conn
     return conn
 
 
-def init_db():
+def close_db_connection():
     """
-    Initializes the database by creating the necessary tables.
+    Closes the connections of the current thread.
     """
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        # Table to store users and their settings
-        cursor.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS users (
-                chat_id INTEGER PRIMARY KEY,
-                language TEXT DEFAULT 'ru',
-                risk_profile TEXT DEFAULT 'moderate',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            '''
+    connections = getattr(_local, 'connections', {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+def _migration_initial_schema(cursor):
+    # Table to store users and their settings
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            chat_id INTEGER PRIMARY KEY,
+            language TEXT DEFAULT 'ru',
+            risk_profile TEXT DEFAULT 'moderate',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        # Table to store tickers a user is subscribed to
-        cursor.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS user_tickers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                ticker TEXT,
-                FOREIGN KEY (chat_id) REFERENCES users (chat_id)
-            '''
+        '''
+    )
+    # Table to store tickers a user is subscribed to
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS user_tickers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            ticker TEXT,
+            FOREIGN KEY (chat_id) REFERENCES users (chat_id)
         )
-        # Table for caching processed news and LLM responses
-        cursor.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS news_cache (
-                url_hash TEXT PRIMARY KEY,
-                processed_summary TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            '''
+        '''
+    )
+
+
+def _migration_language_aware_cache(cursor):
+    # Table for caching processed news and LLM responses.
+    # Older databases keyed the cache by URL only; such entries are not
+    # language-aware and cannot be trusted, so the table is rebuilt.
+    cursor.execute('DROP TABLE IF EXISTS news_cache')
+    cursor.execute(
+        '''
+        CREATE TABLE news_cache (
+            cache_key TEXT PRIMARY KEY,
+            processed_summary TEXT,
+            language TEXT,
+            model TEXT,
+            prompt_version TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        conn.commit()
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_news_cache_timestamp ON news_cache (timestamp)')
+
+
+def _migration_unique_subscriptions(cursor):
+    # Drop duplicate subscriptions so the unique index can be created
+    cursor.execute(
+        '''
+        DELETE FROM user_tickers WHERE id NOT IN (
+            SELECT MIN(id) FROM user_tickers GROUP BY chat_id, ticker
+        )
+        '''
+    )
+    cursor.execute('CREATE UNIQUE INDEX idx_user_tickers_chat_ticker ON user_tickers (chat_id, ticker)')
+    cursor.execute('CREATE INDEX idx_user_tickers_ticker ON user_tickers (ticker)')
+
+
+def _migration_ticker_registry(cursor):
+    # Local index of known ticker symbols and cached validation results
+    cursor.execute(
+        '''
+        CREATE TABLE ticker_registry (
+            symbol TEXT PRIMARY KEY,
+            is_valid INTEGER NOT NULL,
+            name TEXT,
+            source TEXT,
+            checked_at REAL NOT NULL
+        )
+        '''
+    )
+
+
+def _migration_news_store(cursor):
+    # Per-ticker news items, the time each ticker was last fetched and
+    # the newest item delivered to every user for every ticker
+    cursor.execute(
+        '''
+        CREATE TABLE news_items (
+            ticker TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            title TEXT,
+            link TEXT,
+            published_at REAL NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (ticker, item_id)
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_news_items_ticker_published ON news_items (ticker, published_at)')
+    cursor.execute('CREATE TABLE news_fetch_log (ticker TEXT PRIMARY KEY, fetched_at REAL NOT NULL)')
+    cursor.execute(
+        '''
+        CREATE TABLE delivery_watermarks (
+            chat_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            last_published_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, ticker)
+        )
+        '''
+    )
+
+
+def _migration_news_sources(cursor):
+    # News now comes from several sources: remember the source and
+    # keep one row per link, whichever source reported it first
+    cursor.execute('ALTER TABLE news_items ADD COLUMN source TEXT')
+    cursor.execute(
+        '''
+        DELETE FROM news_items WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM news_items GROUP BY ticker, link
+        )
+        '''
+    )
+    cursor.execute('CREATE UNIQUE INDEX idx_news_items_ticker_link ON news_items (ticker, link)')
+
+
+def _migration_story_fingerprints(cursor):
+    # SimHash fingerprints of stories for near-duplicate detection. Every fingerprint
+    # is split into bands; stories sharing a band are candidates for a full comparison.
+    cursor.execute(
+        '''
+        CREATE TABLE story_fingerprints (
+            link TEXT PRIMARY KEY,
+            fingerprint INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_story_fingerprints_created_at ON story_fingerprints (created_at)')
+    cursor.execute(
+        '''
+        CREATE TABLE story_fingerprint_bands (
+            band_key INTEGER NOT NULL,
+            link TEXT NOT NULL,
+            PRIMARY KEY (band_key, link)
+        ) WITHOUT ROWID
+        '''
+    )
+
+
+def _migration_article_texts(cursor):
+    # Extracted article bodies and their extractive summaries, so an article is downloaded
+    # and condensed once. A failed download is stored with empty text and not retried until it expires.
+    cursor.execute(
+        '''
+        CREATE TABLE article_texts (
+            link TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            condensed TEXT NOT NULL,
+            method TEXT NOT NULL,
+            sentence_count INTEGER NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_article_texts_fetched_at ON article_texts (fetched_at)')
+
+
+def _migration_run_summaries(cursor):
+    # Structured summary (stats, stage timings, metrics) of every digest run, as JSON
+    cursor.execute(
+        '''
+        CREATE TABLE run_summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            finished_at REAL NOT NULL,
+            summary TEXT NOT NULL
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_run_summaries_kind ON run_summaries (kind, finished_at)')
+
+
+def _migration_digest_checkpoints(cursor):
+    # One row per digest run of a shard; 'running' rows are resumed after a crash
+    cursor.execute(
+        '''
+        CREATE TABLE digest_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            shard_index INTEGER NOT NULL,
+            shard_count INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at REAL NOT NULL,
+            finished_at REAL
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_digest_runs_status ON digest_runs (status, started_at)')
+    # Users who received the digest of a run, written as each message is delivered
+    cursor.execute(
+        '''
+        CREATE TABLE digest_deliveries (
+            run_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            delivered_at REAL NOT NULL,
+            PRIMARY KEY (run_id, chat_id)
+        ) WITHOUT ROWID
+        '''
+    )
+
+
+def _migration_delivery_schedule(cursor):
+    # Delivery preferences of every user and the unix time of their next digest.
+    # NULL next_due_at means due at once; the index lets the scheduler pick the due users cheaply.
+    cursor.execute("ALTER TABLE users ADD COLUMN timezone TEXT NOT NULL DEFAULT 'UTC'")
+    cursor.execute("ALTER TABLE users ADD COLUMN delivery_time TEXT NOT NULL DEFAULT '08:00'")
+    cursor.execute("ALTER TABLE users ADD COLUMN frequency TEXT NOT NULL DEFAULT 'daily'")
+    cursor.execute('ALTER TABLE users ADD COLUMN next_due_at REAL')
+    cursor.execute('CREATE INDEX idx_users_next_due_at ON users (next_due_at)')
+
+
+def _migration_alerts(cursor):
+    # When the alert worker polls every ticker next, and the stories it has already seen per ticker
+    cursor.execute(
+        '''
+        CREATE TABLE alert_poll_state (
+            ticker TEXT PRIMARY KEY,
+            next_poll_at REAL NOT NULL,
+            last_polled_at REAL NOT NULL
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE TABLE alert_seen (
+            ticker TEXT NOT NULL,
+            link TEXT NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (ticker, link)
+        ) WITHOUT ROWID
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_alert_seen_seen_at ON alert_seen (seen_at)')
+
+
+def _migration_top_k(cursor):
+    # How many items per ticker a user gets in the digest; NULL means the default.
+    # A subscription's own value overrides the user's.
+    cursor.execute('ALTER TABLE users ADD COLUMN top_k INTEGER')
+    cursor.execute('ALTER TABLE user_tickers ADD COLUMN top_k INTEGER')
+
+
+def _migration_sentiment(cursor):
+    # Impact of every summarized story per ticker (-1, 0, 1), parsed from the LLM summaries
+    cursor.execute(
+        '''
+        CREATE TABLE sentiment_observations (
+            ticker TEXT NOT NULL,
+            link TEXT NOT NULL,
+            published_at REAL NOT NULL,
+            impact INTEGER NOT NULL,
+            PRIMARY KEY (ticker, link)
+        ) WITHOUT ROWID
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_sentiment_observations_published ON sentiment_observations (published_at)')
+
+
+def _migration_price_alerts(cursor):
+    # Price alerts of the users: 'above' and 'below' fire when the price crosses `level`,
+    # 'move' when the daily change exceeds `level` percent. A fired alert is disarmed until
+    # the price moves back past its hysteresis band.
+    cursor.execute(
+        '''
+        CREATE TABLE price_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            level REAL NOT NULL,
+            armed INTEGER NOT NULL DEFAULT 1,
+            triggered_at REAL,
+            created_at REAL NOT NULL
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX idx_price_alerts_chat_id ON price_alerts (chat_id)')
+
+
+def _migration_llm_quota(cursor):
+    # LLM quota shared by all processes: the token buckets of the per-minute limits
+    # and the usage of every (UTC) day
+    cursor.execute(
+        '''
+        CREATE TABLE llm_quota_buckets (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE TABLE llm_quota_usage (
+            day TEXT PRIMARY KEY,
+            requests INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0
+        )
+        '''
+    )
+
+
+def _migration_ticker_news(cursor):
+    # Pre-rendered /news answers per ticker and language, and the queue of refreshes
+    # requested by the web app (notify: send the result to the chat when it is ready)
+    cursor.execute(
+        '''
+        CREATE TABLE ticker_news (
+            ticker TEXT NOT NULL,
+            language TEXT NOT NULL,
+            message TEXT NOT NULL,
+            built_at REAL NOT NULL,
+            PRIMARY KEY (ticker, language)
+        ) WITHOUT ROWID
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE TABLE ticker_news_requests (
+            ticker TEXT NOT NULL,
+            language TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            notify INTEGER NOT NULL,
+            requested_at REAL NOT NULL,
+            PRIMARY KEY (ticker, language, chat_id)
+        ) WITHOUT ROWID
+        '''
+    )
+
+
+def _migration_shard_key(cursor):
+    # Digest shard hash of every user (see shard_key()), so a shard is selected in SQL
+    cursor.execute('ALTER TABLE users ADD COLUMN shard_key INTEGER')
+    cursor.execute('UPDATE users SET shard_key = shard_key(chat_id)')
+
+
+def _migration_blocked_users(cursor):
+    # Users whose chat refuses messages (bot blocked, chat deleted) are skipped until they return
+    cursor.execute('ALTER TABLE users ADD COLUMN blocked_at REAL')
+
+
+def _migration_summary_retries(cursor):
+    # Items a user got with a degraded summary, sent again once the LLM can summarize them
+    cursor.execute(
+        '''
+        CREATE TABLE summary_retries (
+            chat_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            link TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, ticker, link)
+        ) WITHOUT ROWID
+        '''
+    )
+
+
+def _migration_digest_run_lease(cursor):
+    # Lease of a running digest run: the process that owns it and when it last proved to be alive
+    cursor.execute('ALTER TABLE digest_runs ADD COLUMN owner TEXT')
+    cursor.execute('ALTER TABLE digest_runs ADD COLUMN heartbeat_at REAL')
+
+
+def _migration_alert_deliveries(cursor):
+    # Stories pushed to a user as alerts; they are left out of the user's next digest
+    cursor.execute(
+        '''
+        CREATE TABLE alert_deliveries (
+            chat_id INTEGER NOT NULL,
+            link TEXT NOT NULL,
+            delivered_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, link)
+        ) WITHOUT ROWID
+        '''
+    )
+
+
+# Schema migrations, applied in order. The index of the last applied migration + 1
+# is stored in PRAGMA user_version, so existing databases are upgraded in place.
+# Never edit a released migration: append a new one instead.
+MIGRATIONS = [
+    _migration_initial_schema,
+    _migration_language_aware_cache,
+    _migration_unique_subscriptions,
+    _migration_ticker_registry,
+    _migration_news_store,
+    _migration_news_sources,
+    _migration_story_fingerprints,
+    _migration_article_texts,
+    _migration_run_summaries,
+    _migration_digest_checkpoints,
+    _migration_delivery_schedule,
+    _migration_alerts,
+    _migration_top_k,
+    _migration_sentiment,
+    _migration_price_alerts,
+    _migration_llm_quota,
+    _migration_ticker_news,
+    _migration_shard_key,
+    _migration_blocked_users,
+    _migration_summary_retries,
+    _migration_digest_run_lease,
+    _migration_alert_deliveries,
+]
+
+
+def init_db():
+    """
+    Initializes the database: creates the tables and applies pending migrations.
+    """
+    conn = get_db_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {number}')
+        logging.info(f"Applied database migration {number}: {migration.__name__}")
     logging.info('Database initialized.')
 
 
+@_timed
 def add_or_update_user(chat_id, language='ru'):
     """
-    Adds a new user or updates an existing one.
+    Adds a new user or updates an existing one. A blocked user who talks to the bot again is unblocked.
     """
     with get_db_connection() as conn:
         conn.execute(
-            'INSERT OR REPLACE INTO users (chat_id, language) VALUES (?, ?)',
+            '''
+            INSERT INTO users (chat_id, language, shard_key) VALUES (?1, ?2, shard_key(?1))
+            ON CONFLICT (chat_id) DO UPDATE SET language = excluded.language, blocked_at = NULL
+            ''',
             (chat_id, language)
         )
-        conn.commit()
     logging.info(f"User {chat_id} added or updated")
 
 
+@_timed
+def add_or_update_users(users):
+    """
+    Bulk version of add_or_update_user().
+    :param users: iterable of (chat_id, language)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            '''
+            INSERT INTO users (chat_id, language, shard_key) VALUES (?1, ?2, shard_key(?1))
+            ON CONFLICT (chat_id) DO UPDATE SET language = excluded.language
+            ''',
+            users
+        )
+
+
+@_timed
+def ensure_user(chat_id):
+    """
+    Creates the user with default settings if it does not exist yet, and unblocks a blocked user.
+    """
+    with get_db_connection() as conn:
+        conn.execute(
+            '''
+            INSERT INTO users (chat_id, shard_key) VALUES (?1, shard_key(?1))
+            ON CONFLICT (chat_id) DO UPDATE SET blocked_at = NULL WHERE blocked_at IS NOT NULL
+            ''',
+            (chat_id,)
+        )
+
+
+@_timed
 def add_ticker_for_user(chat_id, ticker):
     """
     Adds a ticker for a user.
+    :return: True if the ticker was added, False if the user already had it
     """
     ticker = ticker.upper()
     with get_db_connection() as conn:
-        # Check if the subscription already exists
-        exists = conn.execute(
-            'SELECT 1 FROM user_tickers WHERE chat_id = ? AND ticker = ?',
+        # The unique (chat_id, ticker) index makes duplicates a no-op
+        added = conn.execute(
+            'INSERT OR IGNORE INTO user_tickers (chat_id, ticker) VALUES (?, ?)',
             (chat_id, ticker)
-        ).fetchone()
-        if not exists:
-            conn.execute(
-                'INSERT INTO user_tickers (chat_id, ticker) VALUES (?, ?)',
-                (chat_id, ticker)
-            )
-            conn.commit()
-            logging.info(f"Ticker {ticker} added for user {chat_id}.")
-            return True
-    return False
+        ).rowcount > 0
+    if added:
+        logging.info(f"Ticker {ticker} added for user {chat_id}.")
+    return added
+
 
+@_timed
+def add_subscriptions(subscriptions):
+    """
+    Bulk version of add_ticker_for_user().
+    :param subscriptions: iterable of (chat_id, ticker)
+    :return: the number of subscriptions actually added
+    """
+    with get_db_connection() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            'INSERT OR IGNORE INTO user_tickers (chat_id, ticker) VALUES (?, ?)',
+            ((chat_id, ticker.upper()) for chat_id, ticker in subscriptions)
+        )
+        return conn.total_changes - before
 
+
+@_timed
 def remove_ticker_for_user(chat_id, ticker):
     """
     Removes a ticker for a user.
@@ -103,11 +587,11 @@ def remove_ticker_for_user(chat_id, ticker):
             'DELETE FROM user_tickers WHERE chat_id = ? AND ticker = ?',
             (chat_id, ticker)
         )
-        conn.commit()
         logging.info(f"Ticker {ticker} removed for user {chat_id}.")
         return result.rowcount > 0
 
 
+@_timed
 def get_user_ticker(chat_id):
     """
     Returns a list of tickers for a user.
@@ -122,48 +606,1163 @@ def get_user_ticker(chat_id):
         return [row['ticker'] for row in tickers]
 
 
-def get_all_users_with_tickers():
+def iter_subscriptions(due_at=None, shard=(0, 1), page_size=1000):
+    """
+    Streams the subscriptions of all users for the digest, ordered by chat_id and ticker, so the
+    rows of one user are consecutive. Pages are read with keyset pagination on chat_id: every page
+    is one short statement, so no read transaction stays open while the digest writes deliveries.
+    Blocked users (see block_users()) are left out.
+    :param due_at: if given, only the users whose next delivery is due at this unix time
+    :param shard: (index, count): only the users whose shard_key falls in shard `index`
+    :param page_size: number of users read at a time
+    :yield: lists of the rows (chat_id, language, timezone, delivery_time, frequency, top_k, ticker)
+        of up to page_size complete users
+    """
+    shard_index, shard_count = shard
+    filters = ['blocked_at IS NULL', 'EXISTS (SELECT 1 FROM user_tickers WHERE user_tickers.chat_id = users.chat_id)']
+    params = []
+    if due_at is not None:
+        filters.append('(next_due_at IS NULL OR next_due_at <= ?)')
+        params.append(due_at)
+    if shard_count > 1:
+        filters.append('shard_key % ? = ?')
+        params.extend((shard_count, shard_index))
+    query = """
+        SELECT u.chat_id, u.language, u.timezone, u.delivery_time, u.frequency, u.top_k, ut.ticker
+        FROM (
+            SELECT chat_id, language, timezone, delivery_time, frequency, top_k FROM users
+            WHERE {filters}
+            ORDER BY chat_id
+            LIMIT ?
+        ) u
+        JOIN user_tickers ut ON ut.chat_id = u.chat_id
+        ORDER BY u.chat_id, ut.ticker
+    """
+    conn = get_db_connection()
+    last_chat_id = None
+    while True:
+        if last_chat_id is None:
+            page = conn.execute(query.format(filters=' AND '.join(filters)), (*params, page_size))
+        else:
+            page = conn.execute(
+                query.format(filters=' AND '.join(['chat_id > ?'] + filters)), (last_chat_id, *params, page_size)
+            )
+        rows = [tuple(row) for row in page]
+        if not rows:
+            return
+        last_chat_id = rows[-1][0]
+        yield rows
+
+
+@_timed
+def get_user_language(chat_id):
+    """
+    Returns the language of a user, or None for unknown users.
+    """
+    row = get_db_connection().execute('SELECT language FROM users WHERE chat_id = ?', (chat_id,)).fetchone()
+    return row['language'] if row else None
+
+
+@_timed
+def get_user_schedule(chat_id):
+    """
+    Returns the delivery schedule of a user.
+    :return: dict with 'timezone', 'delivery_time', 'frequency' and 'next_due_at', or None for unknown users
+    """
+    row = get_db_connection().execute(
+        'SELECT timezone, delivery_time, frequency, next_due_at FROM users WHERE chat_id = ?', (chat_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+@_timed
+def set_user_schedule(chat_id, timezone, delivery_time, frequency, next_due_at):
+    """
+    Stores the delivery preferences of a user and their next delivery time.
+    """
+    with get_db_connection() as conn:
+        conn.execute(
+            '''
+            UPDATE users SET timezone = ?, delivery_time = ?, frequency = ?, next_due_at = ?
+            WHERE chat_id = ?
+            ''',
+            (timezone, delivery_time, frequency, next_due_at, chat_id)
+        )
+
+
+@_timed
+def set_next_due(entries):
+    """
+    Reschedules users.
+    :param entries: iterable of (next_due_at, chat_id)
+    """
+    with get_db_connection() as conn:
+        conn.executemany('UPDATE users SET next_due_at = ? WHERE chat_id = ?', entries)
+
+
+@_timed
+def block_users(chat_ids, blocked_at):
+    """
+    Marks users whose chat refuses messages (bot blocked, chat deleted): they get no digest
+    until they talk to the bot again (see ensure_user()).
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            'UPDATE users SET blocked_at = ? WHERE chat_id = ?', ((blocked_at, chat_id) for chat_id in chat_ids)
+        )
+
+
+@_timed
+def get_subscription_top_k():
+    """
+    Returns the subscriptions that have their own number of items per digest.
+    :return: dict (chat_id, ticker) -> k
+    """
+    rows = get_db_connection().execute(
+        'SELECT chat_id, ticker, top_k FROM user_tickers WHERE top_k IS NOT NULL'
+    ).fetchall()
+    return {(row['chat_id'], row['ticker']): row['top_k'] for row in rows}
+
+
+@_timed
+def get_user_top_k(chat_id):
+    """
+    Returns how many items per ticker a user gets in the digest, or None for the default.
+    """
+    row = get_db_connection().execute('SELECT top_k FROM users WHERE chat_id = ?', (chat_id,)).fetchone()
+    return row['top_k'] if row else None
+
+
+@_timed
+def set_user_top_k(chat_id, top_k):
+    """
+    Sets how many items per ticker a user gets in the digest (None for the default).
+    """
+    with get_db_connection() as conn:
+        conn.execute('UPDATE users SET top_k = ? WHERE chat_id = ?', (top_k, chat_id))
+
+
+@_timed
+def set_subscription_top_k(chat_id, ticker, top_k):
+    """
+    Sets how many items of one ticker a user gets in the digest (None for the user's default).
+    :return: True if the user follows the ticker
+    """
+    with get_db_connection() as conn:
+        result = conn.execute(
+            'UPDATE user_tickers SET top_k = ? WHERE chat_id = ? AND ticker = ?',
+            (top_k, chat_id, ticker.upper())
+        )
+        return result.rowcount > 0
+
+
+@_timed
+def get_ticker_registry():
+    """
+    Returns every row of the ticker registry.
+    :return: list of (symbol, is_valid, name, source, checked_at)
+    """
+    rows = get_db_connection().execute(
+        'SELECT symbol, is_valid, name, source, checked_at FROM ticker_registry'
+    ).fetchall()
+    return [tuple(row) for row in rows]
+
+
+@_timed
+def save_ticker_registry_entries(entries):
+    """
+    Inserts or replaces ticker registry rows.
+    :param entries: iterable of (symbol, is_valid, name, source, checked_at)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            '''
+            INSERT OR REPLACE INTO ticker_registry (symbol, is_valid, name, source, checked_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''',
+            entries
+        )
+
+
+@_timed
+def get_news_fetched_at(ticker):
+    """
+    Returns the unix time the news for a ticker was last fetched, or None.
+    """
+    row = get_db_connection().execute(
+        'SELECT fetched_at FROM news_fetch_log WHERE ticker = ?', (ticker,)
+    ).fetchone()
+    return row['fetched_at'] if row else None
+
+
+@_timed
+def save_news_items(ticker, items, fetched_at):
+    """
+    Stores freshly fetched news items for a ticker and records the fetch time.
+    Items already stored keep their original published time.
+    :param items: list of dicts with 'id', 'title', 'link', 'published' and optionally 'source'
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            '''
+            INSERT OR IGNORE INTO news_items (ticker, item_id, title, link, published_at, fetched_at, source)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''',
+            (
+                (ticker, item['id'], item['title'], item['link'], item['published'] or fetched_at, fetched_at,
+                 item.get('source'))
+                for item in items
+            )
+        )
+        conn.execute(
+            'INSERT OR REPLACE INTO news_fetch_log (ticker, fetched_at) VALUES (?, ?)',
+            (ticker, fetched_at)
+        )
+
+
+@_timed
+def get_stored_news(ticker, limit):
+    """
+    Returns the most recent stored news items of a ticker, newest first.
+    """
+    rows = get_db_connection().execute(
+        '''
+        SELECT item_id, title, link, published_at, source FROM news_items
+        WHERE ticker = ? ORDER BY published_at DESC LIMIT ?
+        ''',
+        (ticker, limit)
+    ).fetchall()
+    return [
+        {
+            'id': row['item_id'], 'title': row['title'], 'link': row['link'],
+            'published': row['published_at'], 'source': row['source'], 'ticker': ticker
+        }
+        for row in rows
+    ]
+
+
+@_timed
+def prune_news_items(max_age_seconds):
+    """
+    Deletes stored news items older than max_age_seconds.
+    :return: the number of deleted items
+    """
+    with get_db_connection() as conn:
+        return conn.execute(
+            "DELETE FROM news_items WHERE published_at < strftime('%s', 'now') - ?",
+            (max_age_seconds,)
+        ).rowcount
+
+
+@_timed
+def find_story_fingerprints(band_keys):
+    """
+    Returns the stored stories that share at least one band with the given keys.
+    :return: list of (link, fingerprint, created_at)
+    """
+    band_keys = list(set(band_keys))
+    found = {}
+    conn = get_db_connection()
+    for start in range(0, len(band_keys), MAX_QUERY_PARAMS):
+        chunk = band_keys[start:start + MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f'''
+            SELECT f.link, f.fingerprint, f.created_at FROM story_fingerprint_bands b
+            JOIN story_fingerprints f ON f.link = b.link
+            WHERE b.band_key IN ({','.join('?' * len(chunk))})
+            ''',
+            chunk
+        ).fetchall()
+        for row in rows:
+            found[row['link']] = (row['link'], row['fingerprint'], row['created_at'])
+    return list(found.values())
+
+
+@_timed
+def save_story_fingerprints(entries):
+    """
+    Stores story fingerprints and their band keys.
+    :param entries: iterable of (link, fingerprint, created_at, band_keys)
+    """
+    entries = list(entries)
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO story_fingerprints (link, fingerprint, created_at) VALUES (?, ?, ?)',
+            [(link, fingerprint, created_at) for link, fingerprint, created_at, _ in entries]
+        )
+        conn.executemany(
+            'INSERT OR IGNORE INTO story_fingerprint_bands (band_key, link) VALUES (?, ?)',
+            [(band_key, link) for link, _, _, band_keys in entries for band_key in band_keys]
+        )
+
+
+@_timed
+def prune_story_fingerprints(max_age_seconds):
+    """
+    Deletes story fingerprints older than max_age_seconds.
+    :return: the number of deleted fingerprints
+    """
+    with get_db_connection() as conn:
+        cutoff = time.time() - max_age_seconds
+        conn.execute(
+            '''
+            DELETE FROM story_fingerprint_bands WHERE link IN (
+                SELECT link FROM story_fingerprints WHERE created_at < ?
+            )
+            ''',
+            (cutoff,)
+        )
+        return conn.execute('DELETE FROM story_fingerprints WHERE created_at < ?', (cutoff,)).rowcount
+
+
+@_timed
+def get_article_texts(links, max_age_seconds):
+    """
+    Returns the cached article texts that are younger than max_age_seconds.
+    :return: dict link -> {'text', 'condensed', 'method', 'sentence_count'}
+    """
+    links = list(links)
+    found = {}
+    conn = get_db_connection()
+    cutoff = time.time() - max_age_seconds
+    for start in range(0, len(links), MAX_QUERY_PARAMS):
+        chunk = links[start:start + MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f'''
+            SELECT link, text, condensed, method, sentence_count FROM article_texts
+            WHERE link IN ({','.join('?' * len(chunk))}) AND fetched_at >= ?
+            ''',
+            chunk + [cutoff]
+        ).fetchall()
+        for row in rows:
+            found[row['link']] = {
+                'text': row['text'], 'condensed': row['condensed'],
+                'method': row['method'], 'sentence_count': row['sentence_count']
+            }
+    return found
+
+
+@_timed
+def save_article_texts(entries):
+    """
+    Stores extracted article texts.
+    :param entries: iterable of (link, text, condensed, method, sentence_count, fetched_at)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            '''
+            INSERT OR REPLACE INTO article_texts (link, text, condensed, method, sentence_count, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            entries
+        )
+
+
+@_timed
+def prune_article_texts(max_age_seconds):
+    """
+    Deletes cached article texts older than max_age_seconds.
+    :return: the number of deleted texts
+    """
+    with get_db_connection() as conn:
+        return conn.execute(
+            'DELETE FROM article_texts WHERE fetched_at < ?', (time.time() - max_age_seconds,)
+        ).rowcount
+
+
+@_timed
+def save_run_summary(kind, started_at, finished_at, summary):
     """
-    Returns all users and their subscriptions for the digest mailing.
+    Stores the structured summary of a run.
+    :param kind: type of the run, e.g. 'digest'
+    :param summary: JSON-serializable dict
     """
     with get_db_connection() as conn:
-        query = """
-            SELECT u.chat_id, u.language, GROUP_CONCAT(ut.ticker) as tickers
-            FROM users u
-            LEFT JOIN user_tickers ut ON u.chat_id = ut.chat_id
-            WHERE ut.ticker IS NOT NULL
-            GROUP BY u.chat_id, u.language
-        """
-        users = conn.execute(query).fetchall()
-        return [dict(user) for user in users]
+        conn.execute(
+            'INSERT INTO run_summaries (kind, started_at, finished_at, summary) VALUES (?, ?, ?, ?)',
+            (kind, started_at, finished_at, json.dumps(summary))
+        )
+
+
+@_timed
+def get_last_run_summary(kind):
+    """
+    Returns the summary of the latest run of the given kind.
+    :return: the summary dict with 'started_at' and 'finished_at', or None if there was no run
+    """
+    row = get_db_connection().execute(
+        '''
+        SELECT started_at, finished_at, summary FROM run_summaries
+        WHERE kind = ? ORDER BY finished_at DESC LIMIT 1
+        ''',
+        (kind,)
+    ).fetchone()
+    if row is None:
+        return None
+    return dict(json.loads(row['summary']), started_at=row['started_at'], finished_at=row['finished_at'])
+
 
+def run_owner():
+    """
+    Identifies this process as the owner of a digest run lease.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
 
-def get_summary_from_cache(url):
+
+@_timed
+def start_digest_run(shard_index, shard_count, resume_window_seconds, resume=True, lease_seconds=300,
+                     owner=None):
     """
-    Checks the cache for a processed summary for a URL.
-    :param url:
-    :return: the summary if found, otherwise None.
+    Starts a digest run of a shard, or resumes its unfinished run.
+    Unfinished runs started more than resume_window_seconds ago are marked abandoned. A running run
+    whose owner sent a heartbeat less than lease_seconds ago is still being executed by another
+    process (an overlapping cron tick, a restarted worker): it is neither resumed nor replaced.
+    :param resume: if False, an unfinished run of the shard is abandoned instead of resumed
+    :param owner: identity of the calling process, see run_owner()
+    :return: (run_id, resumed), or (None, False) if another live process owns the shard's run
+    """
+    owner = owner or run_owner()
+    now = time.time()
+    conn = get_db_connection()
+    with conn:
+        # Take the write lock at once, so two processes cannot both take over the same run
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            "UPDATE digest_runs SET status = 'abandoned' WHERE status = 'running' AND started_at < ?",
+            (now - resume_window_seconds,)
+        )
+        row = conn.execute(
+            '''
+            SELECT id, owner, heartbeat_at FROM digest_runs
+            WHERE status = 'running' AND shard_index = ? AND shard_count = ?
+            ORDER BY started_at DESC LIMIT 1
+            ''',
+            (shard_index, shard_count)
+        ).fetchone()
+        if row is not None:
+            alive = row['heartbeat_at'] is not None and now - row['heartbeat_at'] < lease_seconds
+            if alive and row['owner'] != owner:
+                return None, False
+            if resume:
+                conn.execute(
+                    'UPDATE digest_runs SET owner = ?, heartbeat_at = ? WHERE id = ?', (owner, now, row['id'])
+                )
+                return row['id'], True
+            conn.execute(
+                "UPDATE digest_runs SET status = 'abandoned' "
+                "WHERE status = 'running' AND shard_index = ? AND shard_count = ?",
+                (shard_index, shard_count)
+            )
+        run_id = conn.execute(
+            '''
+            INSERT INTO digest_runs (shard_index, shard_count, started_at, owner, heartbeat_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''',
+            (shard_index, shard_count, now, owner, now)
+        ).lastrowid
+        return run_id, False
+
+
+@_timed
+def heartbeat_digest_run(run_id, owner=None):
+    """
+    Renews the lease of a running digest run.
+    :return: False if the run is no longer owned by the caller (taken over or finished)
+    """
+    with get_db_connection() as conn:
+        return conn.execute(
+            "UPDATE digest_runs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+            (time.time(), run_id, owner or run_owner())
+        ).rowcount > 0
+
+
+@_timed
+def finish_digest_run(run_id):
+    """
+    Marks a digest run as finished, so the next run starts from scratch.
+    """
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE digest_runs SET status = 'finished', finished_at = ? WHERE id = ?", (time.time(), run_id)
+        )
+
+
+@_timed
+def get_digest_deliveries(run_id):
+    """
+    Returns the chat ids that already received the digest of a run.
+    """
+    rows = get_db_connection().execute('SELECT chat_id FROM digest_deliveries WHERE run_id = ?', (run_id,))
+    return {row['chat_id'] for row in rows}
+
+
+@_timed
+def record_digest_delivery(run_id, chat_id, watermarks, next_due_at=None):
+    """
+    Checkpoints one delivered digest: the delivery, the user's new watermarks and their
+    next delivery time are written in one transaction, so a resumed run neither skips nor repeats it.
+    :param watermarks: iterable of (chat_id, ticker, last_published_at)
+    :param next_due_at: if given, the user is rescheduled to this unix time
+    """
+    with get_db_connection() as conn:
+        conn.execute(
+            'INSERT OR IGNORE INTO digest_deliveries (run_id, chat_id, delivered_at) VALUES (?, ?, ?)',
+            (run_id, chat_id, time.time())
+        )
+        conn.executemany(
+            '''
+            INSERT INTO delivery_watermarks (chat_id, ticker, last_published_at) VALUES (?, ?, ?)
+            ON CONFLICT (chat_id, ticker)
+            DO UPDATE SET last_published_at = MAX(last_published_at, excluded.last_published_at)
+            ''',
+            watermarks
+        )
+        if next_due_at is not None:
+            conn.execute('UPDATE users SET next_due_at = ? WHERE chat_id = ?', (next_due_at, chat_id))
+
+
+@_timed
+def prune_digest_runs(retention_days):
+    """
+    Deletes digest runs (and their deliveries) that are no longer running and older than retention_days.
+    :return: the number of deleted runs
+    """
+    with get_db_connection() as conn:
+        cutoff = time.time() - retention_days * 24 * 3600
+        conn.execute(
+            '''
+            DELETE FROM digest_deliveries WHERE run_id IN (
+                SELECT id FROM digest_runs WHERE status != 'running' AND started_at < ?
+            )
+            ''',
+            (cutoff,)
+        )
+        return conn.execute(
+            "DELETE FROM digest_runs WHERE status != 'running' AND started_at < ?", (cutoff,)
+        ).rowcount
+
+
+@_timed
+def get_ticker_subscriber_counts():
+    """
+    Returns the number of subscribers of every subscribed ticker.
+    :return: dict ticker -> number of users
+    """
+    rows = get_db_connection().execute('SELECT ticker, COUNT(*) AS subscribers FROM user_tickers GROUP BY ticker')
+    return {row['ticker']: row['subscribers'] for row in rows}
+
+
+@_timed
+def get_ticker_subscribers(tickers):
+    """
+    Returns the subscribers of the given tickers.
+    :return: dict ticker -> list of (chat_id, language)
+    """
+    tickers = list(tickers)
+    subscribers = {}
+    conn = get_db_connection()
+    for start in range(0, len(tickers), MAX_QUERY_PARAMS):
+        chunk = tickers[start:start + MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f'''
+            SELECT ut.ticker, u.chat_id, u.language FROM user_tickers ut
+            JOIN users u ON u.chat_id = ut.chat_id
+            WHERE ut.ticker IN ({','.join('?' * len(chunk))}) AND u.blocked_at IS NULL
+            ''',
+            chunk
+        ).fetchall()
+        for row in rows:
+            subscribers.setdefault(row['ticker'], []).append((row['chat_id'], row['language']))
+    return subscribers
+
+
+@_timed
+def get_alert_poll_state():
+    """
+    Returns when every ticker is polled next by the alert worker.
+    :return: dict ticker -> next_poll_at
+    """
+    rows = get_db_connection().execute('SELECT ticker, next_poll_at FROM alert_poll_state')
+    return {row['ticker']: row['next_poll_at'] for row in rows}
+
+
+@_timed
+def save_alert_poll_state(entries):
+    """
+    Stores the poll schedule of tickers.
+    :param entries: iterable of (ticker, next_poll_at, last_polled_at)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO alert_poll_state (ticker, next_poll_at, last_polled_at) VALUES (?, ?, ?)',
+            entries
+        )
+
+
+@_timed
+def get_seen_alert_links(ticker, links):
+    """
+    Returns the links among `links` the alert worker has already seen for a ticker.
+    """
+    links = list(links)
+    seen = set()
+    conn = get_db_connection()
+    for start in range(0, len(links), MAX_QUERY_PARAMS):
+        chunk = links[start:start + MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f"SELECT link FROM alert_seen WHERE ticker = ? AND link IN ({','.join('?' * len(chunk))})",
+            [ticker] + chunk
+        )
+        seen.update(row['link'] for row in rows)
+    return seen
+
+
+@_timed
+def add_seen_alert_links(entries):
+    """
+    Marks stories as seen by the alert worker.
+    :param entries: iterable of (ticker, link, seen_at)
+    """
+    with get_db_connection() as conn:
+        conn.executemany('INSERT OR IGNORE INTO alert_seen (ticker, link, seen_at) VALUES (?, ?, ?)', entries)
+
+
+@_timed
+def get_alert_deliveries(chat_ids):
+    """
+    Returns the stories pushed to users as alerts.
+    :param chat_ids: iterable of chat ids
+    :return: dict chat_id -> set of links
+    """
+    conn = get_db_connection()
+    chat_ids = list(chat_ids)
+    deliveries = {}
+    for start in range(0, len(chat_ids), MAX_QUERY_PARAMS):
+        chunk = chat_ids[start:start + MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f'SELECT chat_id, link FROM alert_deliveries WHERE chat_id IN ({",".join("?" * len(chunk))})',
+            chunk
+        )
+        for row in rows:
+            deliveries.setdefault(row['chat_id'], set()).add(row['link'])
+    return deliveries
+
+
+@_timed
+def record_alert_deliveries(entries):
+    """
+    Records stories pushed to users as alerts.
+    :param entries: iterable of (chat_id, link, delivered_at)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO alert_deliveries (chat_id, link, delivered_at) VALUES (?, ?, ?)', entries
+        )
+
+
+@_timed
+def prune_alert_state(max_age_seconds):
+    """
+    Forgets seen and pushed stories older than max_age_seconds and the poll state of tickers nobody follows.
+    :return: the number of forgotten stories
+    """
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM alert_poll_state WHERE ticker NOT IN (SELECT ticker FROM user_tickers)')
+        conn.execute('DELETE FROM alert_deliveries WHERE delivered_at < ?', (time.time() - max_age_seconds,))
+        return conn.execute(
+            'DELETE FROM alert_seen WHERE seen_at < ?', (time.time() - max_age_seconds,)
+        ).rowcount
+
+
+@_timed
+def add_sentiment_observations(entries):
+    """
+    Stores sentiment observations; stories already observed for a ticker are ignored.
+    :param entries: iterable of (ticker, link, published_at, impact)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO sentiment_observations (ticker, link, published_at, impact) VALUES (?, ?, ?, ?)',
+            entries
+        )
+
+
+@_timed
+def get_sentiment_observations(since, tickers=None):
+    """
+    Returns the sentiment observations published since a unix time, as parallel lists.
+    :param tickers: optional iterable of tickers to restrict the lookup to
+    :return: (tickers, published_at, impacts)
+    """
+    conn = get_db_connection()
+    query = 'SELECT ticker, published_at, impact FROM sentiment_observations WHERE published_at >= ?'
+    if tickers is None:
+        rows = conn.execute(query, (since,)).fetchall()
+    else:
+        tickers = [ticker.upper() for ticker in tickers]
+        rows = []
+        for start in range(0, len(tickers), MAX_QUERY_PARAMS):
+            chunk = tickers[start:start + MAX_QUERY_PARAMS]
+            rows.extend(conn.execute(
+                f"{query} AND ticker IN ({','.join('?' * len(chunk))})", (since, *chunk)
+            ).fetchall())
+    if not rows:
+        return [], [], []
+    symbols, published, impacts = zip(*rows)
+    return list(symbols), list(published), list(impacts)
+
+
+@_timed
+def prune_sentiment_observations(max_age_seconds):
+    """
+    Deletes sentiment observations of stories published longer ago than max_age_seconds.
+    :return: number of deleted rows
+    """
+    with get_db_connection() as conn:
+        return conn.execute(
+            'DELETE FROM sentiment_observations WHERE published_at < ?', (time.time() - max_age_seconds,)
+        ).rowcount
+
+
+def iter_stored_news(since, batch_size):
+    """
+    Yields the (ticker, link, published_at) of the stored news items published since a unix time,
+    in lists of at most batch_size rows.
+    """
+    cursor = get_db_connection().execute(
+        'SELECT ticker, link, published_at FROM news_items WHERE published_at >= ?', (since,)
+    )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield [tuple(row) for row in rows]
+
+
+@_timed
+def add_price_alert(chat_id, ticker, direction, level):
+    """
+    Creates an armed price alert.
+    :return: the id of the alert
+    """
+    with get_db_connection() as conn:
+        return conn.execute(
+            'INSERT INTO price_alerts (chat_id, ticker, direction, level, created_at) VALUES (?, ?, ?, ?, ?)',
+            (chat_id, ticker.upper(), direction, level, time.time())
+        ).lastrowid
+
+
+@_timed
+def remove_price_alert(chat_id, alert_id):
+    """
+    Deletes one of the user's price alerts.
+    :return: True if the alert existed
+    """
+    with get_db_connection() as conn:
+        result = conn.execute('DELETE FROM price_alerts WHERE id = ? AND chat_id = ?', (alert_id, chat_id))
+        return result.rowcount > 0
+
+
+@_timed
+def get_user_price_alerts(chat_id):
+    """
+    Returns the price alerts of a user, oldest first.
+    :return: list of dicts with 'id', 'ticker', 'direction', 'level', 'armed' and 'triggered_at'
+    """
+    rows = get_db_connection().execute(
+        'SELECT id, ticker, direction, level, armed, triggered_at FROM price_alerts WHERE chat_id = ? ORDER BY id',
+        (chat_id,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+@_timed
+def get_price_alerts():
+    """
+    Returns every price alert of the users who accept messages, as parallel lists for the vectorized check.
+    :return: (ids, chat_ids, tickers, directions, levels, armed)
+    """
+    # Plain tuples: building a sqlite3.Row per alert is most of the cost of a large table
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(
+        '''
+        SELECT id, chat_id, ticker, direction, level, armed FROM price_alerts
+        WHERE chat_id NOT IN (SELECT chat_id FROM users WHERE blocked_at IS NOT NULL)
+        '''
+    ).fetchall()
+    if not rows:
+        return [], [], [], [], [], []
+    return tuple(list(column) for column in zip(*rows))
+
+
+@_timed
+def update_price_alerts(fired, rearmed, triggered_at):
+    """
+    Disarms the fired alerts and arms the alerts whose price moved back, in one transaction.
+    :param fired: iterable of alert ids
+    :param rearmed: iterable of alert ids
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            'UPDATE price_alerts SET armed = 0, triggered_at = ? WHERE id = ?',
+            ((triggered_at, alert_id) for alert_id in fired)
+        )
+        conn.executemany('UPDATE price_alerts SET armed = 1 WHERE id = ?', ((alert_id,) for alert_id in rearmed))
+
+
+@_timed
+def take_llm_quota(buckets, day, daily_limit, now):
+    """
+    Atomically takes tokens from the shared LLM quota buckets and counts the request for the day,
+    so all processes (web app, digest, alert worker) stay within one budget.
+    :param buckets: dict name -> (amount, rate per second, capacity, floor). The amounts are only taken
+        if, after the refill, every bucket holds at least amount + floor tokens (at most its capacity).
+    :param daily_limit: requests allowed on this day for the caller
+    :return: 0.0 if taken, the seconds to wait before trying again, or None if the daily limit is reached
+    """
+    conn = get_db_connection()
+    with conn:
+        # Take the write lock at once: the read and the update below must not interleave with another process
+        conn.execute('BEGIN IMMEDIATE')
+        used = conn.execute('SELECT requests FROM llm_quota_usage WHERE day = ?', (day,)).fetchone()
+        if used and used['requests'] >= daily_limit:
+            return None
+        wait = 0.0
+        levels = {}
+        for name, (amount, rate, capacity, floor) in buckets.items():
+            row = conn.execute('SELECT tokens, updated_at FROM llm_quota_buckets WHERE name = ?', (name,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row['tokens'] + (now - row['updated_at']) * rate)
+            levels[name] = tokens - amount
+            needed = min(amount + floor, capacity)
+            if tokens < needed:
+                wait = max(wait, (needed - tokens) / rate)
+        if wait:
+            return wait
+        conn.executemany(
+            '''
+            INSERT INTO llm_quota_buckets (name, tokens, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+            ''',
+            [(name, tokens, now) for name, tokens in levels.items()]
+        )
+        conn.execute(
+            '''
+            INSERT INTO llm_quota_usage (day, requests) VALUES (?, 1)
+            ON CONFLICT (day) DO UPDATE SET requests = requests + 1
+            ''',
+            (day,)
+        )
+        return 0.0
+
+
+@_timed
+def settle_llm_quota(day, bucket, adjustment, capacity, prompt_tokens, output_tokens):
+    """
+    Corrects a bucket once the real cost of a request is known and adds its tokens to the day's usage.
+    :param adjustment: tokens given back to the bucket (negative if the request cost more than taken)
+    """
+    with get_db_connection() as conn:
+        conn.execute(
+            'UPDATE llm_quota_buckets SET tokens = MIN(?, tokens + ?) WHERE name = ?', (capacity, adjustment, bucket)
+        )
+        conn.execute(
+            '''
+            INSERT INTO llm_quota_usage (day, prompt_tokens, output_tokens) VALUES (?, ?, ?)
+            ON CONFLICT (day) DO UPDATE SET prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                                            output_tokens = output_tokens + excluded.output_tokens
+            ''',
+            (day, prompt_tokens, output_tokens)
+        )
+
+
+@_timed
+def get_llm_quota_usage(day):
+    """
+    Returns the LLM usage of a day.
+    :return: dict with 'requests', 'prompt_tokens' and 'output_tokens'
+    """
+    row = get_db_connection().execute(
+        'SELECT requests, prompt_tokens, output_tokens FROM llm_quota_usage WHERE day = ?', (day,)
+    ).fetchone()
+    return dict(row) if row else {'requests': 0, 'prompt_tokens': 0, 'output_tokens': 0}
+
+
+@_timed
+def get_ticker_news_snapshot(ticker, language):
+    """
+    Returns the pre-rendered news of a ticker.
+    :return: (message, built_at) or None if there is none
+    """
+    row = get_db_connection().execute(
+        'SELECT message, built_at FROM ticker_news WHERE ticker = ? AND language = ?', (ticker, language)
+    ).fetchone()
+    return (row['message'], row['built_at']) if row else None
+
+
+@_timed
+def save_ticker_news_snapshots(entries):
+    """
+    Stores pre-rendered news of tickers, replacing older ones.
+    :param entries: iterable of (ticker, language, message, built_at)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO ticker_news (ticker, language, message, built_at) VALUES (?, ?, ?, ?)', entries
+        )
+
+
+@_timed
+def get_popular_ticker_news(limit):
+    """
+    Returns the most followed (ticker, language) pairs and the age of their pre-rendered news.
+    :return: list of (ticker, language, built_at or None), the most subscribers first
+    """
+    rows = get_db_connection().execute(
+        '''
+        SELECT ut.ticker, u.language, COUNT(*) AS subscribers, MAX(tn.built_at) AS built_at
+        FROM user_tickers ut
+        JOIN users u ON u.chat_id = ut.chat_id
+        LEFT JOIN ticker_news tn ON tn.ticker = ut.ticker AND tn.language = u.language
+        GROUP BY ut.ticker, u.language
+        ORDER BY subscribers DESC
+        LIMIT ?
+        ''',
+        (limit,)
+    ).fetchall()
+    return [(row['ticker'], row['language'], row['built_at']) for row in rows]
+
+
+@_timed
+def request_ticker_news(ticker, language, chat_id, notify, requested_at):
+    """
+    Queues a refresh of the news of a ticker. Repeated requests of a chat are merged.
+    :param notify: whether the chat wants the refreshed news sent to it
+    """
+    with get_db_connection() as conn:
+        conn.execute(
+            '''
+            INSERT INTO ticker_news_requests (ticker, language, chat_id, notify, requested_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (ticker, language, chat_id) DO UPDATE SET notify = MAX(notify, excluded.notify)
+            ''',
+            (ticker, language, chat_id, int(notify), requested_at)
+        )
+
+
+@_timed
+def take_ticker_news_requests(limit):
+    """
+    Removes the oldest queued refreshes from the queue and returns them.
+    :return: list of (ticker, language, chat_id, notify)
+    """
+    conn = get_db_connection()
+    with conn:
+        # Take the write lock at once, so two workers never take the same requests
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute(
+            'SELECT ticker, language, chat_id, notify FROM ticker_news_requests ORDER BY requested_at LIMIT ?',
+            (limit,)
+        ).fetchall()
+        requests = [(row['ticker'], row['language'], row['chat_id'], bool(row['notify'])) for row in rows]
+        conn.executemany(
+            'DELETE FROM ticker_news_requests WHERE ticker = ? AND language = ? AND chat_id = ?',
+            [(ticker, language, chat_id) for ticker, language, chat_id, _ in requests]
+        )
+        return requests
+
+
+@_timed
+def get_delivery_watermarks(chat_ids=None):
+    """
+    Returns the published time of the newest item delivered per user and ticker.
+    :param chat_ids: optional iterable of chat ids to restrict the lookup to
+    :return: dict (chat_id, ticker) -> unix time
+    """
+    conn = get_db_connection()
+    if chat_ids is None:
+        rows = conn.execute('SELECT chat_id, ticker, last_published_at FROM delivery_watermarks').fetchall()
+    else:
+        chat_ids = list(chat_ids)
+        rows = []
+        for start in range(0, len(chat_ids), MAX_QUERY_PARAMS):
+            chunk = chat_ids[start:start + MAX_QUERY_PARAMS]
+            rows.extend(conn.execute(
+                f'''
+                SELECT chat_id, ticker, last_published_at FROM delivery_watermarks
+                WHERE chat_id IN ({','.join('?' * len(chunk))})
+                ''',
+                chunk
+            ).fetchall())
+    return {(row['chat_id'], row['ticker']): row['last_published_at'] for row in rows}
+
+
+@_timed
+def update_delivery_watermarks(watermarks):
+    """
+    Moves delivery watermarks forward (never backwards).
+    :param watermarks: iterable of (chat_id, ticker, last_published_at)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            '''
+            INSERT INTO delivery_watermarks (chat_id, ticker, last_published_at) VALUES (?, ?, ?)
+            ON CONFLICT (chat_id, ticker)
+            DO UPDATE SET last_published_at = MAX(last_published_at, excluded.last_published_at)
+            ''',
+            watermarks
+        )
+
+
+@_timed
+def get_summary_retries(chat_ids):
+    """
+    Returns the items that users got with a degraded summary.
+    :param chat_ids: iterable of chat ids
+    :return: dict (chat_id, ticker) -> set of links
+    """
+    conn = get_db_connection()
+    chat_ids = list(chat_ids)
+    retries = {}
+    for start in range(0, len(chat_ids), MAX_QUERY_PARAMS):
+        chunk = chat_ids[start:start + MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f'SELECT chat_id, ticker, link FROM summary_retries WHERE chat_id IN ({",".join("?" * len(chunk))})',
+            chunk
+        )
+        for row in rows:
+            retries.setdefault((row['chat_id'], row['ticker']), set()).add(row['link'])
+    return retries
+
+
+@_timed
+def update_summary_retries(chat_id, retries, now):
+    """
+    Records the items a user got with a degraded summary and forgets those delivered with a real one.
+    :param retries: iterable of (ticker, link, degraded)
+    """
+    retries = list(retries)
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO summary_retries (chat_id, ticker, link, created_at) VALUES (?, ?, ?, ?)',
+            [(chat_id, ticker, link, now) for ticker, link, degraded in retries if degraded]
+        )
+        conn.executemany(
+            'DELETE FROM summary_retries WHERE chat_id = ? AND ticker = ? AND link = ?',
+            [(chat_id, ticker, link) for ticker, link, degraded in retries if not degraded]
+        )
+
+
+@_timed
+def prune_summary_retries(max_age_seconds):
+    """
+    Forgets degraded deliveries older than max_age_seconds: their items are no longer in the news store.
+    :return: the number of deleted rows
+    """
+    with get_db_connection() as conn:
+        return conn.execute(
+            'DELETE FROM summary_retries WHERE created_at < ?', (time.time() - max_age_seconds,)
+        ).rowcount
+
+
+@_timed
+def get_summary_from_cache(cache_key, max_age_seconds):
+    """
+    Checks the cache for a processed summary.
+    :param cache_key: key built by summary_cache.make_cache_key()
+    :param max_age_seconds: entries older than this are treated as expired
+    :return: (summary, timestamp) if a fresh entry is found, otherwise None.
     """
-    import hashlib
-    url_hash = hashlib.sha256(url.encode()).hexdigest()
     with get_db_connection() as conn:
         result = conn.execute(
-            'SELECT processed_summary FROM news_cache WHERE url_hash = ?',
-            (url_hash,)
+            """
+            SELECT processed_summary, strftime('%s', timestamp) AS stored_at FROM news_cache
+            WHERE cache_key = ? AND timestamp >= datetime('now', ?)
+            """,
+            (cache_key, f'-{int(max_age_seconds)} seconds')
         ).fetchone()
-        return result['processed_summary'] if result else None
+        return (result['processed_summary'], int(result['stored_at'])) if result else None
 
 
-def add_summary_to_cache(url, summary):
+@_timed
+def add_summary_to_cache(cache_key, summary, language, model, prompt_version):
     """
     Adds a processed news summary to the cache.
     """
-    import hashlib
-    url_hash = hashlib.sha256(url.encode()).hexdigest()
     with get_db_connection() as conn:
         conn.execute(
-            'INSERT OR REPLACE INTO news_cache (url_hash, processed_summary) VALUES (?, ?)',
-            (url_hash, summary)
+            """
+            INSERT OR REPLACE INTO news_cache (cache_key, processed_summary, language, model, prompt_version)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (cache_key, summary, language, model, prompt_version)
         )
-        conn.commit()
 
+
+@_timed
+def get_summaries_from_cache(cache_keys, max_age_seconds):
+    """
+    Bulk version of get_summary_from_cache().
+    :return: dict cache_key -> (summary, timestamp) for every fresh entry found
+    """
+    cache_keys = list(cache_keys)
+    found = {}
+    conn = get_db_connection()
+    for start in range(0, len(cache_keys), MAX_QUERY_PARAMS):
+        chunk = cache_keys[start:start + MAX_QUERY_PARAMS]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(
+            f"""
+            SELECT cache_key, processed_summary, strftime('%s', timestamp) AS stored_at FROM news_cache
+            WHERE cache_key IN ({placeholders}) AND timestamp >= datetime('now', ?)
+            """,
+            (*chunk, f'-{int(max_age_seconds)} seconds')
+        ).fetchall()
+        for row in rows:
+            found[row['cache_key']] = (row['processed_summary'], int(row['stored_at']))
+    return found
+
+
+@_timed
+def add_summaries_to_cache(entries):
+    """
+    Bulk version of add_summary_to_cache().
+    :param entries: iterable of (cache_key, summary, language, model, prompt_version)
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO news_cache (cache_key, processed_summary, language, model, prompt_version)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            entries
+        )
+
+
+@_timed
+def evict_summary_cache(max_age_seconds, max_rows):
+    """
+    Deletes expired cache entries and the oldest ones above max_rows,
+    then runs VACUUM to give the space back.
+    :return: the number of deleted entries
+    """
+    with get_db_connection() as conn:
+        deleted = conn.execute(
+            "DELETE FROM news_cache WHERE timestamp < datetime('now', ?)",
+            (f'-{int(max_age_seconds)} seconds',)
+        ).rowcount
+        overflow = conn.execute('SELECT COUNT(*) FROM news_cache').fetchone()[0] - max_rows
+        if overflow > 0:
+            deleted += conn.execute(
+                """
+                DELETE FROM news_cache WHERE cache_key IN (
+                    SELECT cache_key FROM news_cache ORDER BY timestamp ASC LIMIT ?
+                )
+                """,
+                (overflow,)
+            ).rowcount
+        conn.commit()
+        if deleted:
+            conn.execute('VACUUM')
+    if deleted:
+        logging.info(f"Evicted {deleted} entries from the summary cache.")
+    return deleted
@@ -0,0 +1,187 @@
+"""
+Near-duplicate story detection.
+
+The same wire story is published under several tickers and by several outlets with
+slightly different URLs and titles. Every story gets a 64-bit SimHash fingerprint of its
+normalized title (and snippet, if the source provides one); stories whose fingerprints
+differ in at most DEDUP_MAX_DISTANCE bits are treated as the same story and share one summary.
+
+Fingerprints are kept in SQLite, split into DEDUP_MAX_DISTANCE + 1 bands: by the pigeonhole
+principle two fingerprints within the distance agree on at least one band, so near-neighbour
+candidates are found with an indexed lookup instead of a scan over all known stories.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import database as db
+from config import DEDUP_MAX_DISTANCE, NEWS_RETENTION_DAYS
+
+FINGERPRINT_BITS = 64
+
+# Words that carry no information about which story a headline is about
+STOP_WORDS = frozenset(
+    'a an the and or of to in on at for by with from as is are was were be its it this that'.split()
+)
+
+# Outlet suffixes such as "... - Reuters" or "... | Bloomberg"
+OUTLET_SUFFIX_PATTERN = re.compile(r'\s+[-|–—]\s+[^-|–—]{2,40}$')
+WORD_PATTERN = re.compile(r'[a-z0-9$%.]+')
+
+
+def normalize_text(text):
+    """
+    Lowercases a headline, drops the outlet suffix, punctuation and stop words.
+    :return: list of tokens
+    """
+    text = OUTLET_SUFFIX_PATTERN.sub('', text or '').lower()
+    tokens = (token.strip('.') for token in WORD_PATTERN.findall(text))
+    return [token for token in tokens if token and token not in STOP_WORDS]
+
+
+def _feature_hash(feature):
+    # Python's hash() is salted per process, fingerprints are persisted: use a stable hash
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+
+
+def simhash(tokens):
+    """
+    Computes a 64-bit SimHash over the words and word pairs of a token list.
+    """
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not features:
+        return 0
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        value = _feature_hash(feature)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def story_fingerprint(news_item):
+    """
+    :return: the SimHash of the item's title and, if present, its snippet
+    """
+    return simhash(normalize_text(news_item['title']) + normalize_text(news_item.get('snippet')))
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class StoryDeduplicator:
+    """
+    Maps news items to the link of the first known story they are a near-duplicate of.
+    """
+
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE, retention_days=NEWS_RETENTION_DAYS):
+        self.max_distance = max_distance
+        self.retention_days = retention_days
+        # At least two bands, so a band key (band number and bits) fits in a SQLite integer
+        self.bands = max(2, max_distance + 1)
+        self.band_width = FINGERPRINT_BITS // self.bands
+        self._lock = threading.Lock()
+
+    def band_keys(self, fingerprint):
+        """
+        Splits a fingerprint into bands; each key encodes the band number and its bits.
+        """
+        mask = (1 << self.band_width) - 1
+        return [
+            band << 32 | (fingerprint >> (band * self.band_width)) & mask
+            for band in range(self.bands)
+        ]
+
+    def _closest(self, fingerprint, candidates):
+        """
+        :param candidates: iterable of (link, fingerprint, created_at)
+        :return: link of the oldest candidate within max_distance, or None
+        """
+        matches = [
+            (created_at, link) for link, candidate, created_at in candidates
+            if hamming_distance(fingerprint, candidate) <= self.max_distance
+        ]
+        return min(matches)[1] if matches else None
+
+    def canonicalize(self, news_items):
+        """
+        Finds the canonical story of every item, among the stories seen before and the items themselves.
+        New stories are added to the persistent index.
+        :return: dict link -> canonical link (the link itself for a new story)
+        """
+        unique = {}
+        for news_item in news_items:
+            unique.setdefault(news_item['link'], news_item)
+        if not unique:
+            return {}
+
+        fingerprints = {link: story_fingerprint(news_item) for link, news_item in unique.items()}
+        with self._lock:
+            try:
+                stored = db.find_story_fingerprints(
+                    key for fingerprint in fingerprints.values() for key in self.band_keys(fingerprint)
+                )
+            except Exception as e:
+                logging.error(f"Error loading story fingerprints: {e}")
+                stored = []
+
+            known = {}
+            for link, fingerprint, created_at in stored:
+                fingerprint = _to_unsigned(fingerprint)
+                for key in self.band_keys(fingerprint):
+                    known.setdefault(key, []).append((link, fingerprint, created_at))
+
+            now = time.time()
+            canonical = {}
+            new_stories = []
+            for order, (link, fingerprint) in enumerate(fingerprints.items()):
+                keys = self.band_keys(fingerprint)
+                if any(candidate[0] == link for key in keys for candidate in known.get(key, ())):
+                    canonical[link] = link
+                    continue
+                match = self._closest(fingerprint, (candidate for key in keys for candidate in known.get(key, ())))
+                if match:
+                    canonical[link] = match
+                    continue
+                # A new story: later items of this batch may be duplicates of it
+                canonical[link] = link
+                entry = (link, fingerprint, now + order * 1e-6)
+                for key in keys:
+                    known.setdefault(key, []).append(entry)
+                new_stories.append((link, _to_signed(fingerprint), entry[2], keys))
+
+            try:
+                db.save_story_fingerprints(new_stories)
+            except Exception as e:
+                logging.error(f"Error saving story fingerprints: {e}")
+
+        duplicates = sum(1 for link, story in canonical.items() if link != story)
+        if duplicates:
+            logging.info(f"Found {duplicates} near-duplicate stories among {len(canonical)} news items.")
+        return canonical
+
+    def prune(self):
+        """
+        Forgets stories older than the news retention period.
+        """
+        deleted = db.prune_story_fingerprints(self.retention_days * 24 * 3600)
+        if deleted:
+            logging.info(f"Pruned {deleted} old story fingerprints.")
+        return deleted
+
+
+# Shared deduplicator used by the digest
+story_deduplicator = StoryDeduplicator()
@@ -0,0 +1,372 @@
+"""
+Rate-limited delivery of messages to Telegram.
+
+Telegram allows a bot about 30 messages per second overall and about one message
+per second to the same chat. The DeliveryScheduler keeps within both limits with a
+global token bucket and a per-chat interval, sends the most urgent messages first,
+waits out RetryAfter (flood wait) errors and splits long digests into several
+messages at ticker-block boundaries.
+
+sendMessage is not idempotent: a request that timed out has often been delivered
+already, so a TimedOut is reported as a failure and never sent again. Callers that
+need to know what got through submit one message per group of blocks (see pack_blocks)
+and track each of them with its on_delivered and on_failed callbacks; failure_kind()
+tells a chat that will never accept messages from one worth trying again later.
+"""
+
+import asyncio
+import itertools
+import logging
+import re
+import time
+
+from telegram.error import BadRequest, Forbidden, TimedOut
+
+import metrics
+
+# Telegram's hard limit for the text of one message
+MAX_MESSAGE_LENGTH = 4096
+
+# Message priorities: lower values are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+# Kinds of failed deliveries, see failure_kind()
+FAILURE_PERMANENT = 'permanent'
+FAILURE_TIMED_OUT = 'timed_out'
+FAILURE_TRANSIENT = 'transient'
+
+# BadRequest descriptions of chats that will never accept a message
+PERMANENT_ERROR_MESSAGES = ('chat not found', 'user is deactivated', 'bot was kicked', 'chat_write_forbidden')
+
+# A digest is made of blocks that start with a "--- 📈 *TICKER* ---" header
+TICKER_BLOCK_PATTERN = re.compile(r'(?=\n+--- 📈 )')
+
+TELEGRAM_SEND_SECONDS = metrics.histogram('telegram_send_seconds', 'Latency of Telegram sendMessage calls')
+TELEGRAM_SEND_EVENTS = metrics.counter(
+    'telegram_send_events_total', 'Telegram sends by outcome (sent, failed, flood_wait)', ('event',)
+)
+
+# Characters that open or close a Markdown (V1) entity
+MARKDOWN_PAIRS = ('*', '_', '`')
+
+
+def failure_kind(error):
+    """
+    Tells how a send failed: FAILURE_PERMANENT if the chat blocked the bot or does not exist,
+    FAILURE_TIMED_OUT if the message may have been delivered anyway, otherwise FAILURE_TRANSIENT.
+    """
+    if isinstance(error, Forbidden):
+        return FAILURE_PERMANENT
+    if isinstance(error, BadRequest) and any(text in str(error).lower() for text in PERMANENT_ERROR_MESSAGES):
+        return FAILURE_PERMANENT
+    if isinstance(error, TimedOut):
+        return FAILURE_TIMED_OUT
+    return FAILURE_TRANSIENT
+
+
+def _is_markdown_balanced(text):
+    """
+    Checks that no Markdown entity is left open in a piece of text.
+    """
+    if any(text.count(char) % 2 for char in MARKDOWN_PAIRS):
+        return False
+    return text.count('[') == text.count(']') and text.count('(') == text.count(')')
+
+
+def _cut_line(line, limit):
+    """
+    Cuts a single over-long line into pieces of at most limit characters,
+    preferring spaces where no Markdown entity is left open.
+    """
+    pieces = []
+    while len(line) > limit:
+        cut = line.rfind(' ', 0, limit)
+        while cut > 0 and not _is_markdown_balanced(line[:cut]):
+            cut = line.rfind(' ', 0, cut)
+        if cut <= 0:
+            cut = limit
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip(' ')
+    pieces.append(line)
+    return pieces
+
+
+def _pack(parts, separator, limit):
+    """
+    Greedily packs parts into chunks of at most limit characters.
+    Parts that are too long on their own are returned as they are.
+    """
+    chunks = []
+    current = ''
+    for part in parts:
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        current = part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """
+    Splits a digest into messages of at most limit characters.
+    Splits happen at ticker blocks first, then at news items, then at lines,
+    so Markdown entities are never cut in half.
+    :return: list of message texts
+    """
+    if len(text) <= limit:
+        return [text]
+
+    chunks = []
+    for block in _pack(TICKER_BLOCK_PATTERN.split(text), '', limit):
+        if len(block) <= limit:
+            chunks.append(block)
+            continue
+        for paragraph in _pack(block.split('\n\n'), '\n\n', limit):
+            if len(paragraph) <= limit:
+                chunks.append(paragraph)
+                continue
+            lines = [piece for line in paragraph.split('\n') for piece in _cut_line(line, limit)]
+            chunks.extend(_pack(lines, '\n', limit))
+    return [chunk.strip('\n') for chunk in chunks if chunk.strip()]
+
+
+def pack_blocks(blocks, limit=MAX_MESSAGE_LENGTH):
+    """
+    Groups the consecutive blocks of a long text into messages of at most limit characters, and
+    tells which blocks every message carries. A block longer than limit is a message of its own,
+    which submit() splits further.
+    :param blocks: list of (text, payload)
+    :return: list of (text, [payloads]) in the order of the blocks
+    """
+    messages = []
+    for text, payload in blocks:
+        if messages and len(messages[-1][0]) + 1 + len(text) <= limit:
+            messages[-1] = (f"{messages[-1][0]}\n{text}", messages[-1][1] + [payload])
+        else:
+            messages.append((text.strip('\n'), [payload]))
+    return messages
+
+
+class TokenBucket:
+    """
+    Asynchronous token bucket: allows `rate` acquisitions per second with bursts up to `capacity`.
+    The default capacity of 1 spreads the acquisitions evenly over each second.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def pause(self, seconds):
+        """
+        Stops handing out tokens for the given number of seconds (e.g. on a flood wait).
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        """
+        Waits until a token is available and takes it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _Submission:
+    """
+    Tracks the parts of one submitted message so the caller can be told when all were sent.
+    """
+    __slots__ = ('remaining', 'failure', 'on_delivered', 'on_failed')
+
+    def __init__(self, parts, on_delivered, on_failed):
+        self.remaining = parts
+        self.failure = None
+        self.on_delivered = on_delivered
+        self.on_failed = on_failed
+
+
+class DeliveryScheduler:
+    """
+    Sends queued messages through a bot while respecting Telegram's rate limits.
+
+    Usage:
+        scheduler = DeliveryScheduler(bot)
+        scheduler.start()
+        scheduler.submit(chat_id, text)
+        await scheduler.join()
+    """
+
+    def __init__(self, bot, rate=30, per_chat_interval=1.0, workers=4, max_retries=3,
+                 max_length=MAX_MESSAGE_LENGTH):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_length = max_length
+        self.queue = asyncio.PriorityQueue()
+        self.stats = {'sent': 0, 'failed': 0, 'flood_waits': 0, 'split_messages': 0}
+        self._next_allowed = {}
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._progress = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        """
+        Starts the worker coroutines. Must be called from a running event loop.
+        """
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, chat_id, text, priority=PRIORITY_NORMAL, parse_mode='Markdown', on_delivered=None,
+               on_failed=None):
+        """
+        Queues a message, split into several if it is longer than Telegram allows.
+        :param on_delivered: optional callable run with chat_id once every part has been sent
+        :param on_failed: optional callable run with (chat_id, kind) once every part has been handled
+            and some failed; kind is FAILURE_PERMANENT if any part failed for good (see failure_kind())
+        :return: the number of messages queued
+        """
+        parts = split_message(text, self.max_length)
+        if len(parts) > 1:
+            self.stats['split_messages'] += 1
+        submission = _Submission(len(parts), on_delivered, on_failed)
+        for part in parts:
+            self._put((priority, next(self._sequence), chat_id, part, parse_mode, 0, submission))
+        return len(parts)
+
+    @property
+    def pending(self):
+        """
+        Number of messages queued or being sent.
+        """
+        return self._pending
+
+    async def wait_below(self, max_pending):
+        """
+        Waits until at most max_pending messages are queued or being sent, so a producer
+        cannot queue faster than the messages go out.
+        """
+        while self._pending > max_pending:
+            self._progress.clear()
+            await self._progress.wait()
+
+    async def join(self):
+        """
+        Waits until every queued message has been sent or has failed.
+        """
+        await self._idle.wait()
+
+    async def close(self):
+        """
+        Waits for the queue to drain and stops the workers.
+        """
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _put(self, entry):
+        self._pending += 1
+        self._idle.clear()
+        self.queue.put_nowait(entry)
+
+    def _done(self, chat_id, submission, failure=None):
+        if failure is not None and submission.failure != FAILURE_PERMANENT:
+            submission.failure = failure
+        submission.remaining -= 1
+        if not submission.remaining:
+            try:
+                if submission.failure is None and submission.on_delivered:
+                    submission.on_delivered(chat_id)
+                elif submission.failure is not None and submission.on_failed:
+                    submission.on_failed(chat_id, submission.failure)
+            except Exception as e:
+                logging.error(f"Error in delivery callback for {chat_id}: {e}")
+
+        self._pending -= 1
+        self._progress.set()
+        if not self._pending:
+            self._idle.set()
+
+    def _requeue_later(self, entry, delay):
+        """
+        Puts a message back into the queue after a delay without holding a worker.
+        """
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, entry)
+
+    async def _worker(self):
+        while True:
+            entry = await self.queue.get()
+            try:
+                await self._deliver(entry)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, entry):
+        priority, sequence, chat_id, text, parse_mode, attempt, submission = entry
+
+        # Per-chat limit: defer the message instead of blocking the worker
+        now = time.monotonic()
+        allowed_at = self._next_allowed.get(chat_id, 0.0)
+        if now < allowed_at:
+            self._requeue_later(entry, allowed_at - now)
+            return
+        self._next_allowed[chat_id] = now + self.per_chat_interval
+
+        await self.bucket.acquire()
+        try:
+            with TELEGRAM_SEND_SECONDS.time():
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+            self.stats['sent'] += 1
+            TELEGRAM_SEND_EVENTS.inc(event='sent')
+            self._done(chat_id, submission)
+        except Exception as e:
+            retry_entry = (priority, sequence, chat_id, text, parse_mode, attempt + 1, submission)
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None and attempt < self.max_retries:
+                # Flood wait: Telegram tells us exactly how long to back off
+                delay = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                logging.warning(f"Flood wait for {delay}s while sending to {chat_id}.")
+                self.stats['flood_waits'] += 1
+                TELEGRAM_SEND_EVENTS.inc(event='flood_wait')
+                self.bucket.pause(delay)
+                self._next_allowed[chat_id] = time.monotonic() + delay
+                self._requeue_later(retry_entry, delay)
+            else:
+                self.stats['failed'] += 1
+                TELEGRAM_SEND_EVENTS.inc(event='failed')
+                if isinstance(e, TimedOut):
+                    # Not retried: Telegram may have delivered the message before the timeout
+                    logging.error(f"Timed out sending a message to user {chat_id}; it may have been delivered.")
+                else:
+                    logging.error(f"Failed to send message to user {chat_id}: {e}")
+                self._done(chat_id, submission, failure_kind(e))
@@ -0,0 +1,98 @@
+"""
+Per-user delivery schedule of the digest.
+
+Every user picks a local delivery time, a time zone and a frequency (daily, weekdays only or
+twice daily, the second time 12 hours after the first). The next delivery is stored as a unix
+time in users.next_due_at, so a scheduler started every few minutes only handles the users who
+are due (run_digest.py --due). Users with the same local time are spread over
+DELIVERY_SPREAD_MINUTES by a stable offset derived from their chat id.
+
+Later slots reuse the work of earlier ones: news is served from the news store within its TTL
+and summaries from the shared summary cache, so only stories that are new since the previous
+slot go to the LLM.
+"""
+
+import hashlib
+from datetime import datetime, timedelta, time as day_time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from config import DELIVERY_SPREAD_MINUTES
+
+FREQUENCIES = ('daily', 'weekdays', 'twice_daily')
+
+DEFAULT_TIMEZONE = 'UTC'
+DEFAULT_DELIVERY_TIME = '08:00'
+DEFAULT_FREQUENCY = 'daily'
+
+
+def parse_delivery_time(value):
+    """
+    Parses a local time given as HH:MM.
+    :raises ValueError: if the value is not a valid time
+    """
+    try:
+        hour, minute = (int(part) for part in value.split(':'))
+        return day_time(hour, minute)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid delivery time '{value}', expected HH:MM")
+
+
+def get_timezone(name):
+    """
+    Returns the ZoneInfo of an IANA time zone name such as 'Europe/Moscow'.
+    :raises ValueError: if the time zone is unknown
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone '{name}'")
+
+
+def spread_offset(chat_id, spread_minutes=DELIVERY_SPREAD_MINUTES):
+    """
+    Returns the stable delay in seconds (0 .. spread_minutes) of a user's delivery.
+    """
+    if spread_minutes <= 0:
+        return 0
+    digest = hashlib.blake2b(str(chat_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % (spread_minutes * 60)
+
+
+def next_due_at(now, timezone=DEFAULT_TIMEZONE, delivery_time=DEFAULT_DELIVERY_TIME,
+                frequency=DEFAULT_FREQUENCY, chat_id=None):
+    """
+    Computes the first delivery of a schedule after `now`.
+    :param now: unix time
+    :param chat_id: if given, the user's spread offset is added
+    :return: unix time of the next delivery
+    :raises ValueError: for an unknown time zone, time or frequency
+    """
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency '{frequency}', expected one of {', '.join(FREQUENCIES)}")
+    zone = get_timezone(timezone)
+    first = parse_delivery_time(delivery_time)
+    slots = [first]
+    if frequency == 'twice_daily':
+        slots.append(day_time((first.hour + 12) % 24, first.minute))
+    slots.sort()
+    offset = spread_offset(chat_id) if chat_id is not None else 0
+
+    today = datetime.fromtimestamp(now, zone).date()
+    # Starts the day before: the spread offset can move a late slot of yesterday past midnight.
+    # A week always contains a weekday, so the loop returns
+    for days in range(-1, 8):
+        day = today + timedelta(days=days)
+        if frequency == 'weekdays' and day.weekday() >= 5:
+            continue
+        for slot in slots:
+            due = datetime.combine(day, slot, tzinfo=zone).timestamp() + offset
+            if due > now:
+                return due
+
+
+def describe(schedule):
+    """
+    Renders a schedule for the user, e.g. '08:00 Europe/Berlin, weekdays'.
+    :param schedule: dict with 'timezone', 'delivery_time' and 'frequency'
+    """
+    return f"{schedule['delivery_time']} {schedule['timezone']}, {schedule['frequency'].replace('_', ' ')}"
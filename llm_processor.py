@@ -1,34 +1,415 @@
 """
 Module for interacting with the LLM (Google Generative AI).
+
+Headlines are sent together with a condensed excerpt of the article (see article.py) when one is
+available. The input and output tokens of every request are counted in token_usage.
+
+Every request goes through the LLMGovernor, which keeps all processes within one Gemini quota
+(requests and tokens per minute, requests per day, persisted in SQLite), serves the interactive
+lane before the batch lane, and opens a circuit breaker on repeated failures or exhausted quota.
+When a request cannot be made, a degraded summary built from the headline is returned instead,
+flagged as such in the results so callers can deliver it again once the LLM is back.
 """
 
-import google.generativeai as genai
-from config import GOOGLE_API_KEY
-from database import get_summary_from_cache, add_summary_to_cache
+import config
+import database as db
+import metrics
+from config import (
+    LLM_BATCH_SIZE, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_REQUESTS_PER_DAY, LLM_INTERACTIVE_RESERVE,
+    LLM_MAX_WAIT_INTERACTIVE_SECONDS, LLM_MAX_WAIT_BATCH_SECONDS, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_SECONDS
+)
+from summary_cache import summary_cache
+from article import get_article_contexts
+import asyncio
+import json
 import logging
+import random
+import threading
 import time
+from datetime import datetime, timezone
 
-# Configure the API
-genai.configure(api_key=GOOGLE_API_KEY)
 # Use the model specified in the project document.
-model = genai.GenerativeModel('gemini-2.5-flash')
+MODEL_NAME = 'gemini-2.5-flash'
 
+# The Gemini client is created on first use by get_model(): importing google.generativeai
+# takes most of a second, which the web app should not pay for /help or /list.
+_model = None
+_model_lock = threading.Lock()
 
-def get_simple_summary(news_title, news_link, language='ru', max_retries=3):
+
+def get_model():
     """
-    Creates a simple news summary using the LLM, with caching and a retry mechanism.
+    Returns the shared Gemini model, configuring the API on the first call.
     """
-    # 1. Check the cache
-    cached_summary = get_summary_from_cache(news_link)
-    if cached_summary:
-        logging.info(f"Found summary in cache for: {news_link}")
-        return cached_summary, True  # True means the result is from the cache
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=config.GOOGLE_API_KEY)
+                _model = genai.GenerativeModel(MODEL_NAME)
+    return _model
 
-    # 2. If not in cache, generate a new summary
-    logging.info(f"Generating new summary for: {news_title}")
+
+def set_model(model):
+    """
+    Replaces the shared Gemini model, e.g. with a local stand-in for benchmarks.
+    :param model: object with generate_content() and generate_content_async(), or None to reset
+    """
+    global _model
+    with _model_lock:
+        _model = model
+
+
+# Part of every cache key: bump it whenever the prompts or the summary format change,
+# so summaries produced by the old prompts are no longer served.
+PROMPT_VERSION = '3'
+
+# Degraded summary returned when the LLM cannot be used: the headline and a note instead of the analysis
+DEGRADED_NOTES = {
+    'ru': 'не оценено, AI-анализ временно недоступен',
+    'en': 'not assessed, AI analysis is temporarily unavailable',
+}
+
+# Allowed impact values in the structured (JSON) output
+IMPACT_VALUES = ('Positive', 'Neutral', 'Negative')
+
+# Labels used to render a structured summary in the same text format as get_simple_summary()
+SUMMARY_LABELS = {
+    'ru': ('СУТЬ', 'ВЛИЯНИЕ', 'ПРОГНОЗ'),
+    'en': ('ESSENCE', 'IMPACT', 'FORECAST'),
+}
+IMPACT_LABELS = {
+    'ru': {'Positive': 'Позитивное', 'Neutral': 'Нейтральное', 'Negative': 'Негативное'},
+    'en': {value: value for value in IMPACT_VALUES},
+}
+
+# JSON schema of a batched response: one object per headline, matched by id
+BATCH_RESPONSE_SCHEMA = {
+    'type': 'ARRAY',
+    'items': {
+        'type': 'OBJECT',
+        'properties': {
+            'id': {'type': 'INTEGER'},
+            'essence': {'type': 'STRING'},
+            'impact': {'type': 'STRING', 'enum': list(IMPACT_VALUES)},
+            'forecast': {'type': 'STRING'},
+        },
+        'required': ['id', 'essence', 'impact', 'forecast'],
+    },
+}
+
+# A plain dict is accepted wherever genai.GenerationConfig is, without importing the client
+BATCH_GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': BATCH_RESPONSE_SCHEMA,
+}
+
+LLM_REQUEST_SECONDS = metrics.histogram('llm_request_seconds', 'Latency of Gemini requests', ('kind',))
+LLM_ERRORS = metrics.counter('llm_errors_total', 'Failed Gemini requests', ('kind',))
+LLM_TOKENS = metrics.counter('llm_tokens_total', 'Tokens used by Gemini requests', ('direction',))
+LLM_BATCH_SECONDS = metrics.histogram(
+    'llm_batch_seconds', 'Time to summarize a list of news items, retries and quota waits included', ('mode',)
+)
+
+# Cumulative token accounting of all LLM requests made by this process
+token_usage = {'requests': 0, 'prompt_tokens': 0, 'output_tokens': 0}
+_token_usage_lock = threading.Lock()
+
+
+def record_token_usage(response):
+    """
+    Adds the token counts reported with an LLM response to token_usage.
+    :return: (prompt_tokens, output_tokens) of this response
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+    output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+    with _token_usage_lock:
+        token_usage['requests'] += 1
+        token_usage['prompt_tokens'] += prompt_tokens
+        token_usage['output_tokens'] += output_tokens
+    LLM_TOKENS.inc(prompt_tokens, direction='prompt')
+    LLM_TOKENS.inc(output_tokens, direction='output')
+    logging.info(f"LLM request used {prompt_tokens} input and {output_tokens} output tokens.")
+    return prompt_tokens, output_tokens
+
+
+def token_usage_snapshot():
+    """
+    :return: a copy of the cumulative token counters
+    """
+    with _token_usage_lock:
+        return dict(token_usage)
+
+
+# Priority lanes of the governor: interactive requests (a user waiting for an answer) may use
+# the whole quota, batch requests (digest, alerts) leave LLM_INTERACTIVE_RESERVE of it
+LANE_INTERACTIVE = 'interactive'
+LANE_BATCH = 'batch'
+
+# Output tokens expected per summarized headline, taken from the token bucket before a request
+OUTPUT_TOKENS_PER_ITEM = 120
+
+LLM_GOVERNOR_EVENTS = metrics.counter(
+    'llm_governor_events_total', 'LLM governor decisions (granted, throttled, rejected, degraded, breaker_opened)',
+    ('event', 'lane')
+)
+LLM_BREAKER_OPEN = metrics.gauge('llm_breaker_open', 'Whether the LLM circuit breaker is open (1) or closed (0)')
+
+
+class QuotaExhausted(Exception):
+    """
+    Raised by the governor when a request cannot be made: the circuit is open, the daily quota is
+    used up or the wait for quota would be too long.
+    """
+
+
+def _is_quota_error(error):
+    """
+    Recognizes the 'resource exhausted' (HTTP 429) errors of the Gemini API.
+    """
+    return type(error).__name__ in ('ResourceExhausted', 'TooManyRequests') or '429' in str(error)
+
+
+class LLMGovernor:
+    """
+    Central admission control of LLM requests.
+    - Token buckets for requests and tokens per minute, and a daily request count, stored in SQLite so
+      the web app, the digest and the alert worker share one budget.
+    - Two lanes: the batch lane keeps a reserve of every limit free for the interactive lane, and
+      within a process it waits while interactive requests are queued.
+    - Waiting is non-blocking in async code (acquire_async); acquire() is for worker threads only.
+    - A circuit breaker that opens after breaker_failures consecutive failures or on a quota error.
+      While it is open, requests are refused at once and the callers serve degraded summaries.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 requests_per_day=LLM_REQUESTS_PER_DAY, interactive_reserve=LLM_INTERACTIVE_RESERVE,
+                 max_wait=None, breaker_failures=LLM_BREAKER_FAILURES,
+                 breaker_cooldown_seconds=LLM_BREAKER_COOLDOWN_SECONDS):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_day = requests_per_day
+        self.interactive_reserve = interactive_reserve
+        self.max_wait = max_wait or {
+            LANE_INTERACTIVE: LLM_MAX_WAIT_INTERACTIVE_SECONDS, LANE_BATCH: LLM_MAX_WAIT_BATCH_SECONDS
+        }
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown_seconds = breaker_cooldown_seconds
+        self._failures = 0
+        self._open_until = 0.0
+        self._interactive_waiting = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    def is_open(self):
+        """
+        Whether the circuit breaker currently refuses requests.
+        """
+        return time.monotonic() < self._open_until
+
+    def _open(self, seconds, reason):
+        with self._lock:
+            self._open_until = max(self._open_until, time.monotonic() + seconds)
+        LLM_GOVERNOR_EVENTS.inc(event='breaker_opened', lane='all')
+        LLM_BREAKER_OPEN.set(1)
+        logging.warning(f"LLM circuit breaker open for {seconds:.0f}s: {reason}")
+
+    def _try_acquire(self, lane, tokens):
+        """
+        :return: 0.0 if the request may be sent now, otherwise the seconds to wait
+        :raises QuotaExhausted: if the circuit is open or the daily quota is used up
+        """
+        if self.is_open():
+            raise QuotaExhausted('circuit breaker open')
+        if lane == LANE_BATCH and self._interactive_waiting:
+            return 0.1
+        reserve = self.interactive_reserve if lane == LANE_BATCH else 0.0
+        buckets = {
+            'requests': (1, self.requests_per_minute / 60, self.requests_per_minute, self.requests_per_minute * reserve),
+            'tokens': (tokens, self.tokens_per_minute / 60, self.tokens_per_minute, self.tokens_per_minute * reserve),
+        }
+        daily_limit = int(self.requests_per_day * (1 - reserve))
+        wait = db.take_llm_quota(buckets, self._today(), daily_limit, time.time())
+        if wait is None:
+            now = datetime.now(timezone.utc)
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() + 24 * 3600
+            if lane == LANE_INTERACTIVE:
+                self._open(midnight - now.timestamp(), 'daily request quota used up')
+            raise QuotaExhausted(f"daily request quota of the {lane} lane used up")
+        return wait
+
+    def _admit(self, lane, tokens, deadline, wait):
+        if wait == 0:
+            LLM_GOVERNOR_EVENTS.inc(event='granted', lane=lane)
+            return True
+        if time.monotonic() + wait > deadline:
+            LLM_GOVERNOR_EVENTS.inc(event='rejected', lane=lane)
+            raise QuotaExhausted(f"no {lane} quota within {self.max_wait[lane]:.0f}s")
+        LLM_GOVERNOR_EVENTS.inc(event='throttled', lane=lane)
+        return False
+
+    def _waiting(self, lane, delta):
+        if lane == LANE_INTERACTIVE:
+            with self._lock:
+                self._interactive_waiting += delta
+
+    async def acquire_async(self, lane, tokens):
+        """
+        Waits without blocking the event loop until the request may be sent.
+        :param tokens: estimated tokens of the request (prompt and output)
+        :raises QuotaExhausted: if the request cannot be made within the lane's maximum wait
+        """
+        deadline = time.monotonic() + self.max_wait[lane]
+        self._waiting(lane, 1)
+        try:
+            while True:
+                # The quota transaction can wait on the SQLite lock: kept off the event loop
+                wait = await asyncio.to_thread(self._try_acquire, lane, tokens)
+                if self._admit(lane, tokens, deadline, wait):
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self._waiting(lane, -1)
+
+    def acquire(self, lane, tokens):
+        """
+        Blocking version of acquire_async(), for code running in worker threads.
+        """
+        deadline = time.monotonic() + self.max_wait[lane]
+        self._waiting(lane, 1)
+        try:
+            while True:
+                wait = self._try_acquire(lane, tokens)
+                if self._admit(lane, tokens, deadline, wait):
+                    return
+                time.sleep(wait)
+        finally:
+            self._waiting(lane, -1)
+
+    def settle(self, estimated_tokens, prompt_tokens, output_tokens):
+        """
+        Records the real cost of a successful request and closes the circuit.
+        """
+        # Without usage metadata the estimate stands
+        used = prompt_tokens + output_tokens
+        db.settle_llm_quota(
+            self._today(), 'tokens', estimated_tokens - used if used else 0, self.tokens_per_minute,
+            prompt_tokens, output_tokens
+        )
+        with self._lock:
+            self._failures = 0
+        LLM_BREAKER_OPEN.set(0)
+
+    def record_failure(self, error):
+        """
+        Counts a failed request; opens the circuit on a quota error or after too many failures in a row.
+        """
+        with self._lock:
+            self._failures += 1
+            failures = self._failures
+        if _is_quota_error(error):
+            self._open(self.breaker_cooldown_seconds, f"quota error: {error}")
+        elif failures >= self.breaker_failures:
+            self._open(self.breaker_cooldown_seconds, f"{failures} consecutive failures")
+
+    def usage(self):
+        """
+        :return: the shared LLM usage of the current (UTC) day
+        """
+        return db.get_llm_quota_usage(self._today())
+
+
+# Governor of all LLM requests of this process
+governor = LLMGovernor()
+
+
+def estimate_tokens(prompt, items=1):
+    """
+    Estimates the tokens of a request: about four characters per prompt token plus the expected output.
+    """
+    return len(prompt) // 4 + OUTPUT_TOKENS_PER_ITEM * items
+
+
+def degraded_summary(news_title, language='ru'):
+    """
+    Cheap summary used when the LLM is unavailable: the headline and a note in place of the analysis.
+    It is never cached, so the story is summarized properly once the LLM is back.
+    """
+    labels = SUMMARY_LABELS.get(language, SUMMARY_LABELS['en'])
+    return f"{labels[0]}: {news_title}\n{labels[1]}: {DEGRADED_NOTES.get(language, DEGRADED_NOTES['en'])}"
+
+
+def _degraded(news_items, language, lane, results):
+    """
+    Stores degraded summaries of news items in results.
+    """
+    LLM_GOVERNOR_EVENTS.inc(len(news_items), event='degraded', lane=lane)
+    for news_item in news_items:
+        results[news_item['link']] = (degraded_summary(news_item['title'], language), False, True)
+
+
+def _generate(prompt, kind, lane, items=1, generation_config=None):
+    """
+    Sends one request through the governor, from a worker thread.
+    :raises QuotaExhausted: if the governor refuses the request
+    """
+    estimated = estimate_tokens(prompt, items)
+    governor.acquire(lane, estimated)
+    try:
+        with LLM_REQUEST_SECONDS.time(kind=kind):
+            if generation_config:
+                response = get_model().generate_content(prompt, generation_config=generation_config)
+            else:
+                response = get_model().generate_content(prompt)
+    except Exception as e:
+        LLM_ERRORS.inc(kind=kind)
+        governor.record_failure(e)
+        raise
+    governor.settle(estimated, *record_token_usage(response))
+    return response
+
+
+async def _generate_async(prompt, kind, lane, items=1, generation_config=None):
+    """
+    Async version of _generate().
+    """
+    estimated = estimate_tokens(prompt, items)
+    await governor.acquire_async(lane, estimated)
+    try:
+        with LLM_REQUEST_SECONDS.time(kind=kind):
+            if generation_config:
+                response = await get_model().generate_content_async(prompt, generation_config=generation_config)
+            else:
+                response = await get_model().generate_content_async(prompt)
+    except Exception as e:
+        LLM_ERRORS.inc(kind=kind)
+        governor.record_failure(e)
+        raise
+    await asyncio.to_thread(governor.settle, estimated, *record_token_usage(response))
+    return response
+
+
+def _backoff_seconds(attempt):
+    """
+    Exponential backoff with jitter, so retrying processes do not stay in step.
+    """
+    return 2 ** attempt * (0.5 + random.random())
+
+
+def build_summary_prompt(news_title, language='ru', context=None):
+    """
+    Builds the prompt for summarizing a single news headline.
+    :param context: optional condensed article text added after the headline
+    """
     if language == 'ru':
-        prompt = f"""
-        Выступи в роли финансового аналитика. Проанализируй следующий заголовок финансовой новости: "{news_title}".
+        excerpt = f'\n        Ключевые предложения статьи: "{context}".' if context else ''
+        return f"""
+        Выступи в роли финансового аналитика. Проанализируй следующий заголовок финансовой новости: "{news_title}".{excerpt}
         Твоя задача:
         1. Кратко пересказать суть новости на русском языке в одном предложении.
         2. Оценить потенциальное влияние (Позитивное, Нейтральное, Негативное) на акции компании.
@@ -38,9 +419,9 @@ def get_simple_summary(news_title, news_link, language='ru', max_retries=3):
         ВЛИЯНИЕ: [Твоя оценка]
         ПРОГНОЗ: [Твой прогноз]
         """
-    else:
-        prompt = f"""
-        Act as a financial analyst. Analyze the following financial news headline: "{news_title}".
+    excerpt = f'\n        Key sentences of the article: "{context}".' if context else ''
+    return f"""
+        Act as a financial analyst. Analyze the following financial news headline: "{news_title}".{excerpt}
         Your task:
         1. Briefly summarize the news essence in one sentence in English.
         2. Assess the potential impact (Positive, Neutral, Negative) on the company's stock.
@@ -51,22 +432,325 @@ def get_simple_summary(news_title, news_link, language='ru', max_retries=3):
         FORECAST: [Your forecast]
         """
 
+
+def get_simple_summary(news_title, news_link, language='ru', max_retries=3, context=None, lane=LANE_BATCH):
+    """
+    Creates a simple news summary using the LLM, with caching and a retry mechanism.
+    Blocks while backing off: call it from a worker thread, async code uses get_simple_summary_async().
+    :param context: optional condensed article text, see article.get_article_contexts()
+    :param lane: LANE_INTERACTIVE for a user waiting for the answer, LANE_BATCH otherwise
+    :return: (summary, from_cache, degraded)
+    """
+    # 1. Check the cache
+    cached_summary = summary_cache.get(news_link, language, MODEL_NAME, PROMPT_VERSION)
+    if cached_summary:
+        logging.info(f"Found summary in cache for: {news_link}")
+        return cached_summary, True, False  # True means the result is from the cache
+
+    # 2. If not in cache, generate a new summary
+    logging.info(f"Generating new summary for: {news_title}")
+    prompt = build_summary_prompt(news_title, language, context)
+
     for attempt in range(max_retries):
         try:
-            response = model.generate_content(prompt)
+            response = _generate(prompt, 'single', lane)
             summary = response.text
             # 3. Save the new summary to the cache
-            add_summary_to_cache(news_link, summary)
-            return summary, False  # False means the result is not from the cache
+            summary_cache.put(news_link, language, MODEL_NAME, PROMPT_VERSION, summary)
+            return summary, False, False  # False means the result is not from the cache
+        except QuotaExhausted as e:
+            logging.warning(f"LLM unavailable, serving a degraded summary for {news_link}: {e}")
+            break
         except Exception as e:
             logging.error(f"Error interacting with Google Generative AI (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:
-                # Exponential backoff
-                time.sleep(2 ** attempt)
+                time.sleep(_backoff_seconds(attempt))
             else:
                 logging.error("All LLM attempts have been exhausted.")
-                # Fallback: return a simple text if the LLM fails
-                fallback_summary = "Failed to analyze the news with AI."
-                return fallback_summary, False
 
-    return None, False
+    # Fallback: a degraded summary that is not cached
+    LLM_GOVERNOR_EVENTS.inc(event='degraded', lane=lane)
+    return degraded_summary(news_title, language), False, True
+
+
+async def get_simple_summary_async(news_title, news_link, language='ru', max_retries=3, context=None,
+                                   lane=LANE_BATCH):
+    """
+    Async version of get_simple_summary() for the concurrent digest and the web app.
+    Uses the async Gemini client and never blocks the event loop while waiting for quota or backing off.
+    """
+    cached_summary = summary_cache.get(news_link, language, MODEL_NAME, PROMPT_VERSION)
+    if cached_summary:
+        logging.info(f"Found summary in cache for: {news_link}")
+        return cached_summary, True, False
+
+    logging.info(f"Generating new summary for: {news_title}")
+    prompt = build_summary_prompt(news_title, language, context)
+
+    for attempt in range(max_retries):
+        try:
+            response = await _generate_async(prompt, 'single', lane)
+            summary = response.text
+            summary_cache.put(news_link, language, MODEL_NAME, PROMPT_VERSION, summary)
+            return summary, False, False
+        except QuotaExhausted as e:
+            logging.warning(f"LLM unavailable, serving a degraded summary for {news_link}: {e}")
+            break
+        except Exception as e:
+            logging.error(f"Error interacting with Google Generative AI (attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(_backoff_seconds(attempt))
+            else:
+                logging.error("All LLM attempts have been exhausted.")
+
+    LLM_GOVERNOR_EVENTS.inc(event='degraded', lane=lane)
+    return degraded_summary(news_title, language), False, True
+
+
+def build_batch_prompt(news_titles, language='ru', contexts=None):
+    """
+    Builds one prompt for summarizing several headlines in a single request.
+    The instructions are shared, so their cost is paid once per batch.
+    :param contexts: optional list of condensed article texts (or None), parallel to news_titles
+    """
+    target_language = 'Russian' if language == 'ru' else 'English'
+    contexts = contexts or [None] * len(news_titles)
+    headlines = '\n'.join(
+        f"{i}. {title}" + (f"\n   Key sentences of the article: {context}" if context else '')
+        for i, (title, context) in enumerate(zip(news_titles, contexts))
+    )
+    return (
+        "Act as a financial analyst. For each numbered financial news headline below return an object with: "
+        f"id (the headline number), essence (a one-sentence summary in {target_language}), "
+        "impact (Positive, Neutral or Negative for the company's stock) "
+        f"and forecast (a very short 1-3 day forecast in {target_language}).\n"
+        f"Headlines:\n{headlines}"
+    )
+
+
+def format_structured_summary(item, language='ru'):
+    """
+    Renders one structured summary in the ESSENCE/IMPACT/FORECAST text format.
+    """
+    labels = SUMMARY_LABELS.get(language, SUMMARY_LABELS['en'])
+    impacts = IMPACT_LABELS.get(language, IMPACT_LABELS['en'])
+    return (
+        f"{labels[0]}: {item['essence'].strip()}\n"
+        f"{labels[1]}: {impacts[item['impact']]}\n"
+        f"{labels[2]}: {item['forecast'].strip()}"
+    )
+
+
+def parse_batch_response(text, batch_size):
+    """
+    Validates a batched JSON response.
+    :return: dict id -> item for every valid item; invalid or missing ids are left out.
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError) as e:
+        logging.warning(f"Malformed batch response from the LLM: {e}")
+        return {}
+    if not isinstance(data, list):
+        logging.warning("Batch response from the LLM is not a list.")
+        return {}
+
+    valid = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        item_id = item.get('id')
+        if not isinstance(item_id, int) or not 0 <= item_id < batch_size or item_id in valid:
+            continue
+        if item.get('impact') not in IMPACT_VALUES:
+            continue
+        if not all(isinstance(item.get(key), str) and item[key].strip() for key in ('essence', 'forecast')):
+            continue
+        valid[item_id] = item
+    return valid
+
+
+def _split_cached(news_items, language):
+    """
+    Splits news items into cached results and the items that still need the LLM.
+    """
+    unique_items = list({news_item['link']: news_item for news_item in news_items}.values())
+    cached = summary_cache.get_many(
+        [news_item['link'] for news_item in unique_items], language, MODEL_NAME, PROMPT_VERSION
+    )
+    results = {link: (summary, True, False) for link, summary in cached.items()}
+    pending = [news_item for news_item in unique_items if news_item['link'] not in cached]
+    return results, pending
+
+
+def _store_batch(batch, text, language, results):
+    """
+    Caches every valid item of a batched response separately.
+    :return: the news items of the batch that came back missing or malformed
+    """
+    valid = parse_batch_response(text, len(batch))
+    failed = []
+    summaries = {}
+    for i, news_item in enumerate(batch):
+        if i in valid:
+            summary = format_structured_summary(valid[i], language)
+            summaries[news_item['link']] = summary
+            results[news_item['link']] = (summary, False, False)
+        else:
+            failed.append(news_item)
+    summary_cache.put_many(summaries, language, MODEL_NAME, PROMPT_VERSION)
+    return failed
+
+
+def chunked(items, size):
+    """
+    Splits a list into consecutive chunks of at most size items.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _retry_batch(error, attempt, max_retries):
+    """
+    Decides whether a failed batch request is sent again. The batch is retried as a whole and only
+    while the circuit breaker is closed: one request per item would multiply the load of an outage.
+    """
+    logging.error(f"Error in batched request to Google Generative AI (attempt {attempt + 1}/{max_retries}): {error}")
+    return attempt < max_retries - 1 and not governor.is_open()
+
+
+def _request_batch(batch, prompt, lane, max_retries):
+    """
+    Sends the request of one batch, retried as a whole (see _retry_batch()), from a worker thread.
+    :return: (response, llm_requests) where response is None if every attempt failed
+    :raises QuotaExhausted: if the governor refuses the request
+    """
+    for attempt in range(max_retries):
+        try:
+            return _generate(prompt, 'batch', lane, len(batch), BATCH_GENERATION_CONFIG), attempt + 1
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            if not _retry_batch(e, attempt, max_retries):
+                return None, attempt + 1
+            time.sleep(_backoff_seconds(attempt))
+    return None, max_retries
+
+
+async def _request_batch_async(batch, prompt, lane, max_retries):
+    """
+    Async version of _request_batch().
+    """
+    for attempt in range(max_retries):
+        try:
+            return await _generate_async(prompt, 'batch', lane, len(batch), BATCH_GENERATION_CONFIG), attempt + 1
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            if not _retry_batch(e, attempt, max_retries):
+                return None, attempt + 1
+            await asyncio.sleep(_backoff_seconds(attempt))
+    return None, max_retries
+
+
+def _plan_batches(pending, contexts, language, batch_size):
+    """
+    Splits the uncached items into batches.
+    :return: list of (batch, prompt)
+    """
+    return [
+        (batch, build_batch_prompt(
+            [news_item['title'] for news_item in batch], language,
+            [contexts.get(news_item['link']) for news_item in batch]
+        ))
+        for batch in chunked(pending, batch_size or LLM_BATCH_SIZE)
+    ]
+
+
+def _apply_batch(batch, response, language, lane, results):
+    """
+    Stores the outcome of one batch request in results: the valid summaries of a response are cached,
+    a batch whose request failed gets degraded summaries.
+    :param response: the LLM response, or None if every attempt failed
+    :return: the news items to summarize again one by one (missing or malformed in the response)
+    """
+    if response is None:
+        _degraded(batch, language, lane, results)
+        return []
+    failed = _store_batch(batch, response.text, language, results)
+    for news_item in failed:
+        logging.info(f"Retrying failed batch item on its own: {news_item['title']}")
+    return failed
+
+
+def _refuse_batches(batches, language, lane, results, error):
+    """
+    Gives degraded summaries to the batches left when the governor refuses a request.
+    """
+    logging.warning(f"LLM unavailable, serving degraded summaries for the rest of the batch: {error}")
+    for batch, _ in batches:
+        _degraded(batch, language, lane, results)
+
+
+@LLM_BATCH_SECONDS.time(mode='blocking')
+def get_batch_summaries(news_items, language='ru', batch_size=None, lane=LANE_BATCH, max_retries=3):
+    """
+    Summarizes several headlines with one LLM request per batch, using JSON-schema output.
+    Uncached headlines are sent with the condensed text of their article, when it can be fetched.
+    Items that come back missing or malformed are retried one by one with get_simple_summary().
+    A failed batch request is retried as a whole; when the retries are used up, the circuit breaker
+    opens or the governor refuses a request, the items get degraded summaries.
+    Blocks while waiting for quota: call it from a worker thread, async code uses get_batch_summaries_async().
+    :param news_items: list of dicts with 'title' and 'link'
+    :param lane: LANE_INTERACTIVE for a user waiting for the answer, LANE_BATCH otherwise
+    :return: (results, llm_requests) where results maps link -> (summary, from_cache, degraded);
+        degraded summaries are the headline-only fallback (see degraded_summary)
+    """
+    results, pending = _split_cached(news_items, language)
+    contexts = get_article_contexts(pending)
+    llm_requests = 0
+
+    batches = _plan_batches(pending, contexts, language, batch_size)
+    for index, (batch, prompt) in enumerate(batches):
+        logging.info(f"Generating {len(batch)} summaries in one batch ({language}).")
+        try:
+            response, requests = _request_batch(batch, prompt, lane, max_retries)
+        except QuotaExhausted as e:
+            _refuse_batches(batches[index:], language, lane, results, e)
+            break
+        llm_requests += requests
+        for news_item in _apply_batch(batch, response, language, lane, results):
+            results[news_item['link']] = get_simple_summary(
+                news_item['title'], news_item['link'], language, context=contexts.get(news_item['link']), lane=lane
+            )
+            llm_requests += 0 if results[news_item['link']][1] else 1
+
+    return results, llm_requests
+
+
+@LLM_BATCH_SECONDS.time(mode='async')
+async def get_batch_summaries_async(news_items, language='ru', batch_size=None, lane=LANE_BATCH, max_retries=3):
+    """
+    Async version of get_batch_summaries(); waits for quota without blocking the event loop.
+    """
+    results, pending = _split_cached(news_items, language)
+    # Article downloads are blocking: keep them off the event loop
+    contexts = await asyncio.to_thread(get_article_contexts, pending)
+    llm_requests = 0
+
+    batches = _plan_batches(pending, contexts, language, batch_size)
+    for index, (batch, prompt) in enumerate(batches):
+        logging.info(f"Generating {len(batch)} summaries in one batch ({language}).")
+        try:
+            response, requests = await _request_batch_async(batch, prompt, lane, max_retries)
+        except QuotaExhausted as e:
+            _refuse_batches(batches[index:], language, lane, results, e)
+            break
+        llm_requests += requests
+        for news_item in _apply_batch(batch, response, language, lane, results):
+            results[news_item['link']] = await get_simple_summary_async(
+                news_item['title'], news_item['link'], language, context=contexts.get(news_item['link']), lane=lane
+            )
+            llm_requests += 0 if results[news_item['link']][1] else 1
+
+    return results, llm_requests
@@ -0,0 +1,308 @@
+"""
+Lightweight in-process metrics: counters, gauges, latency histograms and timers.
+
+Metrics are registered once per name in a shared registry and rendered in the Prometheus
+text exposition format by render(). Instruments with label names keep one series per
+combination of label values, e.g.:
+
+    LLM_REQUEST_SECONDS = histogram('llm_request_seconds', 'Gemini request latency', ('kind',))
+    with LLM_REQUEST_SECONDS.time(kind='batch'):
+        ...
+"""
+
+import contextlib
+import functools
+import inspect
+import math
+import threading
+import time
+
+# Upper bounds (seconds) of the default latency buckets: from fast SQLite queries to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, e.g. the number of requests.
+    """
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+    def snapshot(self):
+        with self._lock:
+            return {','.join(key) or '': value for key, value in self._values.items()}
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, e.g. the depth of a queue.
+    """
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class _Timer:
+    """
+    Context manager and decorator that observes the elapsed time into a histogram.
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            # Timed until the coroutine finishes, not until it is created
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _Timer(self.histogram, self.labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (latencies in seconds) over fixed buckets.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def time(self, **labels):
+        """
+        Times a block (`with histogram.time(...)`) or a function or coroutine function (`@histogram.time(...)`).
+        """
+        self._key(labels)
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series['counts']))) for key, series in self._values.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+    def snapshot(self):
+        """
+        :return: dict label values -> {'count', 'sum', 'mean'}
+        """
+        with self._lock:
+            return {
+                ','.join(key) or '': {
+                    'count': series['count'],
+                    'sum': round(series['sum'], 6),
+                    'mean': round(series['sum'] / series['count'], 6) if series['count'] else 0.0,
+                }
+                for key, series in self._values.items()
+            }
+
+
+class MetricsRegistry:
+    """
+    Keeps every metric of the process by name.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with another type or labels")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+    def snapshot(self):
+        """
+        :return: dict metric name -> values by label values, for structured run summaries
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def reset(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+# Shared registry of the process
+registry = MetricsRegistry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+render = registry.render
+snapshot = registry.snapshot
+
+# Duration of the stages of a run, see RunTimer
+STAGE_SECONDS = histogram('stage_duration_seconds', 'Duration of a pipeline stage', ('stage',))
+
+# Latest persisted run summaries, set by export_run_summary() when the metrics are scraped
+RUN_LAST_TIMESTAMP = gauge('run_last_finished_timestamp_seconds', 'Unix time the last run finished', ('kind',))
+RUN_LAST_DURATION = gauge('run_last_duration_seconds', 'Duration of the last run', ('kind',))
+RUN_LAST_STAGE = gauge('run_last_stage_seconds', 'Stage durations of the last run', ('kind', 'stage'))
+RUN_LAST_STAT = gauge('run_last_stat', 'Counters of the last run', ('kind', 'name'))
+
+
+class RunTimer:
+    """
+    Times the stages of one run: keeps the durations of this run for its summary
+    and records every stage in the stage_duration_seconds histogram.
+
+        timer = RunTimer()
+        with timer.stage('fetch'):
+            ...
+        timer.durations  # {'fetch': 1.2}
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.durations = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+    def slowest(self):
+        """
+        :return: (stage, seconds) of the slowest stage, or (None, 0.0)
+        """
+        return max(self.durations.items(), key=lambda item: item[1], default=(None, 0.0))
+
+
+def export_run_summary(kind, summary):
+    """
+    Publishes a persisted run summary (see database.save_run_summary) as gauges.
+    :param summary: dict with 'started_at', 'finished_at', 'stages' and 'stats'
+    """
+    RUN_LAST_TIMESTAMP.set(summary['finished_at'], kind=kind)
+    RUN_LAST_DURATION.set(summary['finished_at'] - summary['started_at'], kind=kind)
+    for stage, seconds in summary.get('stages', {}).items():
+        RUN_LAST_STAGE.set(seconds, kind=kind, stage=stage)
+    for name, value in summary.get('stats', {}).items():
+        if isinstance(value, (int, float)):
+            RUN_LAST_STAT.set(value, kind=kind, name=name)
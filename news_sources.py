@@ -0,0 +1,353 @@
+"""
+Pluggable news sources and an aggregator that queries them in parallel.
+
+Every source returns items normalized to:
+    {'id', 'title', 'link', 'published', 'source', 'ticker'}
+The aggregator fans out across the enabled sources, applies a timeout and a circuit
+breaker per source, and merges the results into one stream ordered newest first.
+"""
+
+import abc
+import calendar
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import feedparser
+import requests
+
+import metrics
+from config import NEWS_SOURCES, NEWS_SOURCE_TIMEOUT, NEWSAPI_KEY, ALPHAVANTAGE_API_KEY, RSS_FEED_TEMPLATE
+from data_source import fetch_yfinance_news, parse_timestamp, ticker_registry
+
+
+SOURCE_REQUEST_SECONDS = metrics.histogram(
+    'news_source_request_seconds', 'Latency of news source requests', ('source',)
+)
+SOURCE_ERRORS = metrics.counter(
+    'news_source_errors_total', 'Failed or skipped news source requests', ('source', 'reason')
+)
+
+
+def _link_id(link):
+    return hashlib.sha256(link.encode()).hexdigest()
+
+
+# Query parameters that only track where a click came from; any 'utm_' parameter is one too
+TRACKING_PARAMS = frozenset((
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', 'ref', 'ref_src', 'cmpid', 'ncid',
+    'guccounter', 'guce_referrer', 'guce_referrer_sig', 'soc_src', 'soc_trk',
+))
+
+
+def normalize_link(link):
+    """
+    Normalizes a URL for duplicate detection: drops the tracking parameters, fragment and trailing slash,
+    and sorts the remaining query parameters, which may identify the article (e.g. ?id=123).
+    """
+    parts = urlsplit(link.strip())
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), urlencode(query), ''))
+
+
+class NewsSource(abc.ABC):
+    """
+    Base class of a news source. Subclasses implement fetch() and let errors propagate,
+    so the aggregator can count them in the source's circuit breaker.
+    """
+    name = 'base'
+
+    def __init__(self, timeout=NEWS_SOURCE_TIMEOUT):
+        self.timeout = timeout
+
+    @abc.abstractmethod
+    def fetch(self, ticker):
+        """
+        :return: list of normalized news items for the ticker
+        """
+
+    def _item(self, ticker, title, link, published, item_id=None):
+        if not title or not link:
+            return None
+        return {
+            'id': item_id or _link_id(link),
+            'title': title.strip(),
+            'link': link,
+            'published': published,
+            'source': self.name,
+            'ticker': ticker,
+        }
+
+
+class YFinanceSource(NewsSource):
+    name = 'yfinance'
+
+    def fetch(self, ticker):
+        return [
+            self._item(ticker, item['title'], item['link'], item['published'], item['id'])
+            for item in fetch_yfinance_news(ticker)
+        ]
+
+
+class RSSSource(NewsSource):
+    """
+    Any RSS/Atom feed with a per-ticker URL, e.g. Yahoo Finance headlines.
+    """
+    name = 'rss'
+
+    def __init__(self, url_template=RSS_FEED_TEMPLATE, timeout=NEWS_SOURCE_TIMEOUT):
+        super().__init__(timeout)
+        self.url_template = url_template
+
+    def fetch(self, ticker):
+        response = requests.get(self.url_template.format(ticker=ticker), timeout=self.timeout)
+        response.raise_for_status()
+        feed = feedparser.parse(response.content)
+        items = []
+        for entry in feed.entries:
+            parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+            published = calendar.timegm(parsed) if parsed else None
+            items.append(self._item(ticker, entry.get('title'), entry.get('link'), published, entry.get('id')))
+        return items
+
+
+class NewsAPISource(NewsSource):
+    """
+    NewsAPI.org "everything" endpoint (free tier). It is a full-text search, so the company is
+    searched by name when the ticker registry knows it, and the symbol is quoted otherwise.
+    :param names: callable symbol -> company name or None (the ticker registry by default)
+    """
+    name = 'newsapi'
+
+    # Legal suffixes dropped from company names: articles say 'Apple', not 'Apple Inc.'
+    COMPANY_SUFFIX_PATTERN = re.compile(
+        r'[,.]?\s+(?:inc|incorporated|corp|corporation|co|company|ltd|limited|plc|ag|sa|nv|se|holdings?|group)\.?$',
+        re.IGNORECASE
+    )
+
+    def __init__(self, api_key=NEWSAPI_KEY, base_url='https://newsapi.org/v2', timeout=NEWS_SOURCE_TIMEOUT,
+                 names=None):
+        super().__init__(timeout)
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.names = names or ticker_registry.name
+
+    def query(self, ticker):
+        """
+        Builds the search query of a ticker: a bare short symbol such as 'F', 'T' or 'ON'
+        would match unrelated articles.
+        """
+        name = self.names(ticker)
+        if name:
+            previous = None
+            while name != previous:
+                previous, name = name, self.COMPANY_SUFFIX_PATTERN.sub('', name).strip()
+        return f'"{name or ticker}"'
+
+    def fetch(self, ticker):
+        response = requests.get(
+            f"{self.base_url}/everything",
+            params={'q': self.query(ticker), 'sortBy': 'publishedAt', 'language': 'en', 'pageSize': 20},
+            headers={'X-Api-Key': self.api_key},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+        if data.get('status') != 'ok':
+            raise ValueError(f"NewsAPI error: {data.get('message')}")
+        return [
+            self._item(ticker, article.get('title'), article.get('url'), parse_timestamp(article.get('publishedAt')))
+            for article in data.get('articles', [])
+        ]
+
+
+class AlphaVantageSource(NewsSource):
+    """
+    Alpha Vantage NEWS_SENTIMENT endpoint (free tier).
+    """
+    name = 'alphavantage'
+
+    def __init__(self, api_key=ALPHAVANTAGE_API_KEY, base_url='https://www.alphavantage.co',
+                 timeout=NEWS_SOURCE_TIMEOUT):
+        super().__init__(timeout)
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+
+    @staticmethod
+    def _parse_time(value):
+        # Alpha Vantage uses the compact format 20240131T153000 (UTC)
+        try:
+            return int(datetime.strptime(value, '%Y%m%dT%H%M%S').replace(tzinfo=timezone.utc).timestamp())
+        except (TypeError, ValueError):
+            return None
+
+    def fetch(self, ticker):
+        response = requests.get(
+            f"{self.base_url}/query",
+            params={'function': 'NEWS_SENTIMENT', 'tickers': ticker, 'limit': 50, 'apikey': self.api_key},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+        if 'feed' not in data:
+            # Rate limit and error answers come back as HTTP 200 with a note instead of a feed
+            raise ValueError(f"Alpha Vantage error: {data.get('Note') or data.get('Information') or data}")
+        return [
+            self._item(ticker, article.get('title'), article.get('url'), self._parse_time(article.get('time_published')))
+            for article in data['feed']
+        ]
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing source for reset_timeout seconds after failure_threshold
+    consecutive failures. After that it lets calls through again in a half-open state
+    where a single further failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: the next failure re-opens the circuit
+                self.opened_at = None
+                self.failures = self.failure_threshold - 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class NewsAggregator:
+    """
+    Queries several sources in parallel and merges their items into one ordered stream.
+    """
+
+    def __init__(self, sources, max_workers=32, failure_threshold=3, reset_timeout=300):
+        self.sources = list(sources)
+        self.breakers = {source.name: CircuitBreaker(failure_threshold, reset_timeout) for source in self.sources}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='news-source')
+
+    def fetch(self, ticker):
+        """
+        Fetches the news of a ticker from every available source concurrently.
+        :return: merged list of items, unique by link, newest first
+        """
+        return self.fetch_items(ticker)[0]
+
+    def fetch_items(self, ticker):
+        """
+        Same as fetch(), and tells whether any source answered.
+        :return: (items, answered) where answered is the number of sources that returned a result,
+            so an empty list because every source failed is told apart from a ticker without news
+        """
+        started = time.monotonic()
+        futures = []
+        for source in self.sources:
+            if self.breakers[source.name].allow():
+                futures.append((source, self._executor.submit(self._fetch_source, source, ticker)))
+            else:
+                SOURCE_ERRORS.inc(source=source.name, reason='circuit_open')
+                logging.info(f"Circuit open for news source {source.name}, skipping.")
+
+        results = []
+        for source, future in futures:
+            breaker = self.breakers[source.name]
+            remaining = max(0.0, source.timeout - (time.monotonic() - started))
+            try:
+                items = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                SOURCE_ERRORS.inc(source=source.name, reason='timeout')
+                breaker.record_failure()
+                logging.warning(f"News source {source.name} timed out for {ticker}.")
+                continue
+            except Exception as e:
+                SOURCE_ERRORS.inc(source=source.name, reason='error')
+                breaker.record_failure()
+                logging.error(f"Error fetching news for {ticker} from {source.name}: {e}")
+                continue
+            breaker.record_success()
+            results.append(items)
+        return merge_news(results), len(results)
+
+    @staticmethod
+    def _fetch_source(source, ticker):
+        with SOURCE_REQUEST_SECONDS.time(source=source.name):
+            return source.fetch(ticker)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def merge_news(results):
+    """
+    Merges per-source item lists: drops duplicate links, keeps the earliest source order
+    for ties, and sorts the items newest first (items without a publish time go last).
+    """
+    merged = {}
+    for items in results:
+        for item in items:
+            if item is None:
+                continue
+            key = normalize_link(item['link'])
+            if key not in merged:
+                merged[key] = item
+    return sorted(merged.values(), key=lambda item: item['published'] or 0, reverse=True)
+
+
+def build_sources(names=NEWS_SOURCES):
+    """
+    Creates the configured sources, skipping those that need an API key that is not set.
+    """
+    sources = []
+    for name in names:
+        if name == 'yfinance':
+            sources.append(YFinanceSource())
+        elif name == 'rss':
+            sources.append(RSSSource())
+        elif name == 'newsapi':
+            if NEWSAPI_KEY:
+                sources.append(NewsAPISource())
+            else:
+                logging.info('NEWSAPI_KEY is not set, NewsAPI source disabled.')
+        elif name == 'alphavantage':
+            if ALPHAVANTAGE_API_KEY:
+                sources.append(AlphaVantageSource())
+            else:
+                logging.info('ALPHAVANTAGE_API_KEY is not set, Alpha Vantage source disabled.')
+        else:
+            logging.warning(f"Unknown news source '{name}' in NEWS_SOURCES.")
+    return sources
+
+
+# Shared aggregator over the configured sources
+news_aggregator = NewsAggregator(build_sources())
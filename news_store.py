@@ -0,0 +1,61 @@
+"""
+Persisted per-ticker news store.
+
+News fetched from all configured sources (see news_sources) is kept in SQLite with item ids and publish times.
+Repeat requests for a ticker within NEWS_FETCH_TTL_SECONDS are served locally,
+so the digest and other consumers do not refetch the same list over and over.
+"""
+
+import logging
+import time
+
+import database as db
+from news_sources import news_aggregator
+from config import NEWS_FETCH_TTL_SECONDS, NEWS_STORE_LIMIT, NEWS_RETENTION_DAYS
+
+
+def get_ticker_news(ticker, ttl_seconds=NEWS_FETCH_TTL_SECONDS, limit=NEWS_STORE_LIMIT):
+    """
+    Returns the most recent news items for a ticker, newest first.
+    :return: (items, from_store) where from_store is True if no fetch was needed
+    """
+    now = time.time()
+    fetched_at = db.get_news_fetched_at(ticker)
+    if fetched_at is not None and now - fetched_at < ttl_seconds:
+        return db.get_stored_news(ticker, limit), True
+
+    items, answered = news_aggregator.fetch_items(ticker)
+    try:
+        if not answered:
+            # Every source failed: the fetch time is not recorded, so the next request tries again
+            logging.warning(f"No news source answered for {ticker}, serving the stored news.")
+            return db.get_stored_news(ticker, limit), False
+        db.save_news_items(ticker, items, now)
+        return db.get_stored_news(ticker, limit), False
+    except Exception as e:
+        logging.error(f"Error storing news for {ticker}: {e}")
+        # Same shape as the stored items: undated items count as published at the fetch
+        items = [dict(item, published=item['published'] or now) for item in items]
+        return sorted(items, key=lambda item: item['published'], reverse=True)[:limit], False
+
+
+def select_new_items(items, watermark, limit=None):
+    """
+    Returns up to `limit` items published after the watermark, in the order of `items`.
+    :param items: items sorted newest (or best) first
+    :param watermark: unix time of the newest item already delivered, or None
+    :param limit: maximum number of items, or None for all
+    """
+    if watermark is None:
+        return items[:limit]
+    return [item for item in items if (item['published'] or 0) > watermark][:limit]
+
+
+def prune_old_news(retention_days=NEWS_RETENTION_DAYS):
+    """
+    Removes stored news older than the retention period.
+    """
+    deleted = db.prune_news_items(retention_days * 24 * 3600)
+    if deleted:
+        logging.info(f"Pruned {deleted} old news items.")
+    return deleted
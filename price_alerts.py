@@ -0,0 +1,226 @@
+"""
+Price alerts: notify users when a ticker crosses a price level or moves by a percentage in a day.
+
+Every tick the worker loads all alerts as arrays and downloads the quotes of the distinct set of
+alerted tickers with one bulk yfinance.download call. Every alert is then evaluated at once with
+NumPy: the quotes are indexed by the ticker index of each alert, and the conditions are array
+comparisons, so the cost per tick is one download plus a few vector operations, whatever the
+number of alerts.
+
+An alert fires once when its condition becomes true and is disarmed when its message has been
+delivered; if the message cannot be sent the alert stays armed and fires again on the next tick,
+up to PRICE_ALERT_MAX_SEND_ATTEMPTS times. The alerts of a user who blocked the bot are skipped
+until they return.
+It is re-armed when the price moves back past the hysteresis band (PRICE_ALERT_HYSTERESIS_PERCENT),
+so a price hovering around the level does not trigger it again and again.
+"""
+
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+import database as db
+import metrics
+from config import (
+    PRICE_ALERT_HYSTERESIS_PERCENT, PRICE_ALERT_MAX_SEND_ATTEMPTS, TELEGRAM_RATE_LIMIT, TELEGRAM_PER_CHAT_INTERVAL
+)
+from data_source import fetch_quotes
+from delivery import DeliveryScheduler, PRIORITY_HIGH, FAILURE_PERMANENT, FAILURE_TIMED_OUT
+
+# Alert directions: the price rises to the level, falls to it, or moves by `level` percent in a day
+DIRECTIONS = ('above', 'below', 'move')
+ABOVE, BELOW, MOVE = range(len(DIRECTIONS))
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+PRICE_ALERT_EVENTS = metrics.counter(
+    'price_alert_events_total', 'Price alert worker events (checked, fired, rearmed, pushed)', ('event',)
+)
+
+
+def evaluate(directions, levels, armed, prices, previous, hysteresis_percent=PRICE_ALERT_HYSTERESIS_PERCENT):
+    """
+    Evaluates many alerts at once.
+    :param directions: int array of ABOVE, BELOW or MOVE per alert
+    :param levels: float array: the price level, or the daily move in percent for MOVE
+    :param armed: bool array: whether each alert can fire
+    :param prices: float array: the latest price of each alert's ticker (NaN if unknown)
+    :param previous: float array: the previous close of each alert's ticker (NaN if unknown)
+    :return: (fire, rearm, moves) bool arrays of the alerts that fire and that are re-armed,
+        and the daily move of every alert's ticker in percent
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moves = (prices / previous - 1) * 100
+    known = ~np.isnan(prices)
+    band = hysteresis_percent / 100
+    is_above, is_below, is_move = directions == ABOVE, directions == BELOW, directions == MOVE
+    # NaN comparisons are False, so alerts without a quote neither fire nor re-arm
+    condition = (
+        (is_above & (prices >= levels))
+        | (is_below & (prices <= levels))
+        | (is_move & (np.abs(moves) >= levels))
+    )
+    released = (
+        (is_above & (prices < levels * (1 - band)))
+        | (is_below & (prices > levels * (1 + band)))
+        | (is_move & (np.abs(moves) < levels - np.minimum(hysteresis_percent, levels / 2)))
+    )
+    return armed & known & condition, ~armed & known & released, moves
+
+
+def describe(direction, level):
+    """
+    Renders an alert condition, e.g. 'above 250.00' or 'moves 5%'.
+    """
+    if direction == 'move':
+        return f"moves {level:g}%"
+    return f"{direction} {level:.2f}"
+
+
+def format_alerts(fired):
+    """
+    Builds the message of one user.
+    :param fired: list of (alert id, ticker, direction, level, price, move)
+    """
+    lines = [
+        f"🚨 *{ticker}* {describe(direction, level)}: {price:.2f}"
+        + (f" ({move:+.2f}% today)" if not np.isnan(move) else '')
+        for _, ticker, direction, level, price, move in fired
+    ]
+    return 'Price alerts:\n' + '\n'.join(lines)
+
+
+class PriceAlertWorker:
+    """
+    Checks all price alerts every tick and notifies the users whose alerts fire.
+    :param bot: telegram.Bot used for sending
+    """
+
+    def __init__(self, bot, hysteresis_percent=PRICE_ALERT_HYSTERESIS_PERCENT,
+                 max_send_attempts=PRICE_ALERT_MAX_SEND_ATTEMPTS):
+        self.bot = bot
+        self.hysteresis_percent = hysteresis_percent
+        self.max_send_attempts = max_send_attempts
+        # Alert id -> number of ticks its message failed to be sent
+        self._send_failures = {}
+
+    def check(self, now):
+        """
+        Downloads the quotes and evaluates every alert. The alerts that are re-armed are stored at once,
+        the fired ones are only disarmed once their message is delivered (see tick).
+        :return: dict chat_id -> list of (alert id, ticker, direction, level, price, move) of the fired alerts
+        """
+        ids, chat_ids, tickers, directions, levels, armed = db.get_price_alerts()
+        if not ids:
+            return {}
+        # Integer codes through dict lookups: cheaper than comparing arrays of strings
+        symbols = sorted(set(tickers))
+        positions = {symbol: position for position, symbol in enumerate(symbols)}
+        ticker_index = np.fromiter((positions[ticker] for ticker in tickers), dtype=np.int64, count=len(tickers))
+        direction_codes = np.fromiter(
+            (DIRECTION_CODES[direction] for direction in directions), dtype=np.int64, count=len(directions)
+        )
+        last, previous = fetch_quotes(symbols)
+        levels = np.array(levels, dtype=float)
+        fire, rearm, moves = evaluate(
+            direction_codes, levels, np.array(armed, dtype=bool), last[ticker_index], previous[ticker_index],
+            self.hysteresis_percent
+        )
+
+        ids = np.array(ids)
+        db.update_price_alerts([], ids[rearm].tolist(), now)
+        PRICE_ALERT_EVENTS.inc(len(ids), event='checked')
+        PRICE_ALERT_EVENTS.inc(int(fire.sum()), event='fired')
+        PRICE_ALERT_EVENTS.inc(int(rearm.sum()), event='rearmed')
+
+        fired = {}
+        prices = last[ticker_index]
+        for i in np.flatnonzero(fire).tolist():
+            fired.setdefault(chat_ids[i], []).append(
+                (int(ids[i]), tickers[i], directions[i], float(levels[i]), float(prices[i]), float(moves[i]))
+            )
+        return fired
+
+    def on_delivered(self, alert_ids, now, stats):
+        """
+        Returns the delivery callback of one user's message: it disarms the alerts it reported
+        and counts the user as alerted.
+        """
+        def delivered(chat_id):
+            db.update_price_alerts(alert_ids, [], now)
+            for alert_id in alert_ids:
+                self._send_failures.pop(alert_id, None)
+            stats['users_alerted'] += 1
+        return delivered
+
+    def on_failed(self, alert_ids, now, stats):
+        """
+        Returns the failure callback of one user's message. A message that timed out counts as
+        delivered. If the chat refuses messages the user is blocked, which skips their alerts until
+        they return; otherwise the alerts stay armed, and are disarmed once they failed max_send_attempts times.
+        """
+        delivered = self.on_delivered(alert_ids, now, stats)
+
+        def failed(chat_id, kind):
+            if kind == FAILURE_TIMED_OUT:
+                return delivered(chat_id)
+            if kind == FAILURE_PERMANENT:
+                logging.warning(f"User {chat_id} does not accept messages, skipping their price alerts.")
+                stats['users_blocked'] += 1
+                db.block_users([chat_id], now)
+                return
+            given_up = []
+            for alert_id in alert_ids:
+                self._send_failures[alert_id] = self._send_failures.get(alert_id, 0) + 1
+                if self._send_failures[alert_id] >= self.max_send_attempts:
+                    given_up.append(alert_id)
+                    del self._send_failures[alert_id]
+            if given_up:
+                logging.warning(f"Giving up the price alerts {given_up} of user {chat_id} after failed sends.")
+                db.update_price_alerts(given_up, [], now)
+        return failed
+
+    async def tick(self, now=None):
+        """
+        Runs one check and sends the notifications.
+        :return: dict with the statistics of the round
+        """
+        now = now or time.time()
+        fired = await asyncio.to_thread(self.check, now)
+        stats = {
+            'alerts_fired': sum(len(alerts) for alerts in fired.values()), 'users_alerted': 0, 'users_blocked': 0,
+            'errors': 0
+        }
+        if fired:
+            scheduler = DeliveryScheduler(
+                self.bot, rate=TELEGRAM_RATE_LIMIT, per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL
+            )
+            scheduler.start()
+            for chat_id, alerts in fired.items():
+                alert_ids = [alert[0] for alert in alerts]
+                scheduler.submit(
+                    chat_id, format_alerts(alerts), priority=PRIORITY_HIGH,
+                    on_delivered=self.on_delivered(alert_ids, now, stats),
+                    on_failed=self.on_failed(alert_ids, now, stats)
+                )
+            await scheduler.close()
+            stats['errors'] = scheduler.stats['failed']
+            PRICE_ALERT_EVENTS.inc(stats['users_alerted'], event='pushed')
+        logging.info(
+            f"Price alert tick: {stats['alerts_fired']} alerts fired, {stats['users_alerted']} users alerted, "
+            f"{stats['errors']} errors."
+        )
+        return stats
+
+    async def run_forever(self, tick_seconds):
+        """
+        Runs a check every tick_seconds.
+        """
+        while True:
+            started = time.monotonic()
+            try:
+                await self.tick()
+            except Exception as e:
+                logging.error(f"Error in price alert tick: {e}")
+            await asyncio.sleep(max(0.0, tick_seconds - (time.monotonic() - started)))
@@ -0,0 +1,54 @@
+"""
+Script that runs the background workers: news alerts, price alerts and the /news refreshes.
+This needs to be added as an "Always-on task" on PythonAnywhere.
+
+Usage:
+    python run_alerts.py         # poll news every ALERT_TICK_SECONDS, prices every PRICE_ALERT_TICK_SECONDS
+                                 # and serve /news refreshes every TICKER_NEWS_TICK_SECONDS
+    python run_alerts.py --once  # run a single round of every worker (e.g. from cron)
+"""
+
+import argparse
+import asyncio
+import telegram
+import config
+from alerts import AlertWorker
+from config import ALERT_TICK_SECONDS, PRICE_ALERT_TICK_SECONDS, TICKER_NEWS_TICK_SECONDS
+from database import init_db
+from price_alerts import PriceAlertWorker
+from ticker_news import TickerNewsWorker
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Push important news and price alerts to the users as they happen.')
+    parser.add_argument('--once', action='store_true', help='Run a single round of every worker and exit.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print('Initializing DB...')
+    init_db()
+    bot = telegram.Bot(token=config.TELEGRAM_BOT_TOKEN)
+    worker = AlertWorker(bot)
+    price_worker = PriceAlertWorker(bot)
+    news_worker = TickerNewsWorker(bot)
+    if args.once:
+        async def run_once():
+            return await asyncio.gather(worker.tick(), price_worker.tick(), news_worker.tick())
+
+        for stats in asyncio.run(run_once()):
+            print(stats)
+    else:
+        print(
+            f'Polling news every {ALERT_TICK_SECONDS} seconds, prices every {PRICE_ALERT_TICK_SECONDS} seconds '
+            f'and /news refreshes every {TICKER_NEWS_TICK_SECONDS} seconds...'
+        )
+
+        async def run_workers():
+            await asyncio.gather(
+                worker.run_forever(ALERT_TICK_SECONDS), price_worker.run_forever(PRICE_ALERT_TICK_SECONDS),
+                news_worker.run_forever(TICKER_NEWS_TICK_SECONDS)
+            )
+
+        asyncio.run(run_workers())
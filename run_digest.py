@@ -1,15 +1,119 @@
 """
 Main script to run the mailing.
 This needs to be added to "Scheduled Tasks" on PythonAnywhere.
+
+A run that stopped halfway (crash, timeout, deploy) is resumed by the next start within
+DIGEST_RESUME_WINDOW_SECONDS: users who already received the digest are skipped. A start that
+overlaps a run of the same shard still executing elsewhere exits without sending anything.
+
+Usage:
+    python run_digest.py               # serial mode
+    python run_digest.py --concurrent  # bounded-parallel mode (see DIGEST_*_CONCURRENCY)
+    python run_digest.py --metrics-file digest.prom  # also write the run metrics in Prometheus format
+    python run_digest.py --shard 2/4   # only the third of four shards of the users (e.g. one per machine)
+    python run_digest.py --processes 4 # all four shards in parallel worker processes
+    python run_digest.py --due         # only the users whose delivery time has come (run every 5-15 minutes)
+    python run_digest.py --backfill-sentiment  # parse the cached summaries into sentiment observations, then exit
 """
 
+import argparse
 import asyncio
+import os
+import subprocess
+import sys
+import metrics
+import sentiment
 from bot_logic import send_daily_digest
 from database import init_db
 
+
+def parse_shard(value):
+    """
+    Parses a shard given as INDEX/COUNT, with 0 <= INDEX < COUNT.
+    """
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected INDEX/COUNT, e.g. 0/4, got '{value}'")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 0 and {count - 1}, got {index}")
+    return index, count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Send the daily news digest.')
+    parser.add_argument(
+        '--concurrent', action='store_true',
+        help='Run the fetch, LLM and send stages concurrently with bounded parallelism.'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        help='Write the metrics of the run to this file in Prometheus text format '
+             '(e.g. for the node exporter textfile collector).'
+    )
+    parser.add_argument(
+        '--shard', type=parse_shard, default=(0, 1), metavar='INDEX/COUNT',
+        help='Only send to the users of this shard (by chat id hash), e.g. 0/4 ... 3/4.'
+    )
+    parser.add_argument(
+        '--processes', type=int, default=1,
+        help='Split the users into this many shards and run each in its own worker process.'
+    )
+    parser.add_argument(
+        '--due', action='store_true',
+        help="Only send to the users whose scheduled delivery time has come (see /schedule)."
+    )
+    parser.add_argument(
+        '--backfill-sentiment', action='store_true',
+        help='Parse the impact of the cached summaries of stored news into sentiment observations and exit.'
+    )
+    parser.add_argument(
+        '--no-resume', dest='resume', action='store_false',
+        help='Start a new run even if the previous run of the shard did not finish.'
+    )
+    args = parser.parse_args()
+    if args.processes > 1 and (args.shard != (0, 1) or args.metrics_file):
+        parser.error('--processes cannot be combined with --shard or --metrics-file')
+    return args
+
+
+def run_processes(args):
+    """
+    Runs every shard in a child process and waits for all of them.
+    :return: the highest exit code of the children
+    """
+    children = []
+    for index in range(args.processes):
+        command = [sys.executable, os.path.abspath(__file__), '--shard', f"{index}/{args.processes}"]
+        if args.concurrent:
+            command.append('--concurrent')
+        if args.due:
+            command.append('--due')
+        if not args.resume:
+            command.append('--no-resume')
+        children.append(subprocess.Popen(command))
+    return max(child.wait() for child in children)
+
+
 if __name__ == '__main__':
+    args = parse_args()
     print('Initializing DB...')
     init_db()
+    if args.backfill_sentiment:
+        print(f'Backfilled {sentiment.backfill()} sentiment observations')
+        sys.exit(0)
+    if args.processes > 1:
+        print(f'Starting digest mailing in {args.processes} processes...')
+        sys.exit(run_processes(args))
     print('Starting digest mailing...')
-    asyncio.run(send_daily_digest())
+    summary = asyncio.run(send_daily_digest(
+        concurrent=args.concurrent, shard=args.shard, resume=args.resume, due_only=args.due
+    ))
+    if summary is None:
+        print('The previous digest mailing of this shard is still running, nothing to do')
+        sys.exit(0)
+    if args.metrics_file:
+        metrics.export_run_summary('digest', summary)
+        with open(args.metrics_file, 'w') as f:
+            f.write(metrics.render())
     print('Digest mailing finished')
@@ -0,0 +1,202 @@
+"""
+Local importance scoring and categorization of news items, before any LLM call.
+
+Every fetched item gets a score from 1 to 10 and a category (M&A, Earnings, ...), computed on
+the CPU from the headlines of the whole batch at once:
+- the headlines are turned into a sparse TF-IDF matrix (unigrams and bigrams) with NumPy;
+- the category lexicons are term-weight vectors over the same vocabulary, so the lexicon
+  scores of all items are computed at once for every category;
+- the TF-IDF weights give the distinctiveness of a headline within the batch: boilerplate
+  that appears under many tickers scores lower than a specific story;
+- a headline naming its own ticker scores higher, generic roundups ("stocks to watch") lower.
+The digest ranks the items of every ticker by score and sends only the top k to the LLM.
+"""
+
+import re
+
+import numpy as np
+
+# Category lexicons: term -> weight. Terms are single words or bigrams.
+CATEGORY_LEXICONS = {
+    'M&A': {
+        'acquire': 4, 'acquires': 4, 'acquisition': 4, 'merger': 4, 'merge': 4, 'buyout': 4, 'takeover': 4,
+        'deal': 2, 'bid': 2, 'stake': 2, 'spin off': 3, 'spinoff': 3, 'divest': 3,
+    },
+    'Earnings': {
+        'earnings': 3, 'revenue': 2, 'profit': 2, 'eps': 3, 'quarter': 1, 'quarterly': 2, 'results': 2,
+        'beats': 3, 'misses': 3, 'profit warning': 4, 'loss': 2, 'sales': 1,
+    },
+    'Guidance': {
+        'guidance': 3, 'outlook': 2, 'forecast': 2, 'raises': 2, 'cuts': 2, 'lowers': 2, 'expects': 1,
+    },
+    'Analyst': {
+        'downgrade': 3, 'downgrades': 3, 'upgrade': 3, 'upgrades': 3, 'price target': 3, 'rating': 2,
+        'analyst': 1, 'overweight': 2, 'underweight': 2,
+    },
+    'Legal & Regulatory': {
+        'sec': 3, 'lawsuit': 3, 'sues': 3, 'investigation': 3, 'probe': 3, 'fine': 2, 'antitrust': 3,
+        'fda': 3, 'approval': 2, 'recall': 3, 'fraud': 5, 'settlement': 2, 'ban': 2,
+    },
+    'Management': {
+        'ceo': 2, 'cfo': 2, 'resigns': 3, 'steps down': 3, 'appoints': 2, 'names': 1, 'layoffs': 3,
+        'job cuts': 3, 'restructuring': 3,
+    },
+    'Capital': {
+        'dividend': 2, 'buyback': 2, 'repurchase': 2, 'offering': 2, 'split': 2, 'debt': 1,
+        'bankruptcy': 5, 'chapter 11': 5, 'delisted': 5, 'halted': 4,
+    },
+    'Product': {
+        'launch': 2, 'launches': 2, 'unveils': 2, 'product': 1, 'contract': 2, 'partnership': 2, 'order': 1,
+    },
+    'Market': {
+        'plunge': 2, 'plunges': 2, 'soar': 2, 'soars': 2, 'surge': 2, 'surges': 2, 'tumble': 2, 'tumbles': 2,
+        'rally': 1, 'record': 1,
+    },
+}
+
+# Category of items that match no lexicon term
+DEFAULT_CATEGORY = 'General'
+
+# Terms of generic, low-value headlines (single words or bigrams) and their penalty
+LOW_VALUE_TERMS = {
+    'to watch': 3, 'to buy': 2, 'top': 1, 'best': 1, 'should you': 2, 'why': 1,
+    'to know': 2, 'motley fool': 2, 'prediction': 1, 'millionaire': 2,
+}
+
+# Weights of the score components: lexicon score (capped), distinctiveness (0..1),
+# the headline naming its ticker and the low-value penalty
+LEXICON_WEIGHT = 1.0
+LEXICON_CAP = 6.0
+DISTINCTIVENESS_WEIGHT = 2.0
+MENTION_BONUS = 1.0
+PENALTY_WEIGHT = 1.0
+
+MIN_SCORE = 1
+MAX_SCORE = 10
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9&]+")
+
+
+def tokenize(text):
+    """
+    Returns the unigrams and bigrams of a text, lowercased.
+    """
+    words = TOKEN_PATTERN.findall((text or '').lower())
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def _term_weights(lexicon, vocabulary):
+    """
+    Returns the weights of a term lexicon as a vector over the vocabulary.
+    """
+    weights = np.zeros(len(vocabulary))
+    for term, weight in lexicon.items():
+        column = vocabulary.get(' '.join(TOKEN_PATTERN.findall(term)))
+        if column is not None:
+            weights[column] = weight
+    return weights
+
+
+def score_items(news_items, ticker=None):
+    """
+    Scores and categorizes a batch of news items. The TF-IDF statistics are taken over the batch,
+    so scoring all fetched items of a run together ranks them against each other.
+    The matrices are kept sparse, as arrays of (item, term) pairs, so memory grows with
+    the number of headline words rather than items times vocabulary.
+    :param news_items: list of dicts with 'title' (and optionally 'ticker')
+    :param ticker: ticker of items that have no 'ticker' key, for the mention bonus
+    :return: list of (score, category), parallel to news_items
+    """
+    if not news_items:
+        return []
+    documents = [tokenize(news_item['title']) for news_item in news_items]
+    vocabulary = {}
+    for tokens in documents:
+        for token in tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+    size = len(documents)
+
+    # Distinct (item, term) pairs and the count of the term in the item
+    rows = np.repeat(np.arange(size), [len(tokens) for tokens in documents])
+    columns = np.fromiter((vocabulary[token] for tokens in documents for token in tokens), dtype=np.int64,
+                          count=len(rows))
+    pairs, counts = np.unique(rows * max(len(vocabulary), 1) + columns, return_counts=True)
+    rows, columns = np.divmod(pairs, max(len(vocabulary), 1))
+
+    # TF-IDF with smoothed idf, normalized to unit length per item
+    document_frequency = np.bincount(columns, minlength=len(vocabulary))
+    idf = np.log((1 + size) / (1 + document_frequency)) + 1
+    tfidf = counts * idf[columns]
+    norms = np.sqrt(np.bincount(rows, weights=tfidf ** 2, minlength=size))
+    tfidf = tfidf / norms[rows]
+
+    # Lexicon scores of every item and category: sums of the weights of the terms present
+    categories = list(CATEGORY_LEXICONS)
+    lexicon_scores = np.stack([
+        np.bincount(rows, weights=_term_weights(lexicon, vocabulary)[columns], minlength=size)
+        for lexicon in CATEGORY_LEXICONS.values()
+    ], axis=1)
+    penalties = np.bincount(rows, weights=_term_weights(LOW_VALUE_TERMS, vocabulary)[columns], minlength=size)
+
+    # Distinctiveness: the strongest idf-weighted term of a headline, relative to the batch maximum
+    strongest = np.zeros(size)
+    np.maximum.at(strongest, rows, tfidf * idf[columns])
+    distinctiveness = strongest / strongest.max() if strongest.max() > 0 else strongest
+
+    mentions = np.array([
+        (news_item.get('ticker') or ticker or '').lower() in tokens
+        for news_item, tokens in zip(news_items, documents)
+    ])
+
+    best = lexicon_scores.max(axis=1)
+    raw = (
+        MIN_SCORE
+        + LEXICON_WEIGHT * np.minimum(best, LEXICON_CAP)
+        + DISTINCTIVENESS_WEIGHT * distinctiveness
+        + MENTION_BONUS * mentions
+        - PENALTY_WEIGHT * penalties
+    )
+    scores = np.clip(np.rint(raw), MIN_SCORE, MAX_SCORE).astype(int)
+    labels = [categories[index] if value > 0 else DEFAULT_CATEGORY
+              for index, value in zip(lexicon_scores.argmax(axis=1), best)]
+    return list(zip(scores.tolist(), labels))
+
+
+def rank_news(news_by_ticker):
+    """
+    Scores all fetched items of a run in one batch and sorts the items of every ticker by score.
+    Every item gets 'score' and 'category' keys; ties keep the newest first.
+    :param news_by_ticker: dict ticker -> list of news items, newest first
+    :return: dict ticker -> list of scored news items, best first
+    """
+    flat = [dict(news_item, ticker=ticker) for ticker, items in news_by_ticker.items() for news_item in items]
+    scored = iter(zip(flat, score_items(flat)))
+    ranked = {}
+    for ticker, items in news_by_ticker.items():
+        ticker_items = []
+        for _ in items:
+            news_item, (score, category) = next(scored)
+            news_item['score'] = score
+            news_item['category'] = category
+            ticker_items.append(news_item)
+        # sorted() is stable, so equal scores stay newest first
+        ranked[ticker] = sorted(ticker_items, key=lambda news_item: -news_item['score'])
+    return ranked
+
+
+def top_k(news_items, k, min_score=MIN_SCORE):
+    """
+    Returns the k best scored items, leaving out items below min_score.
+    :param news_items: scored items (see rank_news)
+    """
+    return sorted(
+        (news_item for news_item in news_items if news_item.get('score', MIN_SCORE) >= min_score),
+        key=lambda news_item: -news_item.get('score', MIN_SCORE)
+    )[:k]
+
+
+def format_score(news_item):
+    """
+    Renders the category and score of an item for a message, e.g. '_Earnings · 8/10_'.
+    """
+    return f"_{news_item.get('category', DEFAULT_CATEGORY)} · {news_item['score']}/{MAX_SCORE}_"
@@ -0,0 +1,189 @@
+"""
+Sentiment momentum of tickers, from the impact assessments of the LLM summaries.
+
+Every summary ends up in news_cache as one ESSENCE/IMPACT/FORECAST text. When the digest or the
+alert worker produces or reuses a summary, its IMPACT line is parsed into a typed row of
+sentiment_observations: (ticker, link, published_at, impact) with impact -1, 0 or +1.
+
+The signals of all tickers are computed in one batch with NumPy: the observations are loaded as
+flat arrays, binned into a (tickers x days) matrix of sums and counts, and the rolling means come
+from cumulative sums along the day axis, so there is no loop per ticker:
+- sentiment: mean impact over the last SENTIMENT_SHORT_DAYS days (-1 .. +1);
+- momentum: short-window sentiment minus the SENTIMENT_LONG_DAYS baseline;
+- reversal: the short-window sentiment changed sign against the window before it by at least
+  SENTIMENT_REVERSAL_THRESHOLD.
+"""
+
+import logging
+import re
+import time
+
+import numpy as np
+
+import database as db
+from config import SENTIMENT_SHORT_DAYS, SENTIMENT_LONG_DAYS, SENTIMENT_REVERSAL_THRESHOLD, SENTIMENT_RETENTION_DAYS
+from llm_processor import MODEL_NAME, PROMPT_VERSION, SUMMARY_LABELS, IMPACT_LABELS
+from summary_cache import make_cache_key
+
+DAY_SECONDS = 24 * 3600
+
+# Impact line of a summary in any language, e.g. 'IMPACT: Positive' or '**ВЛИЯНИЕ:** Негативное'.
+# The label must start a line and be followed by a colon, so the word in the essence does not match
+_IMPACT_PATTERN = re.compile(
+    r'^\W*(?:' + '|'.join(labels[1] for labels in SUMMARY_LABELS.values()) + r')\W*:\W*(\w+)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Numeric impact of every impact value, and of its label in every language (lowercase)
+IMPACT_NUMBERS = {'Positive': 1, 'Neutral': 0, 'Negative': -1}
+IMPACT_SCORES = {
+    label.lower(): IMPACT_NUMBERS[value] for labels in IMPACT_LABELS.values() for value, label in labels.items()
+}
+
+
+def parse_impact(summary):
+    """
+    Extracts the impact assessment of a summary.
+    :return: 1 (positive), 0 (neutral), -1 (negative) or None if the summary has no valid impact line
+    """
+    match = _IMPACT_PATTERN.search(summary or '')
+    if not match:
+        return None
+    return IMPACT_SCORES.get(match.group(1).lower())
+
+
+def record_summaries(ticker_items, results):
+    """
+    Stores the impact of the summarized items of a run as sentiment observations.
+    :param ticker_items: iterable of (ticker, news item)
+    :param results: dict link -> (summary, from_cache, degraded); degraded summaries have no impact
+    :return: number of observations offered (already known ones are ignored)
+    """
+    entries = {}
+    for ticker, news_item in ticker_items:
+        summary, _, degraded = results.get(news_item['link'], (None, False, False))
+        impact = None if degraded else parse_impact(summary)
+        if impact is not None and news_item.get('published'):
+            entries[(ticker, news_item['link'])] = (ticker, news_item['link'], news_item['published'], impact)
+    db.add_sentiment_observations(entries.values())
+    return len(entries)
+
+
+def backfill(now=None, batch_size=1000):
+    """
+    Parses the cached summaries of the stored news items into sentiment observations.
+    Only needed once for summaries produced before the observations were recorded.
+    :return: number of observations found
+    """
+    since = (now or time.time()) - SENTIMENT_RETENTION_DAYS * DAY_SECONDS
+    found = 0
+    for rows in db.iter_stored_news(since, batch_size):
+        keys = {}
+        for ticker, link, published_at in rows:
+            for language in SUMMARY_LABELS:
+                keys[make_cache_key(link, language, MODEL_NAME, PROMPT_VERSION)] = (ticker, link, published_at)
+        cached = db.get_summaries_from_cache(keys, SENTIMENT_RETENTION_DAYS * DAY_SECONDS)
+        entries = {}
+        for key, (summary, _) in cached.items():
+            ticker, link, published_at = keys[key]
+            impact = parse_impact(summary)
+            if impact is not None:
+                entries[(ticker, link)] = (ticker, link, published_at, impact)
+        db.add_sentiment_observations(entries.values())
+        found += len(entries)
+    logging.info(f"Sentiment backfill: {found} observations from cached summaries.")
+    return found
+
+
+def compute_signals(tickers, published, impacts, now=None, short_days=SENTIMENT_SHORT_DAYS,
+                    long_days=SENTIMENT_LONG_DAYS, reversal_threshold=SENTIMENT_REVERSAL_THRESHOLD):
+    """
+    Computes the sentiment signals of all tickers at once.
+    :param tickers: array of ticker symbols, one per observation
+    :param published: array of unix publish times
+    :param impacts: array of impacts (-1, 0, 1)
+    :return: dict ticker -> dict with 'sentiment', 'baseline', 'momentum', 'reversal', 'observations'
+        and 'daily' (the rolling short-window sentiment of every day of the long window, oldest first,
+        NaN where there was no news)
+    """
+    now = now or time.time()
+    days = max(long_days, 2 * short_days)
+    tickers = np.asarray(tickers)
+    age = np.floor((now - np.asarray(published, dtype=float)) / DAY_SECONDS).astype(np.int64)
+    recent = (age >= 0) & (age < days)
+    if not recent.any():
+        return {}
+    names, rows = np.unique(tickers[recent], return_inverse=True)
+    # Column days - 1 is today
+    cells = rows * days + (days - 1 - age[recent])
+    shape = (len(names), days)
+    weights = np.asarray(impacts, dtype=float)[recent]
+    sums = np.bincount(cells, weights=weights, minlength=shape[0] * days).reshape(shape)
+    counts = np.bincount(cells, minlength=shape[0] * days).reshape(shape)
+
+    # Cumulative sums with a leading zero column: the total of days (a, b] is cum[:, b] - cum[:, a]
+    cum_sums = np.concatenate([np.zeros((shape[0], 1)), sums.cumsum(axis=1)], axis=1)
+    cum_counts = np.concatenate([np.zeros((shape[0], 1), dtype=np.int64), counts.cumsum(axis=1)], axis=1)
+
+    def window_mean(end, width):
+        # Mean impact of the `width` days before column `end`, NaN without observations
+        start = np.maximum(end - width, 0)
+        total = cum_sums[:, end] - cum_sums[:, start]
+        count = cum_counts[:, end] - cum_counts[:, start]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / np.maximum(count, 1), np.nan), count
+
+    sentiment, _ = window_mean(days, short_days)
+    previous, _ = window_mean(days - short_days, short_days)
+    baseline, long_counts = window_mean(days, long_days)
+    daily, _ = window_mean(np.arange(days - long_days + 1, days + 1), short_days)
+    momentum = sentiment - baseline
+    reversal = (
+        ~np.isnan(sentiment) & ~np.isnan(previous)
+        & (np.sign(sentiment) * np.sign(previous) < 0)
+        & (np.abs(sentiment - previous) >= reversal_threshold)
+    )
+
+    return {
+        name: {
+            'sentiment': None if np.isnan(sentiment[i]) else round(float(sentiment[i]), 2),
+            'baseline': None if np.isnan(baseline[i]) else round(float(baseline[i]), 2),
+            'momentum': None if np.isnan(momentum[i]) else round(float(momentum[i]), 2),
+            'reversal': bool(reversal[i]),
+            'observations': int(long_counts[i]),
+            'daily': daily[i].round(2).tolist(),
+        }
+        for i, name in enumerate(names.tolist())
+    }
+
+
+def get_signals(tickers=None, now=None):
+    """
+    Loads the recent observations and computes the signals.
+    :param tickers: optional iterable of tickers to restrict the computation to
+    :return: dict ticker -> signals, see compute_signals(); tickers without recent news are missing
+    """
+    now = now or time.time()
+    since = now - max(SENTIMENT_LONG_DAYS, 2 * SENTIMENT_SHORT_DAYS) * DAY_SECONDS
+    symbols, published, impacts = db.get_sentiment_observations(since, tickers)
+    return compute_signals(symbols, published, impacts, now)
+
+
+def format_signal(ticker, signal):
+    """
+    Renders the signals of a ticker in one line, e.g. 'AAPL 🟢 +0.50 ↑'.
+    """
+    sentiment = signal['sentiment']
+    if sentiment is None:
+        return f"{ticker} ⚪ n/a"
+    marker = '🟢' if sentiment > 0 else '🔴' if sentiment < 0 else '⚪'
+    momentum = signal['momentum'] or 0
+    trend = '↑' if momentum > 0 else '↓' if momentum < 0 else '→'
+    return f"{ticker} {marker} {sentiment:+.2f} {trend}" + (' (reversal)' if signal['reversal'] else '')
+
+
+def prune(retention_days=SENTIMENT_RETENTION_DAYS):
+    """
+    Removes observations older than the retention period.
+    """
+    return db.prune_sentiment_observations(retention_days * DAY_SECONDS)
@@ -0,0 +1,95 @@
+"""
+Streaming scan of the subscriptions for the digest.
+
+The users are read in pages ordered by chat_id (keyset pagination, see database.iter_subscriptions)
+and handed out in chunks of DIGEST_CHUNK_SIZE users, so the digest starts on the first chunk and
+only one chunk of users is in memory at a time. A user is a Subscriber record with __slots__, and their tickers
+are small integer ids interned in a TickerSymbols table shared by the whole scan, so no ticker
+string is repeated per user. build_ticker_index() turns a chunk into the inverted
+ticker -> users index in one pass.
+"""
+
+from array import array
+
+import database as db
+from config import DIGEST_CHUNK_SIZE
+
+
+class TickerSymbols:
+    """
+    Interning table of the tickers of a scan: every symbol gets a small integer id.
+    """
+
+    __slots__ = ('ids', 'names')
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, symbol):
+        """
+        :return: the id of a symbol, assigning the next one on first sight
+        """
+        ticker_id = self.ids.get(symbol)
+        if ticker_id is None:
+            ticker_id = self.ids[symbol] = len(self.names)
+            self.names.append(symbol)
+        return ticker_id
+
+
+class Subscriber:
+    """
+    A user of the digest and the ids of their tickers (see TickerSymbols), in ticker order.
+    """
+
+    __slots__ = ('chat_id', 'language', 'timezone', 'delivery_time', 'frequency', 'top_k', 'ticker_ids')
+
+    def __init__(self, chat_id, language, timezone, delivery_time, frequency, top_k):
+        self.chat_id = chat_id
+        self.language = language
+        self.timezone = timezone
+        self.delivery_time = delivery_time
+        self.frequency = frequency
+        self.top_k = top_k
+        self.ticker_ids = array('I')
+
+
+def iter_subscribers(due_at=None, chunk_size=DIGEST_CHUNK_SIZE, symbols=None, shard=(0, 1), page_size=1000):
+    """
+    Streams the users with at least one subscription, ordered by chat_id.
+    :param due_at: if given, only the users whose next delivery is due at this unix time
+    :param symbols: the TickerSymbols to intern the tickers in (a new table by default)
+    :param shard: (index, count): only the users of shard `index` out of `count`
+    :param page_size: number of users read from the database at a time
+    :yield: lists of up to chunk_size Subscriber records
+    """
+    symbols = symbols if symbols is not None else TickerSymbols()
+    chunk = []
+    subscriber = None
+    for rows in db.iter_subscriptions(due_at, shard, page_size):
+        for chat_id, language, timezone, delivery_time, frequency, top_k, ticker in rows:
+            if subscriber is None or subscriber.chat_id != chat_id:
+                # The previous user is complete: a chunk is only cut between users
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+                subscriber = Subscriber(chat_id, language, timezone, delivery_time, frequency, top_k)
+                chunk.append(subscriber)
+            subscriber.ticker_ids.append(symbols.intern(ticker))
+    if chunk:
+        yield chunk
+
+
+def build_ticker_index(subscribers):
+    """
+    Builds the inverted index of a chunk in one pass over its subscriptions.
+    :return: dict ticker id -> array of the positions in `subscribers` of the users following it
+    """
+    index = {}
+    for position, subscriber in enumerate(subscribers):
+        for ticker_id in subscriber.ticker_ids:
+            positions = index.get(ticker_id)
+            if positions is None:
+                positions = index[ticker_id] = array('I')
+            positions.append(position)
+    return index
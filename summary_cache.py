@@ -0,0 +1,166 @@
+"""
+Two-tier cache for LLM summaries: an in-process LRU in front of the SQLite news_cache table.
+
+Entries are keyed by URL, language, model name and prompt version, so a summary is
+only reused for the same language and is invalidated when the model or prompt changes.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import database as db
+import metrics
+from config import (
+    SUMMARY_CACHE_LRU_SIZE, SUMMARY_CACHE_TTL_SECONDS, SUMMARY_CACHE_MAX_ROWS, SUMMARY_CACHE_EVICT_EVERY
+)
+
+
+def make_cache_key(url, language, model, prompt_version):
+    """
+    Builds the cache key of a summary.
+    """
+    raw = '\x1f'.join((url, language, model, prompt_version))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+SUMMARY_CACHE_EVENTS = metrics.counter(
+    'summary_cache_events_total', 'Summary cache lookups by outcome and evicted rows', ('event',)
+)
+
+
+class SummaryCache:
+    """
+    LRU + SQLite cache with TTL expiry, a bounded number of rows and hit/miss/eviction counters.
+    """
+
+    def __init__(self, lru_size=SUMMARY_CACHE_LRU_SIZE, ttl_seconds=SUMMARY_CACHE_TTL_SECONDS,
+                 max_rows=SUMMARY_CACHE_MAX_ROWS, evict_every=SUMMARY_CACHE_EVICT_EVERY):
+        self.lru_size = lru_size
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self.evict_every = evict_every
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _count(self, name, amount=1):
+        self.stats[name] += amount
+        SUMMARY_CACHE_EVENTS.inc(amount, event=name)
+
+    def _remember(self, key, summary, stored_at):
+        with self._lock:
+            self._lru[key] = (summary, stored_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, url, language, model, prompt_version):
+        """
+        Looks a summary up in memory first, then in SQLite.
+        :return: the summary if a fresh entry is found, otherwise None.
+        """
+        key = make_cache_key(url, language, model, prompt_version)
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry and time.time() - entry[1] < self.ttl_seconds:
+                self._lru.move_to_end(key)
+                self._count('memory_hits')
+                return entry[0]
+            if entry:
+                del self._lru[key]
+
+        stored = db.get_summary_from_cache(key, self.ttl_seconds)
+        if stored:
+            self._count('db_hits')
+            self._remember(key, *stored)
+            return stored[0]
+
+        self._count('misses')
+        return None
+
+    def get_many(self, urls, language, model, prompt_version):
+        """
+        Bulk version of get(): the keys missing from memory are looked up in one query.
+        :return: dict url -> summary for every fresh entry found
+        """
+        found = {}
+        missing = {}
+        now = time.time()
+        with self._lock:
+            for url in urls:
+                key = make_cache_key(url, language, model, prompt_version)
+                entry = self._lru.get(key)
+                if entry and now - entry[1] < self.ttl_seconds:
+                    self._lru.move_to_end(key)
+                    self._count('memory_hits')
+                    found[url] = entry[0]
+                else:
+                    missing[key] = url
+
+        stored = db.get_summaries_from_cache(missing, self.ttl_seconds) if missing else {}
+        for key, url in missing.items():
+            if key in stored:
+                self._count('db_hits')
+                self._remember(key, *stored[key])
+                found[url] = stored[key][0]
+            else:
+                self._count('misses')
+        return found
+
+    def put(self, url, language, model, prompt_version, summary):
+        """
+        Stores a summary in both tiers and runs an eviction pass every evict_every writes.
+        """
+        key = make_cache_key(url, language, model, prompt_version)
+        db.add_summary_to_cache(key, summary, language, model, prompt_version)
+        self._remember(key, summary, time.time())
+
+        self._count_writes(1)
+
+    def put_many(self, summaries, language, model, prompt_version):
+        """
+        Bulk version of put().
+        :param summaries: dict url -> summary
+        """
+        now = time.time()
+        entries = []
+        for url, summary in summaries.items():
+            key = make_cache_key(url, language, model, prompt_version)
+            entries.append((key, summary, language, model, prompt_version))
+            self._remember(key, summary, now)
+        if entries:
+            db.add_summaries_to_cache(entries)
+            self._count_writes(len(entries))
+
+    def _count_writes(self, count):
+        self._writes_since_eviction += count
+        if self._writes_since_eviction >= self.evict_every:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes expired and surplus rows from SQLite.
+        :return: the number of evicted rows
+        """
+        self._writes_since_eviction = 0
+        try:
+            evicted = db.evict_summary_cache(self.ttl_seconds, self.max_rows)
+        except Exception as e:
+            logging.error(f"Error evicting the summary cache: {e}")
+            return 0
+        self._count('evictions', evicted)
+        return evicted
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters, e.g. for the digest statistics.
+        """
+        return dict(self.stats)
+
+
+# Shared cache instance used by the LLM processor
+summary_cache = SummaryCache()
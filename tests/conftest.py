@@ -0,0 +1,23 @@
+"""
+Makes the top-level modules of the bot importable from the tests, and provides a fresh database.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Points the database module at an empty, migrated database of the test.
+    """
+    monkeypatch.setattr(db, 'DATABASE_NAME', str(tmp_path / 'bot_database.db'))
+    db.init_db()
+    yield db
+    db.close_db_connection()
@@ -0,0 +1,102 @@
+"""
+Tests of the news alert worker: stories are marked as seen only once every subscriber got them.
+"""
+
+import asyncio
+import time
+
+from telegram.error import Forbidden
+
+import alerts
+from alerts import AlertWorker
+from bot_logic import select_user_news
+from subscriptions import TickerSymbols, iter_subscribers
+
+STORY = {'link': 'https://example.com/a', 'links': {'https://example.com/a', 'https://mirror.example.com/a'},
+         'title': 'A', 'published': 100, 'ticker': 'AAPL'}
+
+
+class FakeBot:
+    """
+    Records the sent messages; sending to a chat in `failing` raises the error given for it.
+    """
+
+    def __init__(self, failing=None):
+        self.failing = dict(failing or {})
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id in self.failing:
+            raise self.failing[chat_id]
+        self.sent.append(chat_id)
+
+
+def push(bot, pending):
+    stats = {'users_alerted': 0, 'users_blocked': 0, 'errors': 0}
+    asyncio.run(AlertWorker(bot).push(pending, stats, now=1000.0))
+    return stats
+
+
+def subscribe(database, *chat_ids):
+    database.add_or_update_users((chat_id, 'en') for chat_id in chat_ids)
+    database.add_subscriptions((chat_id, 'AAPL') for chat_id in chat_ids)
+
+
+def summarize(monkeypatch, error=None):
+    async def get_batch_summaries_async(news_items, language):
+        if error:
+            raise error
+        return {news_item['link']: ('summary', False, False) for news_item in news_items}, 1
+    monkeypatch.setattr(alerts, 'get_batch_summaries_async', get_batch_summaries_async)
+
+
+def test_story_stays_new_until_every_subscriber_got_it(database, monkeypatch):
+    subscribe(database, 1, 2)
+    summarize(monkeypatch)
+    bot = FakeBot({2: RuntimeError('Bad Gateway')})
+    stats = push(bot, {'AAPL': [STORY]})
+    assert bot.sent == [1] and stats['errors'] == 1
+    assert database.get_seen_alert_links('AAPL', [STORY['link']]) == set()
+    assert database.get_alert_deliveries([1, 2]) == {1: STORY['links']}
+
+    # The next push only reaches the subscriber who missed it
+    bot = FakeBot()
+    push(bot, {'AAPL': [STORY]})
+    assert bot.sent == [2]
+    assert database.get_seen_alert_links('AAPL', [STORY['link']]) == {STORY['link']}
+
+
+def test_failed_summary_holds_the_alert_back(database, monkeypatch):
+    subscribe(database, 1)
+    summarize(monkeypatch, RuntimeError('LLM is down'))
+    bot = FakeBot()
+    stats = push(bot, {'AAPL': [STORY]})
+    assert bot.sent == [] and stats['errors'] == 1
+    assert database.get_seen_alert_links('AAPL', [STORY['link']]) == set()
+
+
+def test_user_who_blocked_the_bot_is_skipped(database, monkeypatch):
+    subscribe(database, 1, 2)
+    summarize(monkeypatch)
+    stats = push(FakeBot({2: Forbidden('bot was blocked by the user')}), {'AAPL': [STORY]})
+    assert stats['users_blocked'] == 1
+    assert database.get_seen_alert_links('AAPL', [STORY['link']]) == {STORY['link']}
+    assert database.get_ticker_subscribers(['AAPL']) == {'AAPL': [(1, 'en')]}
+
+
+def test_pushed_stories_are_left_out_of_the_digest(database, monkeypatch):
+    subscribe(database, 1, 2)
+    summarize(monkeypatch)
+    push(FakeBot({2: RuntimeError('Bad Gateway')}), {'AAPL': [STORY]})
+
+    symbols = TickerSymbols()
+    [users] = iter_subscribers(symbols=symbols)
+    index = {symbols.ids['AAPL']: [0, 1]}
+    news = {'AAPL': [
+        {'link': 'https://mirror.example.com/a', 'title': 'A', 'published': time.time(), 'score': 5.0},
+        {'link': 'https://example.com/b', 'title': 'B', 'published': time.time(), 'score': 4.0},
+    ]}
+    selections = select_user_news(users, index, symbols, news, {}, pushed=database.get_alert_deliveries([1, 2]))
+    links = {chat_id: [news_item['link'] for _, items in ticker_items for news_item in items]
+             for chat_id, _, ticker_items in selections}
+    assert links == {1: ['https://example.com/b'], 2: ['https://mirror.example.com/a', 'https://example.com/b']}
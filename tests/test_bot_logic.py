@@ -0,0 +1,133 @@
+"""
+Tests of the digest messages built for one user.
+"""
+
+import time
+
+import pytest
+
+from bot_logic import build_user_message, delivery_callbacks, select_user_news
+from config import DIGEST_RETRY_DELAY_SECONDS
+from delivery import FAILURE_PERMANENT, FAILURE_TIMED_OUT, FAILURE_TRANSIENT
+from subscriptions import TickerSymbols, iter_subscribers
+
+NEWS_ITEMS = [
+    {'link': 'https://example.com/a', 'title': 'A', 'published': 100},
+    {'link': 'https://example.com/b', 'title': 'B', 'published': 200},
+    {'link': 'https://example.com/c', 'title': 'C', 'published': 300},
+]
+
+
+def test_watermark_is_the_newest_delivered_item():
+    results = {news_item['link']: ('summary', False, False) for news_item in NEWS_ITEMS}
+    messages, news_count = build_user_message('en', [('AAPL', NEWS_ITEMS)], results)
+    assert news_count == 3
+    assert len(messages) == 1
+    text, watermarks, retries = messages[0]
+    assert watermarks == {'AAPL': 300} and retries == []
+    assert text.startswith('News digest for you (en)') and 'summary' in text
+
+
+def test_degraded_summaries_are_retried_without_holding_the_watermark():
+    results = {news_item['link']: ('summary', False, False) for news_item in NEWS_ITEMS}
+    results['https://example.com/b'] = ('headline only', False, True)
+    [(_, watermarks, retries)], news_count = build_user_message('en', [('AAPL', NEWS_ITEMS)], results)
+    assert news_count == 3
+    assert watermarks == {'AAPL': 300}
+    assert retries == [('AAPL', 'https://example.com/b', True)]
+
+
+def test_retried_item_with_a_real_summary_is_cleared():
+    ticker_items = [('AAPL', [dict(NEWS_ITEMS[0], retry=True)])]
+    results = {NEWS_ITEMS[0]['link']: ('summary', False, False)}
+    [(_, watermarks, retries)], _ = build_user_message('en', ticker_items, results)
+    assert retries == [('AAPL', 'https://example.com/a', False)]
+
+
+def test_long_digest_carries_the_watermarks_of_each_message():
+    results = {news_item['link']: ('x' * 300, False, False) for news_item in NEWS_ITEMS}
+    ticker_items = [(ticker, NEWS_ITEMS) for ticker in ('AAPL', 'MSFT', 'TSLA')]
+    messages, news_count = build_user_message('en', ticker_items, results, max_length=1200)
+    assert news_count == 9
+    assert [watermarks for _, watermarks, _ in messages] == [{'AAPL': 300}, {'MSFT': 300}, {'TSLA': 300}]
+    assert all(len(text) <= 1200 for text, _, _ in messages)
+    assert '*AAPL*' in messages[0][0] and '*TSLA*' in messages[2][0]
+
+
+def test_nothing_to_send():
+    assert build_user_message('en', [('AAPL', NEWS_ITEMS)], {}) == ([], 0)
+
+
+@pytest.fixture
+def run(database):
+    database.add_or_update_users([(1, 'en')])
+    database.add_ticker_for_user(1, 'AAPL')
+    run_id, _ = database.start_digest_run(0, 1, 3600)
+    return run_id
+
+
+def send(run_id, outcomes, next_due):
+    """
+    Runs the callbacks of a digest of one message per outcome (None for delivered) to user 1.
+    """
+    stats = {'users_blocked': 0, 'users_retried': 0}
+    callbacks = delivery_callbacks(run_id, len(outcomes), next_due, stats)
+    for number, outcome in enumerate(outcomes):
+        delivered, failed = callbacks({f"T{number}": 100 + number})
+        if outcome is None:
+            delivered(1)
+        else:
+            failed(1, outcome)
+    return stats
+
+
+def test_delivered_digest_is_recorded(database, run):
+    next_due = time.time() + 86400
+    send(run, [None, FAILURE_TIMED_OUT], next_due)
+    assert database.get_digest_deliveries(run) == {1}
+    assert database.get_delivery_watermarks([1]) == {(1, 'T0'): 100, (1, 'T1'): 101}
+    assert database.get_user_schedule(1)['next_due_at'] == next_due
+
+
+def test_transient_failure_is_retried_before_the_next_delivery(database, run):
+    next_due = time.time() + 86400
+    stats = send(run, [None, FAILURE_TRANSIENT], next_due)
+    assert stats['users_retried'] == 1
+    assert database.get_digest_deliveries(run) == set()
+    # The delivered message keeps its watermark, so only the failed one is sent again
+    assert database.get_delivery_watermarks([1]) == {(1, 'T0'): 100}
+    assert database.get_user_schedule(1)['next_due_at'] <= time.time() + DIGEST_RETRY_DELAY_SECONDS
+
+
+def test_blocked_user_is_skipped_until_they_return(database, run):
+    stats = send(run, [FAILURE_PERMANENT, FAILURE_TRANSIENT], time.time() + 86400)
+    assert stats['users_blocked'] == 1
+    assert list(database.iter_subscriptions()) == []
+    database.ensure_user(1)
+    assert [row[0] for page in database.iter_subscriptions() for row in page] == [1]
+
+
+def test_degraded_item_is_selected_again_until_summarized(database, run):
+    symbols = TickerSymbols()
+    [users] = iter_subscribers(symbols=symbols)
+    index = {symbols.ids['AAPL']: [0]}
+    news = {'AAPL': list(reversed(NEWS_ITEMS))}
+
+    # The digest delivered with 'b' degraded
+    results = {news_item['link']: ('summary', False, False) for news_item in NEWS_ITEMS}
+    results['https://example.com/b'] = ('headline only', False, True)
+    [(_, _, [(_, items)])] = select_user_news(users, index, symbols, news, {})
+    [(_, watermarks, retries)], _ = build_user_message('en', [('AAPL', items)], results)
+    delivered, _ = delivery_callbacks(run, 1, time.time() + 86400, {})(watermarks, retries)
+    delivered(1)
+
+    # Only 'b' is selected again, and its real summary clears it
+    selections = select_user_news(
+        users, index, symbols, news, database.get_delivery_watermarks([1]),
+        retries=database.get_summary_retries([1])
+    )
+    [(_, _, [(_, items)])] = selections
+    assert [(news_item['link'], news_item.get('retry')) for news_item in items] == [('https://example.com/b', True)]
+    [(_, watermarks, retries)], _ = build_user_message('en', [('AAPL', items)], {items[0]['link']: ('real', False, False)})
+    delivery_callbacks(run, 1, time.time() + 86400, {})(watermarks, retries)[0](1)
+    assert database.get_summary_retries([1]) == {}
@@ -0,0 +1,49 @@
+"""
+Tests of the near-duplicate story detection across sources and tickers.
+"""
+
+from dedup import StoryDeduplicator, normalize_text, simhash, hamming_distance
+
+
+def item(link, title):
+    return {'link': link, 'title': title}
+
+
+HEADLINE = 'Fed signals it will keep rates on hold as inflation cools'
+WIRE = item('https://www.reuters.com/markets/fed-holds-rates', HEADLINE)
+COPIES = [
+    item('https://finance.yahoo.com/news/fed-holds-rates-1', f"{HEADLINE} - Reuters"),
+    item('https://news.example.com/fed?id=9', f"{HEADLINE.title()} | MarketWatch"),
+]
+OTHER = item('https://news.example.com/apple-buyback', 'Apple announces a record $110 billion share buyback')
+
+
+def test_outlet_suffix_and_case_do_not_change_the_fingerprint():
+    assert normalize_text(COPIES[0]['title']) == normalize_text(WIRE['title'])
+    assert hamming_distance(simhash(normalize_text(COPIES[1]['title'])), simhash(normalize_text(WIRE['title']))) == 0
+    assert hamming_distance(simhash(normalize_text(OTHER['title'])), simhash(normalize_text(WIRE['title']))) > 3
+
+
+def test_copies_from_other_sources_map_to_the_first_story(database):
+    canonical = StoryDeduplicator().canonicalize([WIRE] + COPIES + [OTHER])
+    assert canonical == {
+        WIRE['link']: WIRE['link'], COPIES[0]['link']: WIRE['link'], COPIES[1]['link']: WIRE['link'],
+        OTHER['link']: OTHER['link'],
+    }
+
+
+def test_known_stories_are_found_in_later_batches(database):
+    StoryDeduplicator().canonicalize([WIRE])
+    # A fresh deduplicator, as in the next run: the story comes from the persistent index
+    deduplicator = StoryDeduplicator()
+    assert deduplicator.canonicalize([COPIES[0], OTHER]) == {
+        COPIES[0]['link']: WIRE['link'], OTHER['link']: OTHER['link']
+    }
+    assert deduplicator.canonicalize([WIRE]) == {WIRE['link']: WIRE['link']}
+
+
+def test_slightly_edited_headline_is_a_near_duplicate(database):
+    edited = item('https://news.example.com/fed-2', 'Fed signals it will keep rates on hold as inflation cools further')
+    canonical = StoryDeduplicator(max_distance=12).canonicalize([WIRE, edited])
+    assert canonical[edited['link']] == WIRE['link']
+    assert StoryDeduplicator(max_distance=0).canonicalize([edited])[edited['link']] == edited['link']
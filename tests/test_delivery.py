@@ -0,0 +1,77 @@
+"""
+Tests of the rate-limited delivery of messages.
+"""
+
+import asyncio
+
+from telegram.error import BadRequest, Forbidden, NetworkError, TimedOut
+
+from delivery import (
+    DeliveryScheduler, pack_blocks, split_message, failure_kind, FAILURE_PERMANENT, FAILURE_TIMED_OUT,
+    FAILURE_TRANSIENT
+)
+
+
+class FlakyBot:
+    """
+    Fails the first sends of every chat with the given error.
+    """
+
+    def __init__(self, error, failures=1):
+        self.error = error
+        self.failures = failures
+        self.calls = {}
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.calls[chat_id] = self.calls.get(chat_id, 0) + 1
+        if self.calls[chat_id] <= self.failures:
+            raise self.error
+
+
+def deliver(bot, messages):
+    async def run():
+        scheduler = DeliveryScheduler(bot, rate=1000, per_chat_interval=0)
+        scheduler.start()
+        delivered = []
+        failed = []
+        for chat_id, text in messages:
+            scheduler.submit(
+                chat_id, text, on_delivered=delivered.append, on_failed=lambda *failure: failed.append(failure)
+            )
+        await scheduler.close()
+        return scheduler.stats, delivered, failed
+    return asyncio.run(run())
+
+
+def test_timed_out_send_is_not_retried():
+    bot = FlakyBot(TimedOut())
+    stats, delivered, failed = deliver(bot, [(1, 'hello')])
+    assert bot.calls == {1: 1}
+    assert stats['failed'] == 1 and delivered == []
+    assert failed == [(1, FAILURE_TIMED_OUT)]
+
+
+def test_failed_send_reports_its_kind():
+    bot = FlakyBot(Forbidden('Forbidden: bot was blocked by the user'))
+    stats, delivered, failed = deliver(bot, [(1, 'hello'), (2, 'hello')])
+    assert delivered == [] and failed == [(1, FAILURE_PERMANENT), (2, FAILURE_PERMANENT)]
+
+
+def test_failure_kind():
+    assert failure_kind(Forbidden('Forbidden: bot was blocked by the user')) == FAILURE_PERMANENT
+    assert failure_kind(BadRequest('Chat not found')) == FAILURE_PERMANENT
+    assert failure_kind(BadRequest("Can't parse entities")) == FAILURE_TRANSIENT
+    assert failure_kind(NetworkError('connection reset')) == FAILURE_TRANSIENT
+    assert failure_kind(TimedOut()) == FAILURE_TIMED_OUT
+
+
+def test_pack_blocks():
+    blocks = [('header', 'h'), ('\n--- 📈 *A* ---\n' + 'a' * 40, 'A'), ('\n--- 📈 *B* ---\n' + 'b' * 40, 'B')]
+    assert pack_blocks(blocks, limit=200) == [('\n'.join(text for text, _ in blocks), ['h', 'A', 'B'])]
+    messages = pack_blocks(blocks, limit=70)
+    assert [payloads for _, payloads in messages] == [['h', 'A'], ['B']]
+    assert messages[1][0].startswith('--- 📈 *B* ---')
+
+
+def test_split_message_keeps_short_messages():
+    assert split_message('short') == ['short']
@@ -0,0 +1,46 @@
+"""
+Tests of the per-user delivery schedule and of /schedule.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from delivery_schedule import next_due_at, spread_offset
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_next_due_at():
+    now = utc(2024, 1, 10, 7, 0)  # a Wednesday
+    assert next_due_at(now, 'UTC', '08:00', 'daily') == utc(2024, 1, 10, 8, 0)
+    assert next_due_at(utc(2024, 1, 10, 9, 0), 'UTC', '08:00', 'daily') == utc(2024, 1, 11, 8, 0)
+    assert next_due_at(utc(2024, 1, 10, 9, 0), 'UTC', '08:00', 'twice_daily') == utc(2024, 1, 10, 20, 0)
+    assert next_due_at(utc(2024, 1, 12, 9, 0), 'UTC', '08:00', 'weekdays') == utc(2024, 1, 15, 8, 0)
+    assert next_due_at(now, 'Europe/Berlin', '08:00', 'daily') == utc(2024, 1, 10, 7, 0) + 24 * 3600
+
+
+def test_spread_slot_of_yesterday_after_midnight_is_not_skipped():
+    chat_id = next(chat_id for chat_id in range(1000) if spread_offset(chat_id) >= 20 * 60)
+    due = utc(2024, 1, 9, 23, 50) + spread_offset(chat_id)
+    now = due - 60
+    assert now > utc(2024, 1, 10)
+    assert next_due_at(now, 'UTC', '23:50', 'daily', chat_id) == due
+
+
+@pytest.mark.parametrize('args', [['8'], ['Moscow'], ['08:00', 'Mars/Base']])
+def test_schedule_command_rejects_invalid_arguments(database, args):
+    replies = []
+
+    async def reply_text(text):
+        replies.append(text)
+
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=1), message=SimpleNamespace(reply_text=reply_text))
+    asyncio.run(app.schedule_command(update, SimpleNamespace(args=args)))
+    assert len(replies) == 1 and 'Usage: /schedule' in replies[0]
+    assert database.get_user_schedule(1)['timezone'] == 'UTC'
@@ -0,0 +1,93 @@
+"""
+Tests of the digest run checkpoints: leases, and resuming a run that was killed mid-way.
+"""
+
+import asyncio
+
+import pytest
+
+import bot_logic
+import data_source
+import llm_processor
+import news_store
+from benchmarks.fakes import FakeBot, FakeGeminiModel, FakeTickerFactory
+from llm_processor import LLMGovernor
+from news_sources import NewsAggregator, build_sources
+from summary_cache import SummaryCache
+
+USERS = 6
+
+
+def test_live_run_of_another_process_is_not_resumed(database):
+    run_id, resumed = database.start_digest_run(0, 1, 3600, lease_seconds=60, owner='host:1')
+    assert not resumed
+    assert database.start_digest_run(0, 1, 3600, lease_seconds=60, owner='host:2') == (None, False)
+    assert database.start_digest_run(0, 1, 3600, resume=False, lease_seconds=60, owner='host:2') == (None, False)
+    # The owner itself may pick its run up again
+    assert database.start_digest_run(0, 1, 3600, lease_seconds=60, owner='host:1') == (run_id, True)
+
+
+def test_run_with_a_stale_heartbeat_is_taken_over(database):
+    run_id, _ = database.start_digest_run(0, 1, 3600, lease_seconds=60, owner='host:1')
+    with database.get_db_connection() as conn:
+        conn.execute('UPDATE digest_runs SET heartbeat_at = heartbeat_at - 120')
+    assert database.start_digest_run(0, 1, 3600, lease_seconds=60, owner='host:2') == (run_id, True)
+    assert not database.heartbeat_digest_run(run_id, 'host:1')
+    assert database.heartbeat_digest_run(run_id, 'host:2')
+
+
+class KillingBot(FakeBot):
+    """
+    Fake bot whose digest task is cancelled, as if the process died, when it is asked
+    to send message number `kill_at`.
+    """
+
+    def __init__(self, kill_at=None):
+        super().__init__(latency=0, server_rate=0)
+        self.kill_at = kill_at
+        self.task = None
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        if self.kill_at is not None and self.calls + 1 >= self.kill_at:
+            self.task.cancel()
+            await asyncio.sleep(1)
+        await super().send_message(chat_id, text, parse_mode, **kwargs)
+
+
+@pytest.fixture
+def digest(database, monkeypatch):
+    data_source.set_ticker_factory(FakeTickerFactory(latency=0, items_per_ticker=2))
+    monkeypatch.setattr(news_store, 'news_aggregator', NewsAggregator(build_sources(['yfinance'])))
+    monkeypatch.setattr(llm_processor, 'governor', LLMGovernor(requests_per_minute=1000, requests_per_day=1000))
+    monkeypatch.setattr(llm_processor, 'summary_cache', SummaryCache())
+    monkeypatch.setattr(llm_processor, 'get_article_contexts', lambda news_items: {})
+    llm_processor.set_model(FakeGeminiModel(latency=0))
+    database.add_or_update_users((chat_id, 'en') for chat_id in range(1, USERS + 1))
+    database.add_subscriptions((chat_id, 'AAPL') for chat_id in range(1, USERS + 1))
+
+    async def run(bot):
+        bot.task = asyncio.ensure_future(bot_logic.send_daily_digest(bot=bot))
+        return await bot.task
+
+    yield lambda bot: asyncio.run(run(bot))
+    llm_processor.set_model(None)
+    data_source.set_ticker_factory(None)
+
+
+def test_killed_run_is_resumed_without_repeating_deliveries(database, digest):
+    killed = KillingBot(kill_at=3)
+    with pytest.raises(asyncio.CancelledError):
+        digest(killed)
+    first = {chat_id for chat_id, _, _ in killed.sent}
+    assert len(first) == 2
+    [run] = database.get_db_connection().execute("SELECT id, status FROM digest_runs").fetchall()
+    assert run['status'] == 'running'
+    assert database.get_digest_deliveries(run['id']) == first
+
+    resumed = KillingBot()
+    summary = digest(resumed)
+    second = {chat_id for chat_id, _, _ in resumed.sent}
+    assert second == set(range(1, USERS + 1)) - first
+    assert summary['stats']['users_already_delivered'] == len(first)
+    runs = database.get_db_connection().execute("SELECT id, status FROM digest_runs").fetchall()
+    assert [tuple(row) for row in runs] == [(run['id'], 'finished')]
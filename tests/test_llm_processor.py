@@ -0,0 +1,173 @@
+"""
+Tests of the LLM governor, the shared quota and the batched summaries.
+"""
+
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_processor
+from llm_processor import LLMGovernor, QuotaExhausted, LANE_BATCH, LANE_INTERACTIVE
+from summary_cache import SummaryCache
+
+DAY = '2026-10-17'
+
+
+def bucket_tokens(database, name):
+    row = database.get_db_connection().execute('SELECT tokens FROM llm_quota_buckets WHERE name = ?', (name,))
+    return row.fetchone()['tokens']
+
+
+def test_bucket_refills_over_time(database):
+    # 2 requests of capacity, refilled at 1 per second
+    buckets = {'requests': (1, 1.0, 2, 0)}
+    assert database.take_llm_quota(buckets, DAY, 100, now=1000.0) == 0.0
+    assert database.take_llm_quota(buckets, DAY, 100, now=1000.0) == 0.0
+    assert database.take_llm_quota(buckets, DAY, 100, now=1000.0) == pytest.approx(1.0)
+    assert database.take_llm_quota(buckets, DAY, 100, now=1000.5) == pytest.approx(0.5)
+    assert database.take_llm_quota(buckets, DAY, 100, now=1001.0) == 0.0
+    assert database.get_llm_quota_usage(DAY)['requests'] == 3
+
+
+def test_daily_limit(database):
+    buckets = {'requests': (1, 1.0, 10, 0)}
+    assert database.take_llm_quota(buckets, DAY, 1, now=1000.0) == 0.0
+    assert database.take_llm_quota(buckets, DAY, 1, now=1000.0) is None
+
+
+def test_batch_lane_leaves_the_reserve_to_interactive_requests(database):
+    governor = LLMGovernor(requests_per_minute=10, tokens_per_minute=10 ** 6, requests_per_day=100,
+                           interactive_reserve=0.2)
+    granted = 0
+    while governor._try_acquire(LANE_BATCH, 100) == 0.0:
+        granted += 1
+    assert granted == 8
+    assert governor._try_acquire(LANE_INTERACTIVE, 100) == 0.0
+    assert governor._try_acquire(LANE_INTERACTIVE, 100) == 0.0
+    assert governor._try_acquire(LANE_INTERACTIVE, 100) > 0
+
+
+def test_batch_lane_waits_for_queued_interactive_requests(database):
+    governor = LLMGovernor(requests_per_minute=10, tokens_per_minute=10 ** 6, requests_per_day=100)
+    governor._waiting(LANE_INTERACTIVE, 1)
+    assert governor._try_acquire(LANE_BATCH, 100) > 0
+    assert governor._try_acquire(LANE_INTERACTIVE, 100) == 0.0
+
+
+def test_breaker_opens_and_half_opens(database):
+    governor = LLMGovernor(breaker_failures=2, breaker_cooldown_seconds=0.05)
+    governor.record_failure(RuntimeError('boom'))
+    assert not governor.is_open()
+    governor.record_failure(RuntimeError('boom'))
+    assert governor.is_open()
+    with pytest.raises(QuotaExhausted):
+        governor._try_acquire(LANE_INTERACTIVE, 100)
+
+    time.sleep(0.06)
+    # Half-open: a request is let through, and one more failure opens the circuit again
+    assert governor._try_acquire(LANE_INTERACTIVE, 100) == 0.0
+    governor.record_failure(RuntimeError('boom'))
+    assert governor.is_open()
+
+    time.sleep(0.06)
+    governor.settle(100, 50, 50)
+    governor.record_failure(RuntimeError('boom'))
+    assert not governor.is_open()
+
+
+def test_quota_error_opens_the_breaker_at_once(database):
+    governor = LLMGovernor(breaker_failures=5, breaker_cooldown_seconds=60)
+    governor.record_failure(RuntimeError('429 Resource has been exhausted'))
+    assert governor.is_open()
+
+
+def test_settle_refunds_the_unused_estimate(database):
+    governor = LLMGovernor(requests_per_minute=10, tokens_per_minute=10000, requests_per_day=100)
+    assert governor._try_acquire(LANE_INTERACTIVE, 3000) == 0.0
+    assert bucket_tokens(database, 'tokens') == pytest.approx(7000, abs=1)
+    governor.settle(3000, 800, 200)
+    assert bucket_tokens(database, 'tokens') == pytest.approx(9000, abs=1)
+    # Without usage metadata the estimate stands
+    governor.settle(3000, 0, 0)
+    assert bucket_tokens(database, 'tokens') == pytest.approx(9000, abs=1)
+    assert database.get_llm_quota_usage(governor._today())['prompt_tokens'] == 800
+
+
+class ScriptedModel:
+    """
+    Answers batched requests from a list of outcomes: an exception is raised, a list of item ids
+    is answered with a summary for each of them. Single requests always succeed.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = {'batch': 0, 'single': 0}
+
+    def generate_content(self, prompt, generation_config=None):
+        usage = SimpleNamespace(prompt_token_count=10, candidates_token_count=10)
+        if not generation_config:
+            self.calls['single'] += 1
+            return SimpleNamespace(text='ESSENCE: single\nIMPACT: Neutral\nFORECAST: flat', usage_metadata=usage)
+        self.calls['batch'] += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        items = [{'id': i, 'essence': 'batch', 'impact': 'Positive', 'forecast': 'up'} for i in outcome]
+        return SimpleNamespace(text=json.dumps(items), usage_metadata=usage)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        return self.generate_content(prompt, generation_config)
+
+
+@pytest.fixture
+def summarize(database, monkeypatch):
+    monkeypatch.setattr(llm_processor, 'governor', LLMGovernor(requests_per_minute=1000, requests_per_day=1000))
+    monkeypatch.setattr(llm_processor, 'summary_cache', SummaryCache())
+    monkeypatch.setattr(llm_processor, 'get_article_contexts', lambda news_items: {})
+    monkeypatch.setattr(llm_processor, '_backoff_seconds', lambda attempt: 0)
+
+    def run(model, news_items, blocking=False):
+        llm_processor.set_model(model)
+        try:
+            if blocking:
+                return llm_processor.get_batch_summaries(news_items, 'en')
+            return asyncio.run(llm_processor.get_batch_summaries_async(news_items, 'en'))
+        finally:
+            llm_processor.set_model(None)
+    return run
+
+
+NEWS_ITEMS = [{'title': f"Headline {i}", 'link': f"https://example.com/{i}"} for i in range(3)]
+
+
+@pytest.mark.parametrize('blocking', [False, True])
+def test_failed_batch_is_retried_as_a_whole(summarize, blocking):
+    model = ScriptedModel([RuntimeError('boom'), [0, 1, 2]])
+    results, llm_requests = summarize(model, NEWS_ITEMS, blocking)
+    assert model.calls == {'batch': 2, 'single': 0}
+    assert llm_requests == 2
+    assert all(not degraded for _, _, degraded in results.values())
+
+
+def test_batch_that_keeps_failing_is_degraded(summarize):
+    model = ScriptedModel([RuntimeError('boom')] * 3)
+    results, llm_requests = summarize(model, NEWS_ITEMS)
+    assert model.calls == {'batch': 3, 'single': 0}
+    assert llm_requests == 3
+    assert all(degraded for _, _, degraded in results.values())
+
+
+@pytest.mark.parametrize('blocking', [False, True])
+def test_missing_items_are_summarized_one_by_one(summarize, blocking):
+    model = ScriptedModel([[0, 2]])
+    results, llm_requests = summarize(model, NEWS_ITEMS, blocking)
+    assert model.calls == {'batch': 1, 'single': 1}
+    assert llm_requests == 2
+    assert results['https://example.com/1'] == ('ESSENCE: single\nIMPACT: Neutral\nFORECAST: flat', False, False)
+    assert results['https://example.com/0'][0].startswith('ESSENCE: batch')
+
+    # The summaries are cached: the same items need no request
+    assert summarize(ScriptedModel([]), NEWS_ITEMS)[1] == 0
@@ -0,0 +1,49 @@
+"""
+Tests of the metrics timers and of the protected /metrics route.
+"""
+
+import asyncio
+
+import pytest
+
+import config
+import metrics
+from app import app
+
+
+@pytest.fixture
+def histogram():
+    registry = metrics.MetricsRegistry()
+    return registry.histogram('test_seconds', 'Test latency', ('kind',))
+
+
+def test_timer_decorates_functions_and_coroutine_functions(histogram):
+    @histogram.time(kind='blocking')
+    def blocking():
+        return 'done'
+
+    @histogram.time(kind='async')
+    async def waiting():
+        await asyncio.sleep(0.05)
+        return 'done'
+
+    assert blocking() == 'done'
+    assert asyncio.run(waiting()) == 'done'
+    snapshot = histogram.snapshot()
+    assert {kind: series['count'] for kind, series in snapshot.items()} == {'blocking': 1, 'async': 1}
+    # The coroutine is timed until it finishes, not until it is created
+    assert snapshot['async']['sum'] >= 0.05
+
+
+@pytest.mark.parametrize('token, headers, status', [
+    (None, {'Authorization': 'Bearer secret'}, 404),
+    ('secret', {}, 403),
+    ('secret', {'Authorization': 'Bearer wrong'}, 403),
+    ('secret', {'Authorization': 'Bearer secret'}, 200),
+])
+def test_metrics_route_needs_the_token(database, monkeypatch, token, headers, status):
+    monkeypatch.setattr(config, 'METRICS_TOKEN', token)
+    response = app.test_client().get('/metrics', headers=headers)
+    assert response.status_code == status
+    if status == 200:
+        assert b'# TYPE' in response.data
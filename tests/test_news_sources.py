@@ -0,0 +1,197 @@
+"""
+Tests of the news source adapters and the aggregator against a local HTTP fixture server,
+without network access or API keys.
+
+The server serves canned RSS, NewsAPI and Alpha Vantage answers, plus a slow and a
+failing endpoint to exercise the per-source timeout and the circuit breaker.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+import news_sources
+from news_sources import (
+    RSSSource, NewsAPISource, AlphaVantageSource, NewsAggregator, NewsSource, build_sources, merge_news, normalize_link
+)
+
+RSS_FIXTURE = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>Headlines</title>
+<item><title>{ticker} beats earnings estimates</title><link>https://news.example.com/{ticker}/earnings</link>
+<guid>rss-1</guid><pubDate>Mon, 12 Oct 2026 14:00:00 GMT</pubDate></item>
+<item><title>{ticker} announces buyback</title><link>https://news.example.com/{ticker}/buyback?utm_source=rss</link>
+<guid>rss-2</guid><pubDate>Sun, 11 Oct 2026 09:30:00 GMT</pubDate></item>
+</channel></rss>"""
+
+
+def newsapi_fixture(ticker):
+    return {
+        'status': 'ok',
+        'articles': [
+            {'title': f"{ticker} shares rally", 'url': f"https://wire.example.com/{ticker}/rally",
+             'publishedAt': '2026-10-13T08:00:00Z', 'source': {'name': 'Wire'}},
+            # Same story as the RSS item, different query string: must be merged away
+            {'title': f"{ticker} announces buyback", 'url': f"https://news.example.com/{ticker}/buyback",
+             'publishedAt': '2026-10-11T09:30:00Z', 'source': {'name': 'News'}},
+        ],
+    }
+
+
+def alphavantage_fixture(ticker):
+    return {
+        'feed': [
+            {'title': f"{ticker} guidance raised", 'url': f"https://av.example.com/{ticker}/guidance",
+             'time_published': '20261012T180000', 'source': 'AV'},
+        ],
+    }
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.startswith('/rss/'):
+            self._send(200, RSS_FIXTURE.format(ticker=url.path.rsplit('/', 1)[-1]), 'application/rss+xml')
+        elif url.path == '/v2/everything':
+            self._send(200, json.dumps(newsapi_fixture(params['q'].strip('"'))), 'application/json')
+        elif url.path == '/query':
+            self._send(200, json.dumps(alphavantage_fixture(params['tickers'])), 'application/json')
+        elif url.path.startswith('/slow/'):
+            time.sleep(2)
+            self._send(200, RSS_FIXTURE.format(ticker='SLOW'), 'application/rss+xml')
+        else:
+            self._send(500, 'error', 'text/plain')
+
+
+class FailingSource(NewsSource):
+    name = 'failing'
+
+    def __init__(self, base_url):
+        super().__init__(timeout=1)
+        self.inner = RSSSource(f"{base_url}/fail/{{ticker}}", timeout=1)
+        self.calls = 0
+
+    def fetch(self, ticker):
+        self.calls += 1
+        return self.inner.fetch(ticker)
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_rss_adapter(base_url):
+    items = RSSSource(f"{base_url}/rss/{{ticker}}").fetch('AAPL')
+    assert len(items) == 2
+    assert items[0]['published'] == 1791813600
+    assert items[0]['source'] == 'rss' and items[0]['ticker'] == 'AAPL'
+
+
+def test_newsapi_adapter(base_url):
+    items = NewsAPISource('key', base_url=f"{base_url}/v2", names=lambda ticker: None).fetch('AAPL')
+    assert len(items) == 2
+    assert items[0]['source'] == 'newsapi'
+
+
+def test_newsapi_query():
+    names = {'F': 'Ford Motor Company', 'AAPL': 'Apple Inc.', 'BABA': 'Alibaba Group Holding Limited'}
+    source = NewsAPISource('key', names=names.get)
+    assert source.query('F') == '"Ford Motor"'
+    assert source.query('AAPL') == '"Apple"'
+    assert source.query('BABA') == '"Alibaba"'
+    assert source.query('ON') == '"ON"'
+
+
+def test_alphavantage_adapter(base_url):
+    items = AlphaVantageSource('key', base_url=base_url).fetch('AAPL')
+    assert len(items) == 1
+    assert items[0]['published'] == 1791828000
+
+
+def test_failing_endpoint_raises(base_url):
+    with pytest.raises(Exception):
+        RSSSource(f"{base_url}/fail/{{ticker}}").fetch('AAPL')
+
+
+def test_aggregator(base_url):
+    failing = FailingSource(base_url)
+    slow = RSSSource(f"{base_url}/slow/{{ticker}}", timeout=0.5)
+    slow.name = 'slow'
+    aggregator = NewsAggregator(
+        [RSSSource(f"{base_url}/rss/{{ticker}}"), NewsAPISource('key', base_url=f"{base_url}/v2", names=lambda ticker: None),
+         AlphaVantageSource('key', base_url=base_url), slow, failing],
+        failure_threshold=2, reset_timeout=60
+    )
+    try:
+        started = time.monotonic()
+        merged, answered = aggregator.fetch_items('AAPL')
+        elapsed = time.monotonic() - started
+        # The RSS and NewsAPI buyback stories are one item
+        assert len(merged) == 4
+        assert answered == 3
+        published = [item['published'] for item in merged]
+        assert published == sorted(published, reverse=True)
+        # The slow source is cut off by its timeout
+        assert elapsed < 1.5
+
+        aggregator.fetch('MSFT')
+        aggregator.fetch('TSLA')
+        assert failing.calls == 2
+        assert aggregator.breakers['failing'].is_open
+    finally:
+        aggregator.close()
+
+
+def test_normalize_link_drops_only_tracking_parameters():
+    assert normalize_link('HTTPS://News.example.com/story/?utm_source=rss&id=7&fbclid=x&page=2#top') == \
+        'https://news.example.com/story?id=7&page=2'
+    assert normalize_link('https://example.com/article?id=1') != normalize_link('https://example.com/article?id=2')
+    assert normalize_link('https://example.com/a?b=2&a=1&ref=home') == normalize_link('https://example.com/a/?a=1&b=2')
+
+
+def test_source_must_implement_fetch():
+    class IncompleteSource(NewsSource):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        IncompleteSource()
+
+
+def test_build_sources_skips_unknown_names_and_sources_without_a_key(monkeypatch):
+    monkeypatch.setattr(news_sources, 'NEWSAPI_KEY', None)
+    monkeypatch.setattr(news_sources, 'ALPHAVANTAGE_API_KEY', 'key')
+    sources = build_sources(['rss', 'newsapi', 'alphavantage', 'twitter', 'yfinance'])
+    assert [source.name for source in sources] == ['rss', 'alphavantage', 'yfinance']
+
+
+def test_merge_keeps_the_first_source_of_a_story():
+    rss = [{'link': 'https://news.example.com/a?utm_source=rss', 'source': 'rss', 'published': 100}, None]
+    newsapi = [
+        {'link': 'https://news.example.com/a/', 'source': 'newsapi', 'published': 100},
+        {'link': 'https://news.example.com/b', 'source': 'newsapi', 'published': None},
+        {'link': 'https://news.example.com/c', 'source': 'newsapi', 'published': 200},
+    ]
+    merged = merge_news([rss, newsapi])
+    assert [(item['link'], item['source']) for item in merged] == [
+        ('https://news.example.com/c', 'newsapi'), ('https://news.example.com/a?utm_source=rss', 'rss'),
+        ('https://news.example.com/b', 'newsapi'),
+    ]
@@ -0,0 +1,58 @@
+"""
+Tests of the per-ticker news store.
+"""
+
+import news_store
+from news_store import get_ticker_news, select_new_items
+
+
+def news_item(link, published):
+    return {'id': link, 'title': link.upper(), 'link': link, 'published': published, 'source': 'rss'}
+
+
+def test_select_new_items():
+    items = [news_item('c', 300), news_item('b', 200), news_item('a', 100)]
+    assert select_new_items(items, None, 2) == items[:2]
+    assert select_new_items(items, 150) == items[:2]
+    assert select_new_items(items, 300) == []
+
+
+def test_select_new_items_skips_undated_items():
+    items = [news_item('b', None), news_item('a', 100)]
+    assert select_new_items(items, 50) == [items[1]]
+
+
+def test_failed_fetch_is_not_recorded(database, monkeypatch):
+    monkeypatch.setattr(news_store.news_aggregator, 'fetch_items', lambda ticker: ([], 0))
+    assert get_ticker_news('AAPL') == ([], False)
+    assert database.get_news_fetched_at('AAPL') is None
+
+    monkeypatch.setattr(news_store.news_aggregator, 'fetch_items', lambda ticker: ([news_item('a', 100)], 1))
+    items, from_store = get_ticker_news('AAPL')
+    assert [item['link'] for item in items] == ['a'] and not from_store
+    assert database.get_news_fetched_at('AAPL') is not None
+
+    # Every source failing later serves the stored items
+    monkeypatch.setattr(news_store.news_aggregator, 'fetch_items', lambda ticker: ([], 0))
+    items, _ = get_ticker_news('AAPL', ttl_seconds=0)
+    assert [item['link'] for item in items] == ['a']
+
+
+def test_empty_answer_is_recorded(database, monkeypatch):
+    monkeypatch.setattr(news_store.news_aggregator, 'fetch_items', lambda ticker: ([], 1))
+    assert get_ticker_news('AAPL') == ([], False)
+    assert get_ticker_news('AAPL') == ([], True)
+
+
+def test_fallback_items_are_dated(database, monkeypatch):
+    def failing_save(ticker, items, fetched_at):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(news_store.news_aggregator, 'fetch_items', lambda ticker: (
+        [news_item('b', None), news_item('a', 100)], 1
+    ))
+    monkeypatch.setattr(news_store.db, 'save_news_items', failing_save)
+    items, _ = get_ticker_news('AAPL')
+    assert [item['link'] for item in items] == ['b', 'a']
+    assert all(item['published'] for item in items)
+    assert select_new_items(items, 100) == items[:1]
@@ -0,0 +1,96 @@
+"""
+Tests of the price alert worker and of the /alert arguments.
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+from telegram.error import Forbidden
+
+import price_alerts
+from app import parse_price_alert
+
+
+class FakeBot:
+    """
+    Records the sent messages; sending to a chat in `failing` raises `error`.
+    """
+
+    def __init__(self, failing=(), error=RuntimeError('Bad Gateway')):
+        self.failing = set(failing)
+        self.error = error
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id in self.failing:
+            raise self.error
+        self.sent.append(chat_id)
+
+
+@pytest.fixture
+def alerts(database, monkeypatch):
+    monkeypatch.setattr(
+        price_alerts, 'fetch_quotes', lambda symbols: (np.full(len(symbols), 20.0), np.full(len(symbols), 19.0))
+    )
+    database.add_or_update_users([(1, 'en'), (2, 'en')])
+    with database.get_db_connection() as conn:
+        conn.executemany(
+            'INSERT INTO price_alerts (chat_id, ticker, direction, level, created_at) VALUES (?, ?, ?, ?, 0)',
+            [(1, 'AAPL', 'above', 10), (1, 'MSFT', 'above', 15), (2, 'AAPL', 'above', 10)]
+        )
+    return database
+
+
+def armed(database):
+    rows = database.get_db_connection().execute('SELECT chat_id, ticker, armed FROM price_alerts ORDER BY id')
+    return [tuple(row) for row in rows]
+
+
+def test_alert_stays_armed_when_the_message_fails(alerts):
+    worker = price_alerts.PriceAlertWorker(FakeBot(failing={2}))
+    stats = asyncio.run(worker.tick())
+    assert stats == {'alerts_fired': 3, 'users_alerted': 1, 'users_blocked': 0, 'errors': 1}
+    assert armed(alerts) == [(1, 'AAPL', 0), (1, 'MSFT', 0), (2, 'AAPL', 1)]
+
+    stats = asyncio.run(worker.tick())
+    assert stats['alerts_fired'] == 1
+
+
+def test_alert_is_disarmed_after_max_send_attempts(alerts):
+    worker = price_alerts.PriceAlertWorker(FakeBot(failing={2}), max_send_attempts=3)
+    fired = [asyncio.run(worker.tick())['alerts_fired'] for _ in range(4)]
+    assert fired == [3, 1, 1, 0]
+    assert armed(alerts) == [(1, 'AAPL', 0), (1, 'MSFT', 0), (2, 'AAPL', 0)]
+
+
+def test_alerts_of_a_user_who_blocked_the_bot_are_skipped(alerts):
+    worker = price_alerts.PriceAlertWorker(FakeBot(failing={2}, error=Forbidden('bot was blocked by the user')))
+    stats = asyncio.run(worker.tick())
+    assert stats['users_blocked'] == 1
+    assert asyncio.run(worker.tick())['alerts_fired'] == 0
+
+    alerts.ensure_user(2)
+    assert asyncio.run(worker.tick())['alerts_fired'] == 1
+
+
+def test_users_alerted_counts_users_not_message_parts(alerts, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(price_alerts, 'format_alerts', lambda fired: 'x' * 5000)
+    stats = asyncio.run(price_alerts.PriceAlertWorker(bot).tick())
+    assert len(bot.sent) > 2
+    assert stats['users_alerted'] == 2
+
+
+@pytest.mark.parametrize('args', [
+    ['AAPL', 'above', 'inf'], ['AAPL', 'below', 'nan'], ['AAPL', 'inf%'], ['AAPL', '-1%'], ['AAPL', 'above', '0'],
+    ['AAPL', 'above'], ['AAPL', 'between', '10'],
+])
+def test_parse_price_alert_rejects_invalid_levels(args):
+    with pytest.raises(ValueError):
+        parse_price_alert(args)
+
+
+def test_parse_price_alert():
+    assert parse_price_alert(['aapl', 'above', '250']) == ('AAPL', 'above', 250.0)
+    assert parse_price_alert(['aapl', '5%']) == ('AAPL', 'move', 5.0)
@@ -0,0 +1,71 @@
+"""
+Tests of the local importance scoring: lexicon categories, TF-IDF distinctiveness and ranking.
+"""
+
+from scoring import DEFAULT_CATEGORY, MAX_SCORE, MIN_SCORE, rank_news, score_items, tokenize, top_k
+
+
+def titles(*headlines, ticker='AAPL'):
+    return [{'title': headline, 'ticker': ticker} for headline in headlines]
+
+
+def test_tokenize_adds_bigrams():
+    assert tokenize('Price Target raised') == ['price', 'target', 'raised', 'price target', 'target raised']
+
+
+def test_categories_come_from_the_lexicons():
+    scored = score_items(titles(
+        'Microsoft agrees to acquire Activision in takeover deal',
+        'AAPL quarterly earnings beats estimates',
+        'Analyst raises price target on the stock',
+        'Company holds annual picnic',
+    ))
+    assert [category for _, category in scored] == ['M&A', 'Earnings', 'Analyst', DEFAULT_CATEGORY]
+    assert all(MIN_SCORE <= score <= MAX_SCORE for score, _ in scored)
+
+
+def test_material_news_outranks_generic_roundups():
+    [fraud, roundup] = score_items(titles(
+        'SEC opens fraud investigation into AAPL accounting',
+        'Top 3 stocks to watch should you buy now',
+    ))
+    assert fraud[0] > roundup[0]
+    assert roundup[0] == MIN_SCORE
+
+
+def test_boilerplate_repeated_across_the_batch_scores_lower():
+    repeated = 'Shares move in morning trade'
+    distinct = 'Shares move on Vision Pro supply news'
+    scores = [score for score, _ in score_items(titles(repeated, repeated, repeated, distinct))]
+    assert scores[3] > scores[0] == scores[1] == scores[2]
+
+
+def test_headline_naming_its_ticker_scores_higher():
+    [named, other] = score_items([
+        {'title': 'TSLA unveils new model', 'ticker': 'TSLA'},
+        {'title': 'Rival unveils new model', 'ticker': 'TSLA'},
+    ])
+    assert named[0] == other[0] + 1
+
+
+def test_rank_news_sorts_each_ticker_best_first_and_keeps_ties_newest_first():
+    news = {
+        'AAPL': [
+            {'title': 'Apple shares little changed', 'link': 'a1'},
+            {'title': 'Apple faces antitrust lawsuit and SEC probe', 'link': 'a2'},
+            {'title': 'Apple shares little changed', 'link': 'a3'},
+        ],
+        'MSFT': [{'title': 'Microsoft announces acquisition of gaming studio', 'link': 'm1'}],
+    }
+    ranked = rank_news(news)
+    assert ranked['AAPL'][0]['category'] == 'Legal & Regulatory'
+    assert [news_item['link'] for news_item in ranked['AAPL']] == ['a2', 'a1', 'a3']
+    assert ranked['AAPL'][1]['score'] == ranked['AAPL'][2]['score']
+    assert ranked['MSFT'][0]['category'] == 'M&A'
+    assert 'score' not in news['AAPL'][0]
+
+
+def test_top_k_drops_items_below_the_minimum_score():
+    items = [{'link': str(score), 'score': score} for score in (3, 9, 1, 6)]
+    assert [news_item['link'] for news_item in top_k(items, 2)] == ['9', '6']
+    assert [news_item['link'] for news_item in top_k(items, 10, min_score=4)] == ['9', '6']
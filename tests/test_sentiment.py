@@ -0,0 +1,29 @@
+"""
+Tests of the impact parsing of the LLM summaries.
+"""
+
+import pytest
+
+from sentiment import parse_impact
+
+
+@pytest.mark.parametrize('summary, impact', [
+    ('ESSENCE: Record quarter.\nIMPACT: Positive\nFORECAST: Growth.', 1),
+    ('**ESSENCE:** Guidance cut.\n**IMPACT:** Negative\n**FORECAST:** Pressure.', -1),
+    ('**СУТЬ:** Без изменений.\n**ВЛИЯНИЕ:** Нейтральное\n**ПРОГНОЗ:** Боковик.', 0),
+    ('essence: Buyback.\nimpact: positive', 1),
+])
+def test_parse_impact(summary, impact):
+    assert parse_impact(summary) == impact
+
+
+def test_parse_impact_ignores_the_label_word_in_the_essence():
+    summary = '**ESSENCE:** The impact of new tariffs on margins is limited.\n**IMPACT:** Positive'
+    assert parse_impact(summary) == 1
+    summary = 'СУТЬ: Влияние пошлин ограничено.\nВЛИЯНИЕ: Негативное'
+    assert parse_impact(summary) == -1
+
+
+@pytest.mark.parametrize('summary', [None, '', 'ESSENCE: No impact line.', 'IMPACT: Unclear'])
+def test_parse_impact_without_a_valid_impact(summary):
+    assert parse_impact(summary) is None
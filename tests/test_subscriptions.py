@@ -0,0 +1,48 @@
+"""
+Tests of the streaming subscription scan of the digest.
+"""
+
+from subscriptions import TickerSymbols, iter_subscribers, build_ticker_index
+
+
+def subscribe(database, users):
+    database.add_or_update_users((chat_id, 'en') for chat_id in users)
+    for chat_id, tickers in users.items():
+        for ticker in tickers:
+            database.add_ticker_for_user(chat_id, ticker)
+
+
+def test_chunks_hold_complete_users_in_chat_id_order(database):
+    users = {chat_id: ['AAPL', 'MSFT', 'TSLA'][:chat_id % 3 + 1] for chat_id in range(-10, 40)}
+    subscribe(database, users)
+    database.ensure_user(1000)  # no subscriptions: not streamed
+
+    symbols = TickerSymbols()
+    chunks = list(iter_subscribers(chunk_size=7, symbols=symbols, page_size=3))
+    assert [len(chunk) for chunk in chunks] == [7] * 7 + [1]
+    streamed = [subscriber for chunk in chunks for subscriber in chunk]
+    assert [subscriber.chat_id for subscriber in streamed] == sorted(users)
+    for subscriber in streamed:
+        assert [symbols.names[ticker_id] for ticker_id in subscriber.ticker_ids] == users[subscriber.chat_id]
+
+
+def test_shards_split_the_users(database):
+    subscribe(database, {chat_id: ['AAPL'] for chat_id in range(100)})
+    shards = [
+        {subscriber.chat_id for chunk in iter_subscribers(shard=(index, 3), page_size=10) for subscriber in chunk}
+        for index in range(3)
+    ]
+    assert set().union(*shards) == set(range(100))
+    assert sum(len(shard) for shard in shards) == 100
+    for index, shard in enumerate(shards):
+        assert all(database.shard_key(chat_id) % 3 == index for chat_id in shard)
+
+
+def test_build_ticker_index(database):
+    subscribe(database, {1: ['AAPL', 'MSFT'], 2: ['MSFT'], 3: ['AAPL']})
+    symbols = TickerSymbols()
+    [chunk] = iter_subscribers(symbols=symbols)
+    index = build_ticker_index(chunk)
+    assert {symbols.names[ticker_id]: list(positions) for ticker_id, positions in index.items()} == {
+        'AAPL': [0, 2], 'MSFT': [0, 1]
+    }
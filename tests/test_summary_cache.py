@@ -0,0 +1,57 @@
+"""
+Tests of the two-tier summary cache: what a summary is keyed by, and when it expires.
+"""
+
+import time
+
+from summary_cache import SummaryCache, make_cache_key
+
+URL = 'https://example.com/a'
+
+
+def test_summary_is_only_reused_for_the_same_language_model_and_prompt(database):
+    cache = SummaryCache()
+    cache.put(URL, 'en', 'gemini', 'v1', 'summary')
+    assert cache.get(URL, 'en', 'gemini', 'v1') == 'summary'
+    assert cache.get(URL, 'ru', 'gemini', 'v1') is None
+    assert cache.get(URL, 'en', 'gemini-pro', 'v1') is None
+    assert cache.get(URL, 'en', 'gemini', 'v2') is None
+    assert cache.stats == {'memory_hits': 1, 'db_hits': 0, 'misses': 3, 'evictions': 0}
+    # The fields are separated, so shifting text between them does not collide
+    assert make_cache_key('a', 'bc', 'm', 'v') != make_cache_key('ab', 'c', 'm', 'v')
+
+
+def test_summary_is_shared_through_the_database(database):
+    SummaryCache().put_many({URL: 'summary'}, 'en', 'gemini', 'v1')
+    cache = SummaryCache()
+    assert cache.get_many([URL, 'https://example.com/b'], 'en', 'gemini', 'v1') == {URL: 'summary'}
+    assert cache.get(URL, 'en', 'gemini', 'v1') == 'summary'
+    assert cache.stats == {'memory_hits': 1, 'db_hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_expired_summary_is_a_miss_in_both_tiers(database):
+    cache = SummaryCache(ttl_seconds=3600)
+    cache.put(URL, 'en', 'gemini', 'v1', 'summary')
+    key = make_cache_key(URL, 'en', 'gemini', 'v1')
+    cache._remember(key, 'summary', time.time() - 7200)
+    with database.get_db_connection() as conn:
+        conn.execute("UPDATE news_cache SET timestamp = datetime('now', '-2 hours')")
+    assert cache.get(URL, 'en', 'gemini', 'v1') is None
+    assert cache.get_many([URL], 'en', 'gemini', 'v1') == {}
+    assert cache.stats['misses'] == 2
+    assert key not in cache._lru
+
+
+def test_eviction_drops_expired_and_surplus_rows(database):
+    cache = SummaryCache(ttl_seconds=3600, max_rows=2, evict_every=10 ** 6)
+    cache.put_many({f"https://example.com/{i}": str(i) for i in range(4)}, 'en', 'gemini', 'v1')
+    # Row 0 has expired, row 1 is the oldest of the rest
+    with database.get_db_connection() as conn:
+        conn.execute(
+            "UPDATE news_cache SET timestamp = datetime('now', '-' || (4 - processed_summary) || ' minutes')"
+        )
+        conn.execute("UPDATE news_cache SET timestamp = datetime('now', '-2 hours') WHERE processed_summary = '0'")
+    assert cache.evict() == 2
+    assert SummaryCache().get_many([f"https://example.com/{i}" for i in range(4)], 'en', 'gemini', 'v1') == {
+        'https://example.com/2': '2', 'https://example.com/3': '3'
+    }
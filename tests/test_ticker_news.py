@@ -0,0 +1,118 @@
+"""
+Tests of the /news snapshots: which answers are stored, and which pairs the worker refreshes.
+"""
+
+import asyncio
+
+import pytest
+
+import ticker_news
+from ticker_news import TickerNewsWorker, save_digest_snapshots
+
+NOW = 1_000_000.0
+
+
+class FakeBot:
+    """
+    Records the sent messages.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def news(database, monkeypatch):
+    """
+    Serves one scored story per ticker; the summaries of the links in `degraded` are degraded,
+    and fetching fails if `failing` is set.
+    """
+    state = {'fetched': [], 'degraded': set(), 'failing': False}
+
+    def get_ticker_news(ticker):
+        if state['failing']:
+            raise ConnectionError('yfinance is unreachable')
+        state['fetched'].append(ticker)
+        return [{'title': f"{ticker} earnings beat estimates", 'link': f"https://example.com/{ticker}",
+                 'published': NOW}], True
+
+    async def get_batch_summaries_async(news_items, language, lane=None):
+        return {
+            news_item['link']: (f"summary ({language})", False, news_item['link'] in state['degraded'])
+            for news_item in news_items
+        }, 1
+
+    monkeypatch.setattr(ticker_news, 'get_ticker_news', get_ticker_news)
+    monkeypatch.setattr(ticker_news, 'get_batch_summaries_async', get_batch_summaries_async)
+    return state
+
+
+def tick(worker, now=NOW):
+    return asyncio.run(worker.tick(now))
+
+
+def test_requested_news_is_sent_and_stored(database, news):
+    database.request_ticker_news('AAPL', 'en', 1, True, NOW)
+    database.request_ticker_news('AAPL', 'en', 2, False, NOW)
+    bot = FakeBot()
+    stats = tick(TickerNewsWorker(bot, prewarm_count=0))
+    assert stats['refreshed'] == 1 and stats['users_notified'] == 1
+    [(chat_id, text)] = bot.sent
+    assert chat_id == 1 and '*AAPL*' in text and 'summary (en)' in text
+    assert database.get_ticker_news_snapshot('AAPL', 'en') == (text, NOW)
+    assert database.take_ticker_news_requests(10) == []
+
+
+def test_degraded_answer_is_sent_but_not_stored(database, news):
+    news['degraded'].add('https://example.com/AAPL')
+    database.request_ticker_news('AAPL', 'en', 1, True, NOW)
+    bot = FakeBot()
+    tick(TickerNewsWorker(bot, prewarm_count=0))
+    assert len(bot.sent) == 1
+    assert database.get_ticker_news_snapshot('AAPL', 'en') is None
+
+
+def test_failed_refresh_tells_the_waiting_user(database, news):
+    news['failing'] = True
+    database.request_ticker_news('AAPL', 'en', 1, True, NOW)
+    bot = FakeBot()
+    stats = tick(TickerNewsWorker(bot, prewarm_count=0))
+    assert stats['errors'] == 1
+    assert bot.sent == [(1, 'Could not load the news of AAPL right now, please try again later.')]
+
+
+def test_prewarm_refreshes_only_missing_and_stale_snapshots(database, news):
+    database.add_or_update_users([(1, 'en'), (2, 'en'), (3, 'ru')])
+    database.add_subscriptions([(1, 'AAPL'), (2, 'AAPL'), (1, 'MSFT'), (3, 'TSLA')])
+    database.save_ticker_news_snapshots([
+        ('AAPL', 'en', 'fresh', NOW - 100), ('MSFT', 'en', 'stale', NOW - 2000),
+    ])
+    worker = TickerNewsWorker(FakeBot(), prewarm_count=10, prewarm_seconds=3600)
+    stats = tick(worker)
+    assert stats['prewarmed'] == 2
+    assert sorted(news['fetched']) == ['MSFT', 'TSLA']
+    assert database.get_ticker_news_snapshot('AAPL', 'en') == ('fresh', NOW - 100)
+    assert database.get_ticker_news_snapshot('TSLA', 'ru')[1] == NOW
+
+    # Within the pre-warm interval nothing is refreshed again
+    assert tick(worker, NOW + 60)['prewarmed'] == 0
+
+
+def test_digest_snapshots_skip_degraded_answers(database):
+    ranked = {
+        ticker: [{'title': f"{ticker} earnings beat", 'link': f"https://example.com/{ticker}", 'score': 8}]
+        for ticker in ('AAPL', 'MSFT', 'TSLA')
+    }
+    results = {'en': {
+        'https://example.com/AAPL': ('summary', False, False),
+        'https://example.com/MSFT': ('headline only', False, True),
+    }}
+    stored = save_digest_snapshots(ranked, [('AAPL', 'en'), ('MSFT', 'en'), ('TSLA', 'en')], results, NOW)
+    assert stored == 2
+    assert 'summary' in database.get_ticker_news_snapshot('AAPL', 'en')[0]
+    assert database.get_ticker_news_snapshot('MSFT', 'en') is None
+    # TSLA has no summary yet: its answer is stored with the headline only
+    assert database.get_ticker_news_snapshot('TSLA', 'en')[1] == NOW
@@ -0,0 +1,52 @@
+"""
+Tests of the queued processing of webhook updates.
+"""
+
+import threading
+
+import pytest
+
+from update_processor import UpdateProcessor
+
+
+class FakeApplication:
+    """
+    Records the processed updates; initialize() fails the given number of times first.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.initialized = 0
+        self.processed = []
+        self.done = threading.Event()
+
+    async def initialize(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Telegram is unreachable')
+        self.initialized += 1
+
+    async def process_update(self, update):
+        self.processed.append(update)
+        self.done.set()
+
+    async def shutdown(self):
+        pass
+
+
+def test_failed_start_up_is_retried_on_next_submit():
+    application = FakeApplication(failures=1)
+    processor = UpdateProcessor(lambda: application, workers=2, queue_size=2)
+
+    with pytest.raises(ConnectionError):
+        processor.submit('first')
+    assert not processor.running
+    assert processor.pending == 0
+
+    assert processor.submit('second')
+    assert application.done.wait(5)
+    processor.stop()
+    assert application.initialized == 1
+    assert application.processed == ['second']
+    assert processor.snapshot()['accepted'] == 1
+
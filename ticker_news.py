@@ -0,0 +1,229 @@
+"""
+On-demand news of one ticker (/news), served from pre-rendered snapshots.
+
+The answer to /news TICKER is rendered ahead of time and stored per (ticker, language) in the
+ticker_news table, so the web app answers with one primary-key lookup and never waits on
+yfinance or Gemini. Snapshots are written:
+- by the digest, for every (ticker, language) pair of the run, from the items it already
+  fetched, scored and summarized (no extra LLM requests);
+- by the TickerNewsWorker (run_alerts.py), which refreshes the pairs queued by the web app
+  on a miss or a stale answer, in the interactive LLM lane, and sends the result to the users
+  who were waiting for it;
+- by the same worker, which pre-warms the most followed pairs in the batch lane, so popular
+  tickers are answered at once even between digests.
+"""
+
+import asyncio
+import logging
+import time
+
+import database as db
+import metrics
+from config import (
+    TICKER_NEWS_ITEMS, TICKER_NEWS_REFRESH_BATCH, TICKER_NEWS_PREWARM_COUNT, TICKER_NEWS_PREWARM_SECONDS,
+    DIGEST_MIN_SCORE, TELEGRAM_RATE_LIMIT, TELEGRAM_PER_CHAT_INTERVAL
+)
+from delivery import DeliveryScheduler, PRIORITY_HIGH
+from llm_processor import get_batch_summaries_async, LANE_INTERACTIVE, LANE_BATCH, MODEL_NAME, PROMPT_VERSION
+from news_store import get_ticker_news
+from scoring import rank_news, top_k, format_score
+from summary_cache import summary_cache
+
+TICKER_NEWS_EVENTS = metrics.counter(
+    'ticker_news_events_total', 'On-demand news snapshots (from_digest, refreshed, prewarmed, pushed)', ('event',)
+)
+
+
+def render(ticker, news_items, results):
+    """
+    Builds the /news answer of a ticker.
+    :param news_items: scored items, best first
+    :param results: dict link -> (summary, from_cache, degraded) in the answer's language
+    :return: the message, or None if there are no items
+    """
+    if not news_items:
+        return None
+    parts = [f"📰 *{ticker}*: latest news\n"]
+    for news_item in news_items:
+        summary, _, _ = results.get(news_item['link'], (None, False, False))
+        parts.append(
+            f"*{news_item['title']}*\n"
+            + (f"{format_score(news_item)}\n" if 'score' in news_item else '')
+            + (f"{summary}\n" if summary else '')
+            + f"[Источник]({news_item['link']})\n"
+        )
+    return '\n'.join(parts)
+
+
+def is_degraded(news_items, results):
+    """
+    Whether an answer uses a degraded summary (see llm_processor.degraded_summary). Such answers
+    are not stored as snapshots, so the next request summarizes the items properly.
+    """
+    return any(results.get(news_item['link'], (None, False, False))[2] for news_item in news_items)
+
+
+def save_digest_snapshots(ranked_by_ticker, pairs, results_by_language, now=None):
+    """
+    Stores the /news answers of the (ticker, language) pairs of a digest run. Only summaries that
+    the run produced or that are in the summary cache are used: no LLM request is made.
+    :param ranked_by_ticker: dict ticker -> scored items, best first (see scoring.rank_news)
+    :param pairs: iterable of (ticker, language)
+    :param results_by_language: dict language -> dict link -> (summary, from_cache, degraded)
+    :return: number of snapshots stored
+    """
+    now = now or time.time()
+    chosen = {}
+    for ticker, language in pairs:
+        chosen[(ticker, language)] = top_k(ranked_by_ticker.get(ticker, []), TICKER_NEWS_ITEMS, DIGEST_MIN_SCORE)
+
+    by_language = {}
+    for (_, language), news_items in chosen.items():
+        results = results_by_language.get(language, {})
+        by_language.setdefault(language, set()).update(
+            news_item['link'] for news_item in news_items if news_item['link'] not in results
+        )
+    cached = {
+        language: summary_cache.get_many(links, language, MODEL_NAME, PROMPT_VERSION)
+        for language, links in by_language.items()
+    }
+
+    entries = []
+    for (ticker, language), news_items in chosen.items():
+        results = dict(results_by_language.get(language, {}))
+        results.update((link, (summary, True, False)) for link, summary in cached.get(language, {}).items())
+        if is_degraded(news_items, results):
+            continue
+        message = render(ticker, news_items, results)
+        if message:
+            entries.append((ticker, language, message, now))
+    db.save_ticker_news_snapshots(entries)
+    TICKER_NEWS_EVENTS.inc(len(entries), event='from_digest')
+    return len(entries)
+
+
+async def refresh(pairs, lane, now=None):
+    """
+    Fetches, scores and summarizes the news of (ticker, language) pairs and stores their snapshots.
+    Answers with degraded summaries are returned but not stored.
+    :param lane: LLM lane of the summaries (LANE_INTERACTIVE when a user is waiting)
+    :return: dict (ticker, language) -> message; pairs without news are missing
+    """
+    now = now or time.time()
+    tickers = sorted({ticker for ticker, _ in pairs})
+    fetched = await asyncio.gather(*(asyncio.to_thread(get_ticker_news, ticker) for ticker in tickers))
+    # Scored in one batch, so the items are ranked against each other as in the digest
+    ranked_by_ticker = rank_news({ticker: items for ticker, (items, _) in zip(tickers, fetched)})
+
+    chosen = {
+        (ticker, language): top_k(ranked_by_ticker.get(ticker, []), TICKER_NEWS_ITEMS, DIGEST_MIN_SCORE)
+        for ticker, language in pairs
+    }
+    by_language = {}
+    for (_, language), news_items in chosen.items():
+        by_language.setdefault(language, {}).update((news_item['link'], news_item) for news_item in news_items)
+    results_by_language = {}
+    for language, news_items in by_language.items():
+        results_by_language[language], _ = await get_batch_summaries_async(
+            list(news_items.values()), language, lane=lane
+        )
+
+    messages = {}
+    snapshots = []
+    for (ticker, language), news_items in chosen.items():
+        results = results_by_language.get(language, {})
+        message = render(ticker, news_items, results)
+        if message:
+            messages[(ticker, language)] = message
+            if not is_degraded(news_items, results):
+                snapshots.append((ticker, language, message, now))
+    db.save_ticker_news_snapshots(snapshots)
+    return messages
+
+
+class TickerNewsWorker:
+    """
+    Refreshes the /news snapshots queued by the web app and pre-warms the most followed tickers.
+    :param bot: telegram.Bot used to send refreshed news to the users waiting for it
+    """
+
+    def __init__(self, bot, prewarm_count=TICKER_NEWS_PREWARM_COUNT, prewarm_seconds=TICKER_NEWS_PREWARM_SECONDS):
+        self.bot = bot
+        self.prewarm_count = prewarm_count
+        self.prewarm_seconds = prewarm_seconds
+        self._prewarmed_at = 0.0
+
+    async def serve_requests(self, now, stats):
+        """
+        Refreshes the queued pairs and sends the results to the users who asked for them.
+        """
+        requests = db.take_ticker_news_requests(TICKER_NEWS_REFRESH_BATCH)
+        if not requests:
+            return
+        pairs = sorted({(ticker, language) for ticker, language, _, _ in requests})
+        try:
+            messages = await refresh(pairs, LANE_INTERACTIVE, now)
+            failed = False
+        except Exception as e:
+            logging.error(f"Error refreshing the news of {len(pairs)} tickers: {e}")
+            messages, failed = {}, True
+            stats['errors'] += 1
+        stats['refreshed'] += len(messages)
+        TICKER_NEWS_EVENTS.inc(len(messages), event='refreshed')
+
+        scheduler = DeliveryScheduler(self.bot, rate=TELEGRAM_RATE_LIMIT, per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL)
+        scheduler.start()
+        for ticker, language, chat_id, notify in requests:
+            if notify:
+                message = messages.get((ticker, language)) or (
+                    f"Could not load the news of {ticker} right now, please try again later." if failed
+                    else f"No recent news found for {ticker}."
+                )
+                scheduler.submit(chat_id, message, priority=PRIORITY_HIGH)
+        await scheduler.close()
+        stats['users_notified'] += scheduler.stats['sent']
+        stats['errors'] += scheduler.stats['failed']
+        TICKER_NEWS_EVENTS.inc(scheduler.stats['sent'], event='pushed')
+
+    async def prewarm(self, now, stats):
+        """
+        Refreshes the snapshots of the most followed pairs that are missing or older than half the pre-warm interval.
+        """
+        stale = [
+            (ticker, language) for ticker, language, built_at in db.get_popular_ticker_news(self.prewarm_count)
+            if built_at is None or now - built_at >= self.prewarm_seconds / 2
+        ]
+        if stale:
+            messages = await refresh(stale, LANE_BATCH, now)
+            stats['prewarmed'] += len(messages)
+            TICKER_NEWS_EVENTS.inc(len(messages), event='prewarmed')
+
+    async def tick(self, now=None):
+        """
+        Serves the queued refreshes, and pre-warms when the pre-warm interval has passed.
+        :return: dict with the statistics of the round
+        """
+        now = now or time.time()
+        stats = {'refreshed': 0, 'prewarmed': 0, 'users_notified': 0, 'errors': 0}
+        await self.serve_requests(now, stats)
+        if now - self._prewarmed_at >= self.prewarm_seconds:
+            self._prewarmed_at = now
+            await self.prewarm(now, stats)
+        if stats['refreshed'] or stats['prewarmed']:
+            logging.info(
+                f"Ticker news tick: {stats['refreshed']} refreshed, {stats['prewarmed']} pre-warmed, "
+                f"{stats['users_notified']} users notified, {stats['errors']} errors."
+            )
+        return stats
+
+    async def run_forever(self, tick_seconds):
+        """
+        Runs a round every tick_seconds.
+        """
+        while True:
+            started = time.monotonic()
+            try:
+                await self.tick()
+            except Exception as e:
+                logging.error(f"Error in ticker news tick: {e}")
+            await asyncio.sleep(max(0.0, tick_seconds - (time.monotonic() - started)))
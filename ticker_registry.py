@@ -0,0 +1,142 @@
+"""
+Local index of ticker symbols used to validate /add requests without network round trips.
+
+Validation results are kept in SQLite (ticker_registry table) and in memory, with separate
+time to live for valid and invalid symbols. Symbols loaded from a local list never expire.
+"""
+
+import csv
+import difflib
+import logging
+import threading
+import time
+
+import database as db
+from config import TICKER_VALID_TTL_SECONDS, TICKER_INVALID_TTL_SECONDS, TICKER_LIST_PATH
+
+# Source of an entry: checked online or loaded from the local symbol list
+SOURCE_ONLINE = 'online'
+SOURCE_FILE = 'file'
+
+
+class TickerRegistry:
+    """
+    In-memory symbol index backed by SQLite, with positive and negative caching.
+    :param checker: callable symbol -> (is_valid, name), or (None, None) if the
+        check itself failed (e.g. network error); such results are not cached.
+    """
+
+    def __init__(self, checker, valid_ttl=TICKER_VALID_TTL_SECONDS, invalid_ttl=TICKER_INVALID_TTL_SECONDS,
+                 symbol_file=TICKER_LIST_PATH):
+        self.checker = checker
+        self.valid_ttl = valid_ttl
+        self.invalid_ttl = invalid_ttl
+        self.symbol_file = symbol_file
+        self._index = None
+        self._valid_symbols = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        """
+        Loads the index from SQLite (and the optional symbol file) on first use.
+        """
+        if self._index is not None:
+            return
+        with self._lock:
+            if self._index is not None:
+                return
+            index = {}
+            try:
+                for symbol, is_valid, name, source, checked_at in db.get_ticker_registry():
+                    index[symbol] = (bool(is_valid), name, source, checked_at)
+            except Exception as e:
+                logging.error(f"Error loading the ticker registry: {e}")
+            self._index = index
+        if self.symbol_file:
+            self.load_symbol_file(self.symbol_file)
+
+    def load_symbol_file(self, path):
+        """
+        Loads a bulk symbol list: one SYMBOL[,NAME] per line, lines starting with # are skipped.
+        :return: the number of symbols loaded
+        """
+        self._ensure_loaded()
+        now = time.time()
+        entries = []
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.reader(f):
+                    if not row or not row[0].strip() or row[0].startswith('#'):
+                        continue
+                    name = row[1].strip() if len(row) > 1 else None
+                    entries.append((row[0].strip().upper(), 1, name, SOURCE_FILE, now))
+        except OSError as e:
+            logging.error(f"Error reading ticker list {path}: {e}")
+            return 0
+
+        db.save_ticker_registry_entries(entries)
+        with self._lock:
+            for symbol, is_valid, name, source, checked_at in entries:
+                self._index[symbol] = (True, name, source, checked_at)
+            self._valid_symbols = None
+        logging.info(f"Loaded {len(entries)} symbols from {path}.")
+        return len(entries)
+
+    def lookup(self, symbol):
+        """
+        Returns the cached validation result without any network call.
+        :return: True/False if a fresh result is known, otherwise None
+        """
+        self._ensure_loaded()
+        entry = self._index.get(symbol.upper())
+        if entry is None:
+            return None
+        is_valid, _, source, checked_at = entry
+        if source == SOURCE_FILE:
+            return is_valid
+        ttl = self.valid_ttl if is_valid else self.invalid_ttl
+        return is_valid if time.time() - checked_at < ttl else None
+
+    def name(self, symbol):
+        """
+        Returns the company name of a known valid symbol without any network call.
+        :return: the name, or None if it is not known
+        """
+        self._ensure_loaded()
+        entry = self._index.get(symbol.upper())
+        return entry[1] if entry and entry[0] else None
+
+    def validate(self, symbol):
+        """
+        Checks whether a ticker exists, going to the network only on a cache miss.
+        """
+        symbol = symbol.upper()
+        cached = self.lookup(symbol)
+        if cached is not None:
+            return cached
+
+        is_valid, name = self.checker(symbol)
+        if is_valid is None:
+            return False
+
+        entry = (symbol, int(is_valid), name, SOURCE_ONLINE, time.time())
+        try:
+            db.save_ticker_registry_entries([entry])
+        except Exception as e:
+            logging.error(f"Error saving ticker {symbol} to the registry: {e}")
+        with self._lock:
+            self._index[symbol] = (is_valid, name, SOURCE_ONLINE, entry[4])
+            if is_valid:
+                self._valid_symbols = None
+        return is_valid
+
+    def suggest(self, symbol, limit=3):
+        """
+        Returns up to `limit` known valid symbols similar to the given one ("did you mean").
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if self._valid_symbols is None:
+                self._valid_symbols = [s for s, entry in self._index.items() if entry[0]]
+            candidates = self._valid_symbols
+        return difflib.get_close_matches(symbol.upper(), candidates, n=limit, cutoff=0.6)
@@ -0,0 +1,183 @@
+"""
+Concurrent processing of webhook updates.
+
+Flask views are synchronous and have no running event loop, so updates cannot be handled
+with asyncio.create_task() inside the view. The UpdateProcessor owns one long-lived event loop
+in a background thread, initializes the PTB Application on it once and runs a pool of worker
+coroutines that take updates from a bounded queue. The webhook only enqueues the update and
+returns at once; when the queue is full submit() refuses the update, so the webhook can answer
+503 and Telegram delivers it again later.
+"""
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+import metrics
+from config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE
+
+# Number of recent handler latencies kept for the percentiles in snapshot()
+LATENCY_WINDOW = 10000
+
+UPDATE_SECONDS = metrics.histogram(
+    'update_processing_seconds', 'Time from queueing an update to the end of its handling', ('outcome',)
+)
+UPDATE_QUEUE_DEPTH = metrics.gauge('update_queue_depth', 'Updates queued or being handled')
+UPDATES_REJECTED = metrics.counter('updates_rejected_total', 'Updates refused because the queue was full')
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at the given fraction (0..1) of the sorted values, or 0.0 for no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class UpdateProcessor:
+    """
+    Runs application.process_update() for queued updates on a dedicated event loop.
+    :param application_factory: callable returning the telegram.ext.Application with the
+        handlers registered; it is called once, on first use of the application
+    """
+
+    def __init__(self, application_factory, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.application_factory = application_factory
+        self._application = None
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stats = {'accepted': 0, 'rejected': 0, 'processed': 0, 'failed': 0}
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._tasks = []
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._application_lock = threading.Lock()
+
+    @property
+    def application(self):
+        if self._application is None:
+            with self._application_lock:
+                if self._application is None:
+                    self._application = self.application_factory()
+        return self._application
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts the event loop thread and waits until the application is initialized.
+        Calling start() on a running processor does nothing. If the start-up fails the loop
+        is stopped again and the error is raised, so the next call starts from scratch.
+        """
+        with self._lock:
+            if self.running:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name='update-processor', daemon=True)
+            self._thread.start()
+            # Held under the lock, so concurrent submit() calls wait for the queue to exist
+            try:
+                asyncio.run_coroutine_threadsafe(self._startup(), self._loop).result()
+            except BaseException:
+                self._stop_loop()
+                self._queue = None
+                self._tasks = []
+                raise
+        logging.info(f"Update processor started with {self.workers} workers.")
+
+    async def _startup(self):
+        await self.application.initialize()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, update):
+        """
+        Queues an update for processing. Safe to call from any thread, never blocks.
+        :return: False if the queue is full and the update was not accepted
+        """
+        if not self.running:
+            self.start()
+        with self._lock:
+            if self._pending >= self.queue_size:
+                self.stats['rejected'] += 1
+                UPDATES_REJECTED.inc()
+                return False
+            # The pending counter guarantees that put_nowait() finds room in the queue
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, (update, time.monotonic()))
+            self._pending += 1
+            self.stats['accepted'] += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            update, queued_at = await self._queue.get()
+            try:
+                await self.application.process_update(update)
+                outcome = 'processed'
+            except Exception as e:
+                logging.error(f"Error processing update {getattr(update, 'update_id', None)}: {e}")
+                outcome = 'failed'
+            finally:
+                self._queue.task_done()
+            elapsed = time.monotonic() - queued_at
+            UPDATE_SECONDS.observe(elapsed, outcome=outcome)
+            with self._lock:
+                self._pending -= 1
+                self.stats[outcome] += 1
+                self.latencies.append(elapsed)
+
+    @property
+    def pending(self):
+        """
+        Number of queued or in-progress updates.
+        """
+        with self._lock:
+            return self._pending
+
+    def snapshot(self):
+        """
+        :return: copy of the counters with the queue depth and p50/p99 handler latency in seconds
+        """
+        with self._lock:
+            latencies = list(self.latencies)
+            snapshot = dict(self.stats, pending=self._pending)
+        snapshot['latency_p50'] = percentile(latencies, 0.50)
+        snapshot['latency_p99'] = percentile(latencies, 0.99)
+        return snapshot
+
+    def stop(self, timeout=10):
+        """
+        Waits up to timeout seconds for the queued updates, then stops the workers,
+        shuts the application down and stops the event loop.
+        """
+        if not self.running:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(timeout), self._loop).result()
+        self._stop_loop()
+        logging.info(f"Update processor stopped: {self.snapshot()}")
+
+    def _stop_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    async def _shutdown(self, timeout):
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Update processor stopped with {self._queue.qsize()} updates still queued.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.application.shutdown()